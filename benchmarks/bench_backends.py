@@ -0,0 +1,68 @@
+"""
+Load test of the lookup backends against a local mock server, without network access.
+
+A fixture of panos along a synthetic street grid is served by MockPanoServer with a fixed
+latency and failure rate. Sample points are looked up with the async HTTP backend through
+lookup pools of increasing size, and stored. Throughput, retries and server-side failures
+are reported for every run.
+
+Usage: python benchmarks/bench_backends.py [--n-points 2000] [--latency 0.05] [--failure-rate 0.02] [--client aiohttp]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from svdiscover import instrument
+from svdiscover.backends import AsyncHTTPBackend, MockPanoServer
+from svdiscover.database import StreetviewDB
+from svdiscover.lookup import PanoLookupPool
+from svdiscover.sampling import store_panos_from_sample_pts
+
+def street_grid_fixture(n_streets=20, spacing=1e-3, pano_spacing=1e-4, origin=(4.8, 52.3), seed=0):
+    """Panos every pano_spacing degrees along a square grid of streets, with random capture dates"""
+    rng = np.random.default_rng(seed)
+    along = np.arange(0, n_streets * spacing, pano_spacing)
+    across = np.arange(n_streets) * spacing
+    lons = np.concatenate([np.repeat(across, len(along)), np.tile(along, n_streets)]) + origin[0]
+    lats = np.concatenate([np.tile(along, n_streets), np.repeat(across, len(along))]) + origin[1]
+    years = rng.integers(2008, 2022, len(lons))
+    months = rng.integers(1, 13, len(lons))
+    return [{'panoid': f'mock_{i}', 'lat': float(lat), 'lon': float(lon), 'year': int(year), 'month': int(month)}
+            for i, (lat, lon, year, month) in enumerate(zip(lats, lons, years, months))]
+
+def sample_points(n_points, extent=0.02, origin=(4.8, 52.3), seed=1):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, extent, (n_points, 2)) + origin
+    return list(map(tuple, xy.tolist()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-points', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per mock response')
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--client', choices=['aiohttp', 'httpx'], default=None)
+    parser.add_argument('--n-workers', type=int, nargs='*', default=[1, 8, 32, 128])
+    args = parser.parse_args()
+
+    fixture = street_grid_fixture()
+    pts = sample_points(args.n_points)
+    print(f'{"workers":>8} {"seconds":>8} {"lookups/s":>10} {"retries":>8} {"503s":>6} {"stored":>8}')
+    with tempfile.TemporaryDirectory() as db_dir:
+        for n_workers in args.n_workers:
+            sv_db = StreetviewDB(os.path.join(db_dir, f'backends_{n_workers}.sqlite'), fast_mode=True)
+            sv_db.make_region_table('panos', set_target=True)
+            stats = instrument.enable()
+            with MockPanoServer(fixture, latency=args.latency, failure_rate=args.failure_rate) as server, \
+                 AsyncHTTPBackend(server.url, max_connections=n_workers, client=args.client) as backend, \
+                 PanoLookupPool(n_workers, lookup_func=backend, max_retries=10) as pool:
+                start = perf_counter()
+                store_panos_from_sample_pts(pts, 'mock', sv_db, pool=pool)
+                seconds = perf_counter() - start
+            instrument.disable()
+            n_stored = sv_db.cursor.execute('SELECT COUNT(*) FROM panos').fetchone()[0]
+            retries = stats.summary()['counters'].get('retries', 0)
+            print(f'{n_workers:>8} {seconds:>8.2f} {len(pts) / seconds:>10.1f} {retries:>8} {server.n_failures:>6} {n_stored:>8}')
+            sv_db.db.close()
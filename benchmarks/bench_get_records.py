@@ -0,0 +1,59 @@
+"""
+Benchmark of loading a region table into a dataframe: the original row-by-row loader
+against the columnar DatabaseHandler.get_records.
+
+The original loader parsed capture dates with a malformed format string, so it is timed here
+with the per-row parse it was meant to do ('%Y-%m').
+
+Usage: python benchmarks/bench_get_records.py [--n-rows 2000000] [--max-legacy-rows 1000000]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+
+from svdiscover.database import StreetviewDB
+from bench_inserts import synthetic_entries
+
+def legacy_get_records(sv_db):
+    """Original implementation of get_records, with the intended date format"""
+    records = [record for record in sv_db.cursor.execute(f'SELECT * FROM {sv_db.table}')]
+    headers = [x for x in sv_db.cursor.execute(f'PRAGMA table_info({sv_db.table})')]
+    pandas_dict = {}
+    for i,header in enumerate(headers):
+        pandas_dict[header[1]] = [row[i] for row in records]
+    table_df = pd.DataFrame(pandas_dict)
+    table_df['capture_date'] = table_df['capture_date'].apply(lambda x: pd.to_datetime(str(x), format='%Y-%m'))
+    return table_df
+
+def time_func(func, *args, **kwargs):
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    return perf_counter() - start, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-rows', type=int, nargs='+', default=[10**5, 10**6, 2 * 10**6])
+    parser.add_argument('--max-legacy-rows', type=int, default=10**6,
+                        help='Skip the original implementation above this number of rows')
+    args = parser.parse_args()
+
+    print(f'{"rows":>10} {"legacy (s)":>12} {"all columns (s)":>16} {"3 columns (s)":>14}')
+    for n_rows in args.n_rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sv_db = StreetviewDB(os.path.join(tmp_dir, 'bench.sqlite'), fast_mode=True)
+            sv_db.make_region_table('panos', set_target=True)
+            sv_db.add_entries(synthetic_entries(n_rows))
+
+            if n_rows <= args.max_legacy_rows:
+                legacy_time, _ = time_func(legacy_get_records, sv_db)
+                legacy_str = f'{legacy_time:12.2f}'
+            else:
+                legacy_str = f'{"skipped":>12}'
+            all_time, records = time_func(sv_db.get_records)
+            assert len(records) == n_rows
+            subset_time, _ = time_func(sv_db.get_records, columns=['pano_x', 'pano_y', 'capture_date'])
+            sv_db.db.close()
+        print(f'{n_rows:>10} {legacy_str} {all_time:16.2f} {subset_time:14.2f}')
@@ -0,0 +1,64 @@
+"""
+Benchmark of storing panorama records: one add_entry call per pano against
+StreetviewDB.add_entries, with and without the fast mode pragmas.
+
+Every variant writes synthetic pano rows into a fresh database file.
+
+Usage: python benchmarks/bench_inserts.py [--n-rows 1000000] [--commit-interval 1]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+from svdiscover.database import StreetviewDB
+
+def synthetic_entries(n_rows, n_subregions=100):
+    """Generates pano entries with unique ids spread over a number of subregions"""
+    for i in range(n_rows):
+        yield {'subregion_name': f'region_{i % n_subregions}',
+               'pano_id': f'pano_{i:012d}',
+               'capture_date': f'{2008 + i % 14}-{1 + i % 12}',
+               'anchor_x': 4.8 + (i % 1000) * 1e-4,
+               'anchor_y': 52.3 + (i // 1000) * 1e-4,
+               'pano_x': 4.8 + (i % 1000) * 1e-4 + 1e-5,
+               'pano_y': 52.3 + (i // 1000) * 1e-4 + 1e-5,
+               'lookup_date': '2021-01-01',
+               'download_date': '',
+               'saved_path': ''}
+
+def old_path(sv_db, entries, commit_interval):
+    """Inserts like store_panos_from_sample_pts used to: add_entry per pano, committing per sample point"""
+    for i, entry in enumerate(entries):
+        sv_db.add_entry(entry, manual_commit=True)
+        if i % commit_interval == 0:
+            sv_db.db.commit()
+    sv_db.db.commit()
+
+def new_path(sv_db, entries, commit_interval):
+    sv_db.add_entries(entries)
+
+def run(insert_func, n_rows, commit_interval, fast_mode):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sv_db = StreetviewDB(os.path.join(tmp_dir, 'bench.sqlite'), fast_mode=fast_mode)
+        sv_db.make_region_table('panos', set_target=True)
+        start = perf_counter()
+        insert_func(sv_db, synthetic_entries(n_rows), commit_interval)
+        elapsed = perf_counter() - start
+        n_stored = sv_db.cursor.execute('SELECT COUNT(*) FROM panos').fetchone()[0]
+        sv_db.db.close()
+    assert n_stored == n_rows
+    return elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-rows', type=int, default=10**6)
+    parser.add_argument('--commit-interval', type=int, default=3,
+                        help='Entries per commit for the old path, i.e. the number of panos found per sample point')
+    args = parser.parse_args()
+
+    print(f'{"path":<12} {"fast mode":<10} {"seconds":>10} {"rows/s":>12}')
+    for name, insert_func in [('add_entry', old_path), ('add_entries', new_path)]:
+        for fast_mode in [False, True]:
+            elapsed = run(insert_func, args.n_rows, args.commit_interval, fast_mode)
+            print(f'{name:<12} {str(fast_mode):<10} {elapsed:10.2f} {args.n_rows / elapsed:12.0f}')
@@ -0,0 +1,112 @@
+"""
+End-to-end benchmark of the discovery pipeline with per-stage instrumentation.
+
+Synthetic road buffers are sampled, reprojected and looked up against a stub of
+streetview.panoids with a configurable latency, then stored. Afterwards, pano tables
+of 10^4 to 10^7 generated rows are read back and summarized with the time statistics.
+The timings of every stage are printed, and can be written to a JSON log.
+
+Usage: python benchmarks/bench_pipeline.py [--n-polygons 10] [--latency 0.05] [--table-sizes 10000 100000] [--json-log log.jsonl]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+from time import sleep
+
+import shapely.affinity
+
+from svdiscover import instrument
+from svdiscover.database import StreetviewDB
+from svdiscover.lookup import PanoLookupPool
+from svdiscover.pano_funcs import xy_timestats
+from svdiscover.sampling import iter_sample_pts, store_panos_from_sample_pts
+from bench_inserts import synthetic_entries
+from bench_sampling import make_road_buffer
+
+RD_NEW_ORIGIN = (120000, 480000) # Somewhere in the Netherlands, so the polygons reproject to plausible coordinates
+
+class StubPanoids():
+    """Stand-in for streetview.panoids which waits for a fixed latency and returns deterministic panos.
+    A share of the calls fails, to exercise the retries.
+
+    Keyword Arguments:
+        latency {float} -- Seconds every call waits, mimicking the network round trip (default: {0.05})
+        max_panos {int} -- Maximum number of panos per sample point (default: {3})
+        failure_rate {float} -- Share of calls which raise an exception (default: {0.})
+    """
+    def __init__(self, latency=0.05, max_panos=3, failure_rate=0.):
+        self.latency = latency
+        self.max_panos = max_panos
+        self.failure_rate = failure_rate
+
+    def __call__(self, lat, lon):
+        sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError('Stub failure')
+        # Panos are shared between nearby sample points, like real panos which are found from several points
+        cell_lat, cell_lon = round(lat, 4), round(lon, 4)
+        rng = random.Random(hash((cell_lat, cell_lon)))
+        return [{'panoid': f'stub_{cell_lat}_{cell_lon}_{i}', 'lat': cell_lat, 'lon': cell_lon,
+                 'year': rng.randint(2008, 2021), 'month': rng.randint(1, 12)}
+                for i in range(rng.randint(0, self.max_panos))]
+
+def synthetic_polygons(n_polygons, n_cells, grid_resolution=20):
+    """Road buffers with roughly n_cells grid cells in their bounding box, in EPSG:28992 coordinates"""
+    return [shapely.affinity.translate(make_road_buffer(n_cells, grid_resolution, seed), *RD_NEW_ORIGIN)
+            for seed in range(n_polygons)]
+
+def run_discovery(sv_db, polygons, lookup_func, grid_resolution=20, n_workers=8):
+    with PanoLookupPool(n_workers, lookup_func=lookup_func, max_retries=10) as pool:
+        for i, poly in enumerate(polygons):
+            sample_pts = iter_sample_pts(poly, 'EPSG:28992', grid_resolution)
+            store_panos_from_sample_pts(sample_pts, f'polygon_{i}', sv_db, pool=pool)
+
+def run_table_stats(table_sizes, db_dir):
+    for n_rows in table_sizes:
+        sv_db = StreetviewDB(os.path.join(db_dir, f'table_{n_rows}.sqlite'), fast_mode=True)
+        sv_db.make_region_table('panos', set_target=True)
+        sv_db.add_entries(synthetic_entries(n_rows))
+        records = sv_db.get_records()
+        xy_timestats(records['pano_x'], records['pano_y'], records['capture_date'], tolerance=1e-5)
+        sv_db.db.close()
+
+def print_summary(summary):
+    print(f'{"stage":<14} {"calls":>8} {"total (s)":>10} {"mean (ms)":>10} {"rows":>10} {"rows/s":>12}')
+    for stage, stats in summary['stages'].items():
+        print(f'{stage:<14} {stats["calls"]:>8} {stats["seconds"]:>10.2f} {stats["mean_ms"]:>10.2f} '
+              f'{stats["rows"]:>10} {stats["rows_per_second"]:>12.0f}')
+    for counter, value in summary['counters'].items():
+        print(f'{counter:<14} {value:>8}')
+    print('Latency histograms (ms):')
+    for stage, stats in summary['stages'].items():
+        print(f'  {stage:<12} {json.dumps(stats["latency_ms_histogram"])}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-polygons', type=int, default=10)
+    parser.add_argument('--n-cells', type=int, default=10**4, help='Grid cells in the bounding box of every polygon')
+    parser.add_argument('--grid-resolution', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per stub lookup')
+    parser.add_argument('--failure-rate', type=float, default=0.01)
+    parser.add_argument('--n-workers', type=int, default=8)
+    parser.add_argument('--table-sizes', type=int, nargs='*', default=[10**4, 10**5, 10**6],
+                        help='Rows of the generated pano tables, up to 10^7')
+    parser.add_argument('--json-log', help='Write every timing event to this file as JSON lines')
+    args = parser.parse_args()
+
+    callbacks = [instrument.JsonLogger(args.json_log)] if args.json_log else []
+    stats = instrument.enable(callbacks)
+    with tempfile.TemporaryDirectory() as db_dir:
+        sv_db = StreetviewDB(os.path.join(db_dir, 'discovery.sqlite'), fast_mode=True)
+        sv_db.make_region_table('panos', set_target=True)
+        polygons = synthetic_polygons(args.n_polygons, args.n_cells, args.grid_resolution)
+        run_discovery(sv_db, polygons, StubPanoids(args.latency, failure_rate=args.failure_rate),
+                      args.grid_resolution, args.n_workers)
+        sv_db.db.close()
+        run_table_stats(args.table_sizes, db_dir)
+    instrument.disable()
+    for callback in callbacks:
+        callback.close()
+    print_summary(stats.summary())
@@ -0,0 +1,61 @@
+"""
+Benchmark of grid sampling in polygons: the original list + MultiPoint intersection
+approach against the vectorized svdiscover.sampling.grid_xy_in_poly.
+
+Polygons are synthetic concave road buffers in a metric coordinate system, scaled so that
+their bounding box holds 10^4 to 10^7 candidate grid cells.
+
+Usage: python benchmarks/bench_sampling.py [--max-legacy-cells 1000000]
+"""
+import argparse
+from math import floor, ceil, sqrt
+from time import perf_counter
+
+import numpy as np
+from shapely.geometry import LineString, MultiPoint
+
+from svdiscover.sampling import grid_xy_in_poly
+
+def legacy_sample_pts_in_poly(poly_geom, grid_resolution=20):
+    """Original implementation of sample_pts_in_poly, kept for comparison"""
+    xmin_orig, ymin_orig, xmax_orig, ymax_orig = poly_geom.bounds
+    xy_pairs = []
+    for x in range(floor(xmin_orig), ceil(xmax_orig), grid_resolution):
+        for y in range(floor(ymin_orig), ceil(ymax_orig), grid_resolution):
+            xy_pairs.append((x, y))
+    grid_points_in_extent = MultiPoint(xy_pairs)
+    return poly_geom.intersection(grid_points_in_extent)
+
+def make_road_buffer(n_cells, grid_resolution=20, seed=0):
+    """Zig-zagging road buffer whose bounding box holds roughly n_cells grid cells"""
+    side = sqrt(n_cells) * grid_resolution
+    rng = np.random.default_rng(seed)
+    xs = np.linspace(0, side, 25)
+    ys = rng.uniform(0, side, 25)
+    return LineString(np.column_stack([xs, ys])).buffer(side / 50)
+
+def time_func(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grid-resolution', type=int, default=20)
+    parser.add_argument('--max-legacy-cells', type=int, default=10**6,
+                        help='Skip the original implementation above this number of candidate cells')
+    args = parser.parse_args()
+
+    print(f'{"cells":>10} {"kept":>10} {"legacy (s)":>12} {"vectorized (s)":>15}')
+    for exponent in range(4, 8):
+        n_cells = 10 ** exponent
+        poly = make_road_buffer(n_cells, args.grid_resolution)
+
+        vector_time, xy = time_func(grid_xy_in_poly, poly, args.grid_resolution)
+        if n_cells <= args.max_legacy_cells:
+            legacy_time, legacy_pts = time_func(legacy_sample_pts_in_poly, poly, args.grid_resolution)
+            assert len(legacy_pts.geoms) == len(xy)
+            legacy_str = f'{legacy_time:12.3f}'
+        else:
+            legacy_str = f'{"skipped":>12}'
+        print(f'{n_cells:>10} {len(xy):>10} {legacy_str} {vector_time:15.3f}')
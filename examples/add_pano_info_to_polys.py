@@ -13,7 +13,7 @@ import streetview
 import geopandas as gpd
 import pandas as pd
 
-from svdiscover.pano_funcs import add_pano_stats_to_polygons
+from svdiscover.pano_funcs import add_pano_stats_to_polygons, add_pano_stats_to_all_polygons
 from svdiscover.database import StreetviewDB
 
 ## Region name
@@ -41,4 +41,10 @@ for col in ['earliest', 'earliest_year', 'latest', 'latest_year', 'mean_date', '
 poly_with_timestats = add_pano_stats_to_polygons(sv_db, region_poly)
 
 out_file = "output/neighbourhood_with_timestats.geojson"
-poly_with_timestats.to_file(out_file, driver="GeoJSON")
\ No newline at end of file
+poly_with_timestats.to_file(out_file, driver="GeoJSON")
+
+# Get panorama info for all polygons at once with a single spatial join
+polys_with_timestats = add_pano_stats_to_all_polygons(sv_db, poly_geoms[['postcode', 'geometry']])
+
+out_file = "output/postcodes_with_timestats.geojson"
+polys_with_timestats.to_file(out_file, driver="GeoJSON")
\ No newline at end of file
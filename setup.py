@@ -14,7 +14,8 @@ setup(
     author_email='alex.levering@wur.nl',
     license='MIT',
     packages=['svdiscover'],
-    install_requires=['geopandas'],
+    install_requires=['geopandas', 'numpy', 'shapely>=2.0'],
+    extras_require={'parquet': ['pyarrow'], 'async': ['aiohttp'], 'httpx': ['httpx']},
     zip_safe=False
 #     test_suite='nose.collector',
 #     tests_require=['nose'],
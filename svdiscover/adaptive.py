@@ -0,0 +1,215 @@
+from math import floor
+
+import numpy as np
+import shapely
+
+from svdiscover.database import RecordFilter
+from svdiscover.lookup import PanoLookupPool
+from svdiscover.sampling import prepared, reproject_xy, store_panos_from_sample_pts
+
+CHILD_OFFSETS = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]]) # Quadrants of a cell, in units of a quarter of the parent size
+CORNER_OFFSETS = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]]) # Corners of a cell, in units of half the cell size
+NEIGHBOUR_OFFSETS = np.array([[dx, dy] for dx in (-1, 0, 1) for dy in (-1, 0, 1)]) # A cell and its eight neighbours
+
+class CoverageIndex():
+    """Spatial hash of pano positions, used to tell which sample points would only return panos that are already known
+
+    Arguments:
+        radius {float} -- Distance in meters within which a sample point counts as covered by a pano
+    """
+    def __init__(self, radius):
+        self.radius = radius
+        self.cells = {}
+        self.xy_chunks = []
+
+    def _cell(self, x, y):
+        return floor(x / self.radius), floor(y / self.radius)
+
+    def add(self, x, y):
+        """Adds pano positions to the index
+
+        Arguments:
+            x {numpy.ndarray} -- X coordinates in the metric coordinate system of the sampling grid
+            y {numpy.ndarray} -- Y coordinates in the metric coordinate system of the sampling grid
+        """
+        for pano_x, pano_y in zip(x, y):
+            self.cells.setdefault(self._cell(pano_x, pano_y), []).append((pano_x, pano_y))
+        self.xy_chunks.append(np.column_stack([x, y]))
+
+    def covers(self, xy):
+        """Checks for every point whether a pano lies within the radius
+
+        Arguments:
+            xy {numpy.ndarray} -- Array of shape (n, 2) with points in the metric coordinate system of the sampling grid
+
+        Returns:
+            {numpy.ndarray} -- Boolean array, True where a point is covered
+        """
+        covered = np.zeros(len(xy), dtype=bool)
+        if not self.cells:
+            return covered
+        for i, (x, y) in enumerate(xy.tolist()):
+            cell_x, cell_y = self._cell(x, y)
+            covered[i] = any((pano_x - x) ** 2 + (pano_y - y) ** 2 <= self.radius ** 2
+                             for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                             for pano_x, pano_y in self.cells.get((cell_x + dx, cell_y + dy), ()))
+        return covered
+
+    def near_cells(self, centers, cell_size, origin):
+        """Checks for every cell of a grid whether a pano lies in the cell or in one of its eight neighbours
+
+        Arguments:
+            centers {numpy.ndarray} -- Array of shape (n, 2) with the centers of the cells
+            cell_size {float} -- Size of the cells
+            origin {tuple} -- Corner of the grid
+
+        Returns:
+            {numpy.ndarray} -- Boolean array, True where a pano lies in or next to a cell
+        """
+        if not self.xy_chunks or len(centers) == 0:
+            return np.zeros(len(centers), dtype=bool)
+        # Chunks are merged once per call rather than on every addition
+        self.xy_chunks = [np.concatenate(self.xy_chunks)]
+        pano_cells = np.floor((self.xy_chunks[0] - origin) / cell_size).astype(np.int64)
+        cells = np.floor((centers - origin) / cell_size).astype(np.int64)
+        neighbours = (cells[:, None, :] + NEIGHBOUR_OFFSETS).reshape(-1, 2)
+        # Structured views compare the (column, row) pairs as single values
+        pair = np.dtype([('col', np.int64), ('row', np.int64)])
+        is_occupied = np.isin(np.ascontiguousarray(neighbours).view(pair), np.ascontiguousarray(pano_cells).view(pair))
+        return is_occupied.reshape(len(cells), len(NEIGHBOUR_OFFSETS)).any(axis=1)
+
+def adaptive_store_panos(poly_geom, subregion_name, sv_db, in_proj, min_resolution=20, max_resolution=320,
+                         lookup_radius=50, coverage_radius=10, road_network=None, road_buffer=25, n_workers=1,
+                         requests_per_second=None, lookup_func=None, pool=None, cache=None):
+    """Retrieves panoramas in a polygon with a quadtree of sample points instead of a fixed grid, and stores them.
+    Sampling starts with a coarse grid of all cells that intersect the polygon, and every cell is looked up at the
+    point of the polygon nearest to its center. A cell is split into four, until the cells reach the minimum
+    resolution, unless its lookup returned no panos, the whole cell lies within the lookup radius of its sample
+    point and no known pano lies in the cell or its neighbours. Only cells that are known to be empty are therefore
+    left, which keeps the recall of a fixed grid at the minimum resolution.
+    Cells of which the sample point lies within the coverage radius of a known pano are not looked up, as their
+    lookup would return the same panos, but they are still split. Panos already stored for the subregion count as known.
+
+    Arguments:
+        poly_geom {Shapely geometry} -- Polygon in a metric coordinate system
+        subregion_name {str} -- Subregion name to fill in the region table
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a target table
+        in_proj {str} -- EPSG description of the coordinate system of the polygon
+
+    Keyword Arguments:
+        min_resolution {float} -- Size in meters of the smallest cells (default: {20})
+        max_resolution {float} -- Size in meters of the cells of the initial grid (default: {320})
+        lookup_radius {float} -- Distance in meters around a sample point within which a lookup returns panos (default: {50})
+        coverage_radius {float} -- Skip cells within this many meters of a known pano, None to disable (default: {10})
+        road_network {Shapely geometry} -- Roads in the coordinate system of the polygon. If given, cells that do
+                                           not lie within the road buffer are neither looked up nor split (default: {None})
+        road_buffer {float} -- Distance in meters from the road network within which cells are sampled (default: {25})
+        n_workers {int} -- Number of concurrent lookups (default: {1})
+        requests_per_second {float} -- Maximum request rate, None for no limit (default: {None})
+        lookup_func {callable} -- Replacement for streetview.panoids, e.g. a local stub (default: {None})
+        pool {PanoLookupPool} -- Existing lookup pool to use instead of n_workers & requests_per_second (default: {None})
+        cache {LookupCache} -- Cache of earlier lookups (default: {None})
+
+    Returns:
+        {int} -- Number of sample points that were looked up or taken from the cache
+    """
+    if pool is None and n_workers > 1:
+        with PanoLookupPool(n_workers, requests_per_second, lookup_func) as pool:
+            return adaptive_store_panos(poly_geom, subregion_name, sv_db, in_proj, min_resolution, max_resolution,
+                                        lookup_radius, coverage_radius, road_network, road_buffer, pool=pool, cache=cache)
+
+    roads = None
+    if road_network is not None:
+        roads = shapely.buffer(road_network, road_buffer)
+        shapely.prepare(roads)
+    poly_geom = prepared(poly_geom)
+    known_panos = CoverageIndex(coverage_radius or lookup_radius)
+    _add_stored_panos(known_panos, poly_geom, subregion_name, sv_db, in_proj)
+
+    cell_size = max_resolution
+    origin = np.floor(poly_geom.bounds[:2])
+    centers = _grid_cell_centers(poly_geom, cell_size, origin)
+    n_lookups = 0
+    while len(centers):
+        half_size = cell_size / 2
+        cells = shapely.box(centers[:, 0] - half_size, centers[:, 1] - half_size,
+                            centers[:, 0] + half_size, centers[:, 1] + half_size)
+        if roads is not None:
+            on_road = shapely.intersects(roads, cells)
+            centers, cells = centers[on_road], cells[on_road]
+
+        sample_xy = _nearest_in_poly(poly_geom, centers, cells)
+        # An empty lookup only proves a cell empty if the lookup radius reaches all of its corners. Larger cells are
+        # split regardless of their lookup, so they are only looked up at the finest level
+        corners = centers[:, None, :] + CORNER_OFFSETS * half_size
+        corner_dist = np.hypot(*(corners - sample_xy[:, None, :]).transpose(2, 0, 1)).max(axis=1)
+        is_in_reach = corner_dist <= lookup_radius
+        is_finest = cell_size / 2 < min_resolution
+        has_panos = np.zeros(len(centers), dtype=bool)
+        to_lookup = is_in_reach | is_finest
+        if coverage_radius:
+            is_covered = known_panos.covers(sample_xy)
+            has_panos[is_covered] = True
+            to_lookup &= ~is_covered
+
+        # Neighbouring cells can share their sample point, e.g. a vertex of the polygon, which is looked up once
+        lookup_idx = np.flatnonzero(to_lookup)
+        unique_xy, pt_of_cell = np.unique(sample_xy[lookup_idx], axis=0, return_inverse=True)
+        lon, lat = reproject_xy(unique_xy[:, 0], unique_xy[:, 1], in_proj)
+        sample_pts = list(map(tuple, np.column_stack([lon, lat]).tolist()))
+        pt_index = {sample_pt: i for i, sample_pt in enumerate(sample_pts)}
+        pt_has_panos = np.zeros(len(sample_pts), dtype=bool)
+
+        def on_result(sample_pt, panos):
+            if not panos:
+                return
+            pt_has_panos[pt_index[sample_pt]] = True
+            pano_x, pano_y = reproject_xy([pano['lon'] for pano in panos], [pano['lat'] for pano in panos],
+                                          'EPSG:4326', in_proj)
+            known_panos.add(np.atleast_1d(pano_x), np.atleast_1d(pano_y))
+
+        store_panos_from_sample_pts(sample_pts, subregion_name, sv_db, requests_per_second=requests_per_second,
+                                    lookup_func=lookup_func, pool=pool, cache=cache, on_result=on_result)
+        n_lookups += len(sample_pts)
+        has_panos[lookup_idx] |= pt_has_panos[pt_of_cell.ravel()]
+
+        if is_finest:
+            break
+        is_split = has_panos | ~is_in_reach | known_panos.near_cells(centers, cell_size, origin)
+        cell_size /= 2
+        centers = (centers[is_split, None, :] + CHILD_OFFSETS * cell_size / 2).reshape(-1, 2)
+        half_size = cell_size / 2
+        children = shapely.box(centers[:, 0] - half_size, centers[:, 1] - half_size,
+                               centers[:, 0] + half_size, centers[:, 1] + half_size)
+        centers = centers[shapely.intersects(poly_geom, children)]
+    return n_lookups
+
+def _grid_cell_centers(poly_geom, cell_size, origin):
+    """Centers of all cells of a grid that intersect the polygon"""
+    xmin, ymin, xmax, ymax = poly_geom.bounds
+    xs = origin[0] + cell_size * (np.arange(max(1, np.ceil((xmax - origin[0]) / cell_size))) + .5)
+    ys = origin[1] + cell_size * (np.arange(max(1, np.ceil((ymax - origin[1]) / cell_size))) + .5)
+    centers = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1).reshape(-1, 2)
+    half_size = cell_size / 2
+    cells = shapely.box(centers[:, 0] - half_size, centers[:, 1] - half_size, centers[:, 0] + half_size, centers[:, 1] + half_size)
+    return centers[shapely.intersects(poly_geom, cells)]
+
+def _nearest_in_poly(poly_geom, centers, cells):
+    """Sample point of every cell: its center if that lies in the polygon, else the nearest point of the polygon within the cell"""
+    sample_xy = centers.copy()
+    outside = ~shapely.intersects_xy(poly_geom, centers[:, 0], centers[:, 1])
+    if outside.any():
+        clipped = shapely.intersection(poly_geom, cells[outside])
+        nearest = shapely.shortest_line(clipped, shapely.points(centers[outside]))
+        sample_xy[outside] = shapely.get_coordinates(shapely.get_point(nearest, 0))
+    return sample_xy
+
+def _add_stored_panos(known_panos, poly_geom, subregion_name, sv_db, in_proj):
+    """Adds the panos that are already stored for the subregion within the bounds of the polygon to the index"""
+    xmin, ymin, xmax, ymax = poly_geom.bounds
+    lon, lat = reproject_xy(np.array([xmin, xmin, xmax, xmax]), np.array([ymin, ymax, ymin, ymax]), in_proj)
+    bbox = (min(lon), min(lat), max(lon), max(lat))
+    stored = sv_db.get_records(RecordFilter(bbox=bbox, subregions=subregion_name), columns=['pano_x', 'pano_y'])
+    if len(stored):
+        pano_x, pano_y = reproject_xy(stored['pano_x'].to_numpy(), stored['pano_y'].to_numpy(), 'EPSG:4326', in_proj)
+        known_panos.add(np.atleast_1d(pano_x), np.atleast_1d(pano_y))
@@ -0,0 +1,295 @@
+from math import ceil, floor
+
+import numpy as np
+import pandas as pd
+
+from svdiscover import instrument
+from svdiscover.database import CAPTURE_MONTH_SQL, months_to_datetime
+
+# Cell & month pairs are packed in one integer: the flat cell index in the high bits, the month number in the low bits
+MONTH_BITS = 16
+MONTH_MASK = (1 << MONTH_BITS) - 1
+NO_MONTH = np.iinfo(np.int32).max
+
+class GridAggregator():
+    """Availability statistics of panos binned into a fixed grid, built up chunk by chunk in a single pass.
+    Every cell keeps the number of panos, the earliest and latest capture month and the number of distinct
+    capture months. The distinct months are kept as sorted (cell, month) pairs, so that coarser grids can be
+    rolled up exactly from a finer grid without going back to the database.
+
+    Arguments:
+        bounds {tuple} -- Extent (xmin, ymin, xmax, ymax) of the grid. Points outside of it are ignored
+        cell_size {float} -- Size of the square cells, in the units of the coordinates
+
+    Keyword Arguments:
+        shape {tuple} -- Number of rows and columns of the grid, computed from the bounds if None (default: {None})
+    """
+    def __init__(self, bounds, cell_size, shape=None):
+        self.x_origin, self.y_origin = bounds[0], bounds[1]
+        self.cell_size = cell_size
+        if shape is None:
+            shape = (max(1, ceil((bounds[3] - bounds[1]) / cell_size)), max(1, ceil((bounds[2] - bounds[0]) / cell_size)))
+        self.n_rows, self.n_cols = shape
+        n_cells = self.n_rows * self.n_cols
+        self.count = np.zeros(n_cells, dtype=np.int64)
+        self.min_month = np.full(n_cells, NO_MONTH, dtype=np.int32)
+        self.max_month = np.zeros(n_cells, dtype=np.int32)
+        self._pairs = np.empty(0, dtype=np.int64)
+        self._pending_pairs = []
+
+    @property
+    def bounds(self):
+        return (self.x_origin, self.y_origin,
+                self.x_origin + self.n_cols * self.cell_size, self.y_origin + self.n_rows * self.cell_size)
+
+    def extend(self, bounds):
+        """Grows the grid by whole cells until it covers an extent. Existing cells keep their position and statistics.
+
+        Arguments:
+            bounds {tuple} -- Extent (xmin, ymin, xmax, ymax) to cover
+        """
+        xmin, ymin, xmax, ymax = bounds
+        add_cols = max(0, ceil((self.x_origin - xmin) / self.cell_size))
+        add_rows = max(0, ceil((self.y_origin - ymin) / self.cell_size))
+        # Rounding of the shifted origin may leave the minimum just outside of the grid
+        add_cols += floor((xmin - (self.x_origin - add_cols * self.cell_size)) / self.cell_size) < 0
+        add_rows += floor((ymin - (self.y_origin - add_rows * self.cell_size)) / self.cell_size) < 0
+        x_origin = self.x_origin - add_cols * self.cell_size
+        y_origin = self.y_origin - add_rows * self.cell_size
+        n_cols = max(self.n_cols + add_cols, floor((xmax - x_origin) / self.cell_size) + 1)
+        n_rows = max(self.n_rows + add_rows, floor((ymax - y_origin) / self.cell_size) + 1)
+        if (n_rows, n_cols) == (self.n_rows, self.n_cols):
+            return
+
+        def shift(cells):
+            rows, cols = np.divmod(cells, self.n_cols)
+            return (rows + add_rows) * n_cols + cols + add_cols
+
+        # Shifted cell indices keep their order, so the pairs stay sorted
+        cells = shift(np.arange(len(self.count)))
+        count = np.zeros(n_rows * n_cols, dtype=np.int64)
+        min_month = np.full(n_rows * n_cols, NO_MONTH, dtype=np.int32)
+        max_month = np.zeros(n_rows * n_cols, dtype=np.int32)
+        count[cells], min_month[cells], max_month[cells] = self.count, self.min_month, self.max_month
+        self._merge_pairs()
+        self._pairs = (shift(self._pairs >> MONTH_BITS) << MONTH_BITS) | (self._pairs & MONTH_MASK)
+        self.x_origin, self.y_origin = x_origin, y_origin
+        self.n_rows, self.n_cols = n_rows, n_cols
+        self.count, self.min_month, self.max_month = count, min_month, max_month
+
+    def add(self, x, y, capture_months):
+        """Bins a chunk of panos
+
+        Arguments:
+            x {array-like} -- X coordinates
+            y {array-like} -- Y coordinates
+            capture_months {array-like} -- Capture month numbers (year * 12 + month), panos without one are ignored
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        capture_months = np.asarray(capture_months, dtype=np.float64)
+        cols = np.floor((x - self.x_origin) / self.cell_size)
+        rows = np.floor((y - self.y_origin) / self.cell_size)
+        is_valid = ((cols >= 0) & (cols < self.n_cols) & (rows >= 0) & (rows < self.n_rows)
+                    & (capture_months >= 0) & (capture_months <= MONTH_MASK))
+        cells = rows[is_valid].astype(np.int64) * self.n_cols + cols[is_valid].astype(np.int64)
+        self._add_pairs((cells << MONTH_BITS) | capture_months[is_valid].astype(np.int64))
+
+    def _add_pairs(self, pair_keys):
+        """Merges the (cell, month) pair of every pano into the statistics"""
+        pair_keys, pair_counts = np.unique(pair_keys, return_counts=True)
+        if len(pair_keys) == 0:
+            return
+        # Pairs are sorted, so the months of every cell are contiguous and in ascending order
+        cells = pair_keys >> MONTH_BITS
+        months = (pair_keys & MONTH_MASK).astype(np.int32)
+        is_cell_start = np.ones(len(cells), dtype=bool)
+        is_cell_start[1:] = cells[1:] != cells[:-1]
+        starts = np.flatnonzero(is_cell_start)
+        ends = np.append(starts[1:], len(cells)) - 1
+        chunk_cells = cells[starts]
+
+        self.count[chunk_cells] += np.add.reduceat(pair_counts, starts)
+        self.min_month[chunk_cells] = np.minimum(self.min_month[chunk_cells], months[starts])
+        self.max_month[chunk_cells] = np.maximum(self.max_month[chunk_cells], months[ends])
+
+        # Pending pairs are merged once they outgrow the merged pairs, which keeps the total merging cost linearithmic
+        self._pending_pairs.append(pair_keys)
+        if sum(len(pairs) for pairs in self._pending_pairs) > len(self._pairs):
+            self._merge_pairs()
+
+    def _merge_pairs(self):
+        if self._pending_pairs:
+            self._pairs = np.unique(np.concatenate([self._pairs, *self._pending_pairs]))
+            self._pending_pairs = []
+
+    def num_months(self):
+        """Number of distinct capture months of every cell, as a flat array"""
+        self._merge_pairs()
+        return np.bincount(self._pairs >> MONTH_BITS, minlength=len(self.count))
+
+    def coarsen(self, factor=2):
+        """Rolls the grid up into cells that are factor times larger, without going back to the panos
+
+        Keyword Arguments:
+            factor {int} -- Number of cells along each side of a coarse cell (default: {2})
+
+        Returns:
+            {GridAggregator} -- Grid with the same origin and cells of factor times the cell size
+        """
+        coarse = GridAggregator(self.bounds, self.cell_size * factor, (ceil(self.n_rows / factor), ceil(self.n_cols / factor)))
+        fine_cells = np.flatnonzero(self.count)
+        coarse_cells = self._coarse_cells(fine_cells, factor, coarse.n_cols)
+        coarse.count = np.bincount(coarse_cells, self.count[fine_cells], minlength=len(coarse.count)).astype(np.int64)
+
+        # The months of every coarse cell follow from the pairs, which stay sorted by cell & month after unique
+        self._merge_pairs()
+        coarse_pairs = self._coarse_cells(self._pairs >> MONTH_BITS, factor, coarse.n_cols) << MONTH_BITS
+        coarse._pairs = np.unique(coarse_pairs | (self._pairs & MONTH_MASK))
+        if len(coarse._pairs) == 0:
+            return coarse
+        cells = coarse._pairs >> MONTH_BITS
+        months = (coarse._pairs & MONTH_MASK).astype(np.int32)
+        is_cell_start = np.ones(len(cells), dtype=bool)
+        is_cell_start[1:] = cells[1:] != cells[:-1]
+        starts = np.flatnonzero(is_cell_start)
+        coarse.min_month[cells[starts]] = months[starts]
+        coarse.max_month[cells[starts]] = months[np.append(starts[1:], len(cells)) - 1]
+        return coarse
+
+    def _coarse_cells(self, cells, factor, n_coarse_cols):
+        rows, cols = np.divmod(cells, self.n_cols)
+        return (rows // factor) * n_coarse_cols + cols // factor
+
+    def pyramid(self, n_levels):
+        """Rolls the grid up into zoom levels of which every level has cells twice as large as the previous one
+
+        Arguments:
+            n_levels {int} -- Number of coarser levels
+
+        Returns:
+            {list} -- This grid followed by the coarser GridAggregators
+        """
+        levels = [self]
+        for _ in range(n_levels):
+            levels.append(levels[-1].coarsen(2))
+        return levels
+
+    def to_arrays(self):
+        """Returns the statistics as rasters of shape (n_rows, n_cols). Row 0 is the southernmost row of cells.
+        Months are month numbers (year * 12 + month), 0 for cells without panos.
+
+        Returns:
+            {dict} -- Rasters of the pano count, earliest & latest capture month and number of distinct months
+        """
+        shape = (self.n_rows, self.n_cols)
+        return {'count': self.count.reshape(shape),
+                'min_month': np.where(self.count > 0, self.min_month, 0).reshape(shape),
+                'max_month': self.max_month.reshape(shape),
+                'num_months': self.num_months().reshape(shape)}
+
+    def to_table(self):
+        """Returns the statistics of all cells with panos as a table, with the center of every cell
+
+        Returns:
+            {pandas.DataFrame} -- One row per cell with col, row, x, y, count, min_time, max_time, month_timediff & num_timesteps
+        """
+        cells = np.flatnonzero(self.count)
+        rows, cols = np.divmod(cells, self.n_cols)
+        return pd.DataFrame({'col': cols,
+                             'row': rows,
+                             'x': self.x_origin + (cols + .5) * self.cell_size,
+                             'y': self.y_origin + (rows + .5) * self.cell_size,
+                             'count': self.count[cells],
+                             'min_time': months_to_datetime(self.min_month[cells]),
+                             'max_time': months_to_datetime(self.max_month[cells]),
+                             'month_timediff': self.max_month[cells] - self.min_month[cells],
+                             'num_timesteps': self.num_months()[cells]})
+
+    def save(self, out_path):
+        """Saves the grid, including the pairs needed for rolling up, to a compressed .npz file
+
+        Arguments:
+            out_path {str} -- Path of the output file
+        """
+        self._merge_pairs()
+        np.savez_compressed(out_path, bounds=np.array(self.bounds), cell_size=self.cell_size, shape=(self.n_rows, self.n_cols),
+                            count=self.count, min_month=self.min_month, max_month=self.max_month, pairs=self._pairs)
+
+    @classmethod
+    def load(cls, in_path):
+        """Loads a grid saved with save()
+
+        Arguments:
+            in_path {str} -- Path of the .npz file
+
+        Returns:
+            {GridAggregator} -- The loaded grid
+        """
+        with np.load(in_path) as arrays:
+            grid = cls(tuple(arrays['bounds']), float(arrays['cell_size']), tuple(arrays['shape']))
+            grid.count = arrays['count']
+            grid.min_month = arrays['min_month']
+            grid.max_month = arrays['max_month']
+            grid._pairs = arrays['pairs']
+        return grid
+
+def aggregate_grid(sv_db, cell_size, bounds=None, chunksize=100000):
+    """Bins all panos of the target table into a grid in a single streaming pass.
+    Panos that occur in several subregions are counted once. Without bounds, the grid starts at the first pano
+    and grows by whole cells to cover every chunk, so the extent needs no separate query.
+
+    Arguments:
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a target table
+        cell_size {float} -- Size of the grid cells in degrees
+
+    Keyword Arguments:
+        bounds {tuple} -- Extent (xmin, ymin, xmax, ymax) of the grid, defaults to the extent of all panos (default: {None})
+        chunksize {int} -- Number of panos read from the database at a time (default: {100000})
+
+    Returns:
+        {GridAggregator} -- Availability statistics of every grid cell
+    """
+    table = sv_db.table
+    if sv_db.is_normalized(table):
+        query = f'SELECT pano_x, pano_y, capture_month FROM {table}_panos'
+    else:
+        # Rows are read in primary key order, so grouping by pano ID needs no temporary index
+        query = f'SELECT pano_x, pano_y, {CAPTURE_MONTH_SQL} FROM {table} GROUP BY pano_id'
+
+    grid = GridAggregator(bounds, cell_size) if bounds is not None else None
+    cursor = sv_db.db.cursor()
+    try:
+        cursor.execute(query)
+        while True:
+            with instrument.timed('aggregate') as event:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    event['skipped'] = True
+                    break
+                xym = np.array(rows, dtype=np.float64)
+                if bounds is None:
+                    grid = _extend_to_chunk(grid, xym, cell_size)
+                if grid is not None:
+                    grid.add(xym[:, 0], xym[:, 1], xym[:, 2])
+                event['rows'] = len(rows)
+    finally:
+        cursor.close()
+    if grid is None:
+        grid = GridAggregator((0, 0, cell_size, cell_size), cell_size)
+    return grid
+
+def _extend_to_chunk(grid, xym, cell_size):
+    """Grows the grid to the extent of a chunk of panos with coordinates, starting a grid at the first of them"""
+    xy = xym[~np.isnan(xym[:, :2]).any(axis=1), :2]
+    if len(xy) == 0:
+        return grid
+    xmin, ymin = xy.min(axis=0)
+    xmax, ymax = xy.max(axis=0)
+    if grid is None:
+        # The first pano lies at the center of a cell, as panos on the edge of a cell could be binned differently
+        # once the origin is shifted
+        x, y = xy[0]
+        grid = GridAggregator((x - cell_size / 2, y - cell_size / 2, x + cell_size / 2, y + cell_size / 2), cell_size)
+    grid.extend((xmin, ymin, xmax, ymax))
+    return grid
@@ -0,0 +1,276 @@
+import abc
+import json
+import asyncio
+import logging
+import threading
+from math import cos, radians
+from zlib import crc32
+from time import sleep
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from svdiscover import instrument
+from svdiscover.cache import METERS_PER_DEGREE
+from svdiscover.lookup import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+class LookupBackend(abc.ABC):
+    """Interface of a panorama lookup. Backends are called like streetview.panoids, with keyword arguments lat & lon,
+    and return a list of panos with panoid, lat, lon and optionally year & month. They can therefore be passed as
+    lookup_func to any lookup, where they get the same retries, backoff and rate limiting.
+    Backends which can run many lookups at once also offer fetch_many, which a PanoLookupPool uses to hand them
+    whole batches of sample points."""
+    @abc.abstractmethod
+    def __call__(self, lat, lon):
+        """Looks up the panos of a coordinate pair
+
+        Arguments:
+            lat {float} -- Latitude in WGS84 coordinates
+            lon {float} -- Longitude in WGS84 coordinates
+
+        Returns:
+            {list} -- Panos in the format of streetview.panoids
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class StreetviewBackend(LookupBackend):
+    """Synchronous lookups through the streetview package, one blocking request per call"""
+    def __call__(self, lat, lon):
+        # Imported here so that the other backends can be used offline without the streetview package
+        import streetview
+        return streetview.panoids(lat=lat, lon=lon)
+
+class AsyncHTTPBackend(LookupBackend):
+    """Lookups against an HTTP endpoint which returns the panos of a coordinate pair, such as MockPanoServer.
+    Requests run on an event loop in a background thread and share one pooled client with keep-alive connections,
+    so many concurrent lookups need neither a thread nor a new connection each. A call blocks until its response
+    arrives, while fetch_many runs a whole batch of lookups concurrently on the event loop. A PanoLookupPool hands
+    the backend batches, so a few workers keep up to max_connections requests in flight.
+    Requires aiohttp or httpx, install them with `pip install svdiscover[async]`.
+
+    Arguments:
+        base_url {str} -- URL of the endpoint, which is queried with lat & lon parameters
+
+    Keyword Arguments:
+        max_connections {int} -- Maximum number of open connections (default: {100})
+        timeout {float} -- Timeout in seconds of a single request (default: {30})
+        parse_response {callable} -- Converts the response text to a list of panos (default: {json.loads})
+        client {str} -- HTTP client to use, 'aiohttp', 'httpx' or None for whichever is installed (default: {None})
+    """
+    def __init__(self, base_url, max_connections=100, timeout=30, parse_response=json.loads, client=None):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.parse_response = parse_response
+        self.client = client or self._installed_client()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session = asyncio.run_coroutine_threadsafe(self._make_session(), self.loop).result()
+
+    @staticmethod
+    def _installed_client():
+        for client in ('aiohttp', 'httpx'):
+            try:
+                __import__(client)
+                return client
+            except ImportError:
+                continue
+        raise ImportError('The async lookup backend requires aiohttp or httpx, install one with `pip install aiohttp`')
+
+    async def _make_session(self):
+        # Bounds the requests in flight over all batches, as the semaphore must be made on the event loop
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        if self.client == 'aiohttp':
+            import aiohttp
+            return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout))
+        import httpx
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout)
+
+    async def fetch(self, lat, lon):
+        """Looks up the panos of a coordinate pair on the event loop of the backend"""
+        # Numpy scalars are converted first, as their repr is 'np.float64(...)' since numpy 2
+        params = {'lat': str(float(lat)), 'lon': str(float(lon))}
+        if self.client == 'aiohttp':
+            async with self.session.get(self.base_url, params=params) as response:
+                response.raise_for_status()
+                text = await response.text()
+        else:
+            response = await self.session.get(self.base_url, params=params)
+            response.raise_for_status()
+            text = response.text
+        return self.parse_response(text)
+
+    def __call__(self, lat, lon):
+        return asyncio.run_coroutine_threadsafe(self.fetch(lat, lon), self.loop).result()
+
+    def fetch_many(self, sample_pts, max_retries=5, rate_limiter=None):
+        """Looks up a batch of sample points concurrently, with at most max_connections requests in flight.
+        Every sample point is retried with exponential backoff on its own, and is timed as one lookup.
+
+        Arguments:
+            sample_pts {list} -- Coordinate pairs in WGS84 coordinates
+
+        Keyword Arguments:
+            max_retries {int} -- Number of retries per sample point (default: {5})
+            rate_limiter {RateLimiter} -- Optional rate limiter consulted before every request (default: {None})
+
+        Returns:
+            {list} -- Panoids response of every sample point, in the order of the sample points
+        """
+        async def fetch_all():
+            return await asyncio.gather(*(self._fetch_with_backoff(sample_pt, max_retries, rate_limiter)
+                                          for sample_pt in sample_pts))
+        return asyncio.run_coroutine_threadsafe(fetch_all(), self.loop).result()
+
+    async def _fetch_with_backoff(self, sample_pt, max_retries, rate_limiter):
+        with instrument.timed('lookup') as event:
+            for attempt in range(max_retries + 1):
+                if rate_limiter is not None:
+                    # The rate limiter blocks, so it is waited for outside of the event loop
+                    await self.loop.run_in_executor(None, rate_limiter.acquire)
+                try:
+                    async with self.semaphore:
+                        panos = await self.fetch(lat=sample_pt[1], lon=sample_pt[0])
+                    event['rows'] = len(panos)
+                    return panos
+                except Exception as e:
+                    if attempt == max_retries:
+                        raise e
+                    delay = backoff_delay(attempt)
+                    instrument.count('retries')
+                    logger.warning('Querying error (%s), retrying in %.1f seconds', e, delay)
+                    await asyncio.sleep(delay)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        close = self.session.close() if self.client == 'aiohttp' else self.session.aclose()
+        asyncio.run_coroutine_threadsafe(close, self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 makes bursts of new connections wait for a retransmit, which takes a second
+    request_queue_size = 128
+
+class MockPanoServer():
+    """Local HTTP server which answers lookups from a fixture of panos, for testing and load-testing without network access.
+    GET [url]?lat=..&lon=.. returns the panos within the search radius as JSON, in the format of streetview.panoids.
+    Latency and failures are deterministic: whether a request fails with a 503 only depends on its coordinates and
+    on how often they were requested before, so retries of the same point eventually succeed.
+
+    Arguments:
+        fixture {str or list} -- Path of a JSON file with a list of panos, or the list itself. Every pano has a panoid,
+                                 lat & lon and optionally a year & month
+
+    Keyword Arguments:
+        search_radius {float} -- Radius in meters around the requested point in which panos are returned (default: {50})
+        latency {float} -- Seconds every response is delayed (default: {0.})
+        failure_rate {float} -- Share of requests which fail with a 503 (default: {0.})
+        host {str} -- Host to bind to (default: {'127.0.0.1'})
+        port {int} -- Port to bind to, 0 to pick a free port (default: {0})
+    """
+    def __init__(self, fixture, search_radius=50, latency=0., failure_rate=0., host='127.0.0.1', port=0):
+        if isinstance(fixture, str):
+            with open(fixture) as f:
+                fixture = json.load(f)
+        self.panos = fixture
+        self.lats = np.array([pano['lat'] for pano in fixture], dtype=np.float64)
+        self.lons = np.array([pano['lon'] for pano in fixture], dtype=np.float64)
+        self.search_radius = search_radius
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.n_requests = 0
+        self.n_failures = 0
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.server = _MockHTTPServer((host, port), self._make_handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/panoids'
+
+    def panos_near(self, lat, lon):
+        """Panos of the fixture within the search radius of a coordinate pair, nearest first"""
+        dy = (self.lats - lat) * METERS_PER_DEGREE
+        dx = (self.lons - lon) * METERS_PER_DEGREE * cos(radians(lat))
+        distances = np.hypot(dx, dy)
+        nearby = np.flatnonzero(distances <= self.search_radius)
+        return [self.panos[i] for i in nearby[np.argsort(distances[nearby], kind='stable')]]
+
+    def _should_fail(self, lat, lon):
+        with self.lock:
+            self.n_requests += 1
+            attempt = self.attempts.get((lat, lon), 0)
+            self.attempts[(lat, lon)] = attempt + 1
+        should_fail = crc32(f'{lat},{lon},{attempt}'.encode()) / 2 ** 32 < self.failure_rate
+        if should_fail:
+            with self.lock:
+                self.n_failures += 1
+        return should_fail
+
+    def _make_handler(self):
+        mock_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keeps connections alive between requests
+
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                try:
+                    lat, lon = float(query['lat'][0]), float(query['lon'][0])
+                except (KeyError, ValueError):
+                    return self._respond(400, b'lat and lon are required')
+                if mock_server.latency:
+                    sleep(mock_server.latency)
+                if mock_server._should_fail(lat, lon):
+                    return self._respond(503, b'Mock failure')
+                self._respond(200, json.dumps(mock_server.panos_near(lat, lon)).encode(), 'application/json')
+
+            def _respond(self, status, body, content_type='text/plain'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Serves requests from a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,123 @@
+import json
+from math import cos, radians
+from datetime import date, timedelta
+
+from svdiscover.database import RecordFilter
+
+METERS_PER_DEGREE = 111320 # Length of a degree of latitude, and of longitude at the equator
+
+class LookupCache():
+    """Persistent cache of panorama lookups, stored in a table of the panorama database.
+    Responses are keyed by their sample point rounded to a tolerance, so nearby sample points, re-runs after
+    a crash and runs at a different grid resolution reuse earlier lookups instead of querying the API again.
+
+    Arguments:
+        sv_db {StreetviewDB} -- Database in which the cache table is stored
+
+    Keyword Arguments:
+        table_name {str} -- Name of the cache table (default: {'lookup_cache'})
+        tolerance {float} -- Rounding step of the sample point coordinates in degrees, 1e-4 is roughly 10 meters (default: {1e-4})
+        ttl_days {int} -- Number of days after which a cached lookup expires, None to never expire (default: {None})
+        coverage_radius {float} -- Skip sample points within this many meters of a known pano of the same subregion in the
+                                   target table, None to disable (default: {None})
+    """
+    def __init__(self, sv_db, table_name='lookup_cache', tolerance=1e-4, ttl_days=None, coverage_radius=None):
+        self.sv_db = sv_db
+        self.table_name = table_name
+        self.tolerance = tolerance
+        self.ttl_days = ttl_days
+        self.coverage_radius = coverage_radius
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        sv_db.execute_cmd(f'''CREATE TABLE IF NOT EXISTS {table_name}
+                                (cell_x INTEGER,
+                                cell_y INTEGER,
+                                lookup_date VARCHAR,
+                                response VARCHAR,
+                                PRIMARY KEY (cell_x, cell_y)
+                                ) WITHOUT ROWID''')
+
+    def _cell(self, sample_pt):
+        return round(sample_pt[0] / self.tolerance), round(sample_pt[1] / self.tolerance)
+
+    def get(self, sample_pt):
+        """Looks up the cached response for a sample point
+
+        Arguments:
+            sample_pt {list} -- X and Y coordinate in WGS84 coordinates
+
+        Returns:
+            {tuple} -- The cached panoids response & its lookup date, or None if there is no fresh response
+        """
+        query = f'SELECT response, lookup_date FROM {self.table_name} WHERE cell_x = ? AND cell_y = ?'
+        if self.ttl_days is not None:
+            query += ' AND lookup_date >= ?'
+            params = [*self._cell(sample_pt), str(date.today() - timedelta(days=self.ttl_days))]
+        else:
+            params = self._cell(sample_pt)
+        cached = self.sv_db.cursor.execute(query, params).fetchone()
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(cached[0]), cached[1]
+
+    def put(self, sample_pt, panos, lookup_date=None, manual_commit=False):
+        """Stores a panoids response, replacing an older response for the same cell
+
+        Arguments:
+            sample_pt {list} -- X and Y coordinate in WGS84 coordinates
+            panos {list} -- Response of the panorama lookup
+
+        Keyword Arguments:
+            lookup_date {str} -- Date of the lookup, defaults to today (default: {None})
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """
+        self.sv_db.cursor.execute(f'INSERT OR REPLACE INTO {self.table_name} VALUES (?,?,?,?)',
+                                  [*self._cell(sample_pt), lookup_date or str(date.today()), json.dumps(panos)])
+        if not manual_commit:
+            self.sv_db.db.commit()
+
+    def is_covered(self, sample_pt, subregion_name=None):
+        """Checks whether a known pano of the target table lies within the coverage radius of a sample point.
+        Only panos stored for the same subregion count, so that panos of a point are stored for every subregion.
+
+        Arguments:
+            sample_pt {list} -- X and Y coordinate in WGS84 coordinates
+
+        Keyword Arguments:
+            subregion_name {str} -- Subregion of the sample point, None to count panos of all subregions (default: {None})
+
+        Returns:
+            {bool} -- True if the sample point does not need to be looked up
+        """
+        if not self.coverage_radius or not self.sv_db.table:
+            return False
+        radius_y = self.coverage_radius / METERS_PER_DEGREE
+        radius_x = radius_y / max(cos(radians(sample_pt[1])), 1e-6)
+        x, y = sample_pt[0], sample_pt[1]
+        record_filter = RecordFilter(bbox=(x - radius_x, y - radius_y, x + radius_x, y + radius_y), subregions=subregion_name)
+        where_clause, params = self.sv_db.compile_where(record_filter)
+        for pano_x, pano_y in self.sv_db.cursor.execute(f'SELECT pano_x, pano_y FROM {self.sv_db.table} WHERE {where_clause}', params):
+            if ((pano_x - x) / radius_x) ** 2 + ((pano_y - y) / radius_y) ** 2 <= 1:
+                return True
+        return False
+
+    def resolve(self, sample_pt, subregion_name=None):
+        """Returns the known response of a sample point, so that it does not need to be looked up.
+        Sample points within the coverage radius of a known pano of their subregion get an empty response.
+
+        Arguments:
+            sample_pt {list} -- X and Y coordinate in WGS84 coordinates
+
+        Keyword Arguments:
+            subregion_name {str} -- Subregion of the sample point (default: {None})
+
+        Returns:
+            {tuple} -- The cached panoids response & its lookup date, or None if the sample point needs to be looked up
+        """
+        if self.is_covered(sample_pt, subregion_name):
+            self.skipped += 1
+            return [], None
+        return self.get(sample_pt)
@@ -1,179 +1,956 @@
-import sqlite3
-import pandas as pd
-
-class DatabaseHandler():
-    """IMPORTANT NOTE: Don't use this code in production without cleaning inputs!
-    Sets up a SQLite database connection with simple functions.
-    Decorator reference: https://stackoverflow.com/questions/1263451/python-decorators-in-classes  
-    
-    Args:
-        db_root (string): Path to the database. 
-    """
-    def __init__(self, db_root):
-        self.db = sqlite3.connect(db_root)
-        self.cursor = self.db.cursor()
-        self.table = None
-
-    def _table_selected(func):
-        """Checks if self.table has been set for functions that require selecting a table
-        
-        Arguments:
-            func {Method} -- Function that uses table as input
-        """            
-        def inner(self, *args, **kwargs):
-            if not self.table:
-                raise AssertionError("No table selected. Set a table by setting [db_name].table")
-            else:
-                return func(self, *args, **kwargs)
-        return inner
-
-    def execute_cmd(self, command_str, manual_commit=False):
-        """Catch-all method for manually running commands
-        
-        Arguments:
-            command_str {str} -- String with SQL instructions
-        
-        Keyword Arguments:
-            manual_commit {bool} -- Commit after completing (default: {False})
-        """        
-        try:
-            self.cursor.execute(command_str)
-            if not manual_commit:
-                self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise e
-
-    @_table_selected
-    def remove_records(self, where_clause=False):
-        """Remove records from the target table
-        
-        Keyword Arguments:
-            where_clause {str} -- Optional where clause to limit deletion
-        """        
-        try:
-            if where_clause:
-                self.db.execute(f'DELETE FROM {self.table} WHERE {where_clause}')
-            else:
-                self.db.execute(f'DELETE * FROM {self.table}')
-            self.db.commit()
-        except sqlite3.IntegrityError as e:
-            print(f'Cannot delete record: {e}')
-    
-    @_table_selected
-    def get_records(self, where_clause=None):
-        """Select records from the target table
-        
-        Keyword Arguments:
-            where_clause {str} -- Optional where clause to limit selection (default: {None})
-        
-        Returns:
-            {list} -- List of lists containing all selected records
-        """        
-        try:
-            if where_clause:
-                records = [record for record in self.cursor.execute(f'SELECT * FROM {self.table} WHERE {where_clause}')]
-            else:
-                records = [record for record in self.cursor.execute(f'SELECT * FROM {self.table}')]
-            headers = [x for x in self.cursor.execute(f'PRAGMA table_info({self.table})')]
-            pandas_dict = {}
-            for i,header in enumerate(headers):
-                pandas_dict[header[1]] = [row[i] for row in records]
-            table_df = pd.DataFrame(pandas_dict)
-            table_df['capture_date'] = table_df['capture_date'].apply(lambda x: pd.to_datetime(str(x), format='%Y%m%'))
-            table_df.infer_objects()
-            return table_df
-        except sqlite3.IntegrityError as e:
-            print(f'Cannot load records: {e}')
-    
-    @_table_selected
-    def add_field(self, field_name, datatype):
-        """Adds a field to the target table
-        
-        Arguments:
-            field_name {str} -- Name of the new field
-            datatype {str} -- String of field's datatype in SQL syntax
-        """        
-        try:
-            self.db.execute(f'ALTER TABLE {self.table} ADD COLUMN {field_name} {datatype};')
-        except sqlite3.IntegrityError as e:
-            self.db.rollback()
-            print(f'Cannot add field: {e}')
-
-    _table_selected = staticmethod(_table_selected)
-
-class StreetviewDB(DatabaseHandler):
-    def __init__(self, db_root, verbose=False):
-        super().__init__(db_root)
-        self.verbose=verbose
-
-    def make_region_table(self, table_name, set_target=False):
-        """Makes a table to store streetview panorama information for a given region
-        
-        Arguments:
-            table_name {str} -- Name of the new region table
-        
-        Keyword Arguments:
-            set_target {bool} -- Make this table the target table for future functions? (default: {False})
-        """        
-        self.execute_cmd(f'''CREATE TABLE IF NOT EXISTS {table_name}
-                                (subregion_name VARCHAR,
-                                pano_id VARCHAR,
-                                capture_date VARCHAR,
-                                anchor_x REAL,
-                                anchor_y REAL,
-                                pano_x REAL,
-                                pano_y REAL,
-                                lookup_date VARCHAR,
-                                download_date VARCHAR,
-                                saved_path VARCHAR,
-                                PRIMARY KEY (pano_id, subregion_name)
-                                )''')
-        if set_target:
-            self.table = table_name
-
-    @DatabaseHandler._table_selected
-    def add_entry(self, entry, manual_commit=False):
-        """Stores a record in the target table
-        
-        Arguments:
-            entry {dict} -- dictionary containing entries for all table fields
-        
-        Keyword Arguments:
-            manual_commit {bool} -- Commit after completing (default: {False})
-        """            
-        try:
-            self.cursor.execute(f'INSERT INTO {self.table} VALUES (?,?,?,?,?,?,?,?,?,?)',
-                                    [
-                                        entry['subregion_name'],
-                                        entry['pano_id'],
-                                        entry['capture_date'],
-                                        entry['anchor_x'],
-                                        entry['anchor_y'],
-                                        entry['pano_x'],
-                                        entry['pano_y'],
-                                        entry['lookup_date'],
-                                        entry['download_date'],
-                                        entry['saved_path']
-                                    ]
-                            )
-            if not manual_commit:
-                self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            if 'UNIQUE constraint failed' in str(e):
-                if self.verbose:
-                    print(f'Duplicate entry for pano {entry["pano_id"]} ignored.')
-            else:
-                raise e
-
-    # def calculate_splits(self, table, field_name, split_probabilities, commit_interval=50):
-    #     records = self.get_all_records(table)
-    #     for i, record in enumerate(records):
-    #         split = determine_split(split_probabilities)
-    #         try:
-    #             self.db.execute(f'UPDATE {table} SET {field_name}=(?) WHERE img_id=(?)', [split, record[0]])
-    #             if i % commit_interval == 0 or i == len(records):
-    #                 self.db.commit()
-    #         except sqlite3.IntegrityError as e:
-    #             print(f'Cannot load records: {e}')
+import json
+import sqlite3
+from datetime import date
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from svdiscover import instrument
+
+PANO_FIELDS = ('subregion_name', 'pano_id', 'capture_date', 'anchor_x', 'anchor_y',
+               'pano_x', 'pano_y', 'lookup_date', 'download_date', 'saved_path')
+_entry_values = itemgetter(*PANO_FIELDS)
+# Columns of the pano table of normalized storage, which stores capture dates as integer months
+NORMALIZED_PANO_FIELDS = ('pano_id', 'capture_month', 'anchor_x', 'anchor_y', 'pano_x', 'pano_y',
+                          'lookup_date', 'download_date', 'saved_path')
+
+# Status of discovery job subregions and sample points
+PENDING, IN_FLIGHT, DONE = 0, 1, 2
+
+JobPoint = namedtuple('JobPoint', ['x', 'y', 'chunk_id', 'point_idx'])
+JobPoint.__doc__ = "Sample point registered in a discovery job, usable wherever an (x, y) pair is expected"
+
+def _capture_month_sql(column):
+    """SQL expression converting a column of 'YYYY-M' capture dates to integer month numbers (year * 12 + month)"""
+    return (f"CASE WHEN {column} LIKE '____-%' "
+            f"THEN CAST(substr({column}, 1, 4) AS INTEGER) * 12 + CAST(substr({column}, 6) AS INTEGER) END")
+
+CAPTURE_MONTH_SQL = _capture_month_sql('capture_date')
+# Converts integer month numbers back to 'YYYY-M' capture dates, for the legacy layout of normalized tables
+CAPTURE_DATE_SQL = ("CASE WHEN capture_month IS NOT NULL "
+                    "THEN ((capture_month - 1) / 12) || '-' || ((capture_month - 1) % 12 + 1) END")
+_MONTH_1970 = 1970 * 12 + 1
+
+def months_to_datetime(capture_months):
+    """Converts integer month numbers (year * 12 + month) to datetimes on the first of the month
+    
+    Arguments:
+        capture_months {array-like} -- Month numbers, missing values become NaT
+    
+    Returns:
+        {numpy.ndarray} -- Array of datetime64[ns] values
+    """
+    capture_months = np.asarray(capture_months, dtype=np.float64)
+    valid = ~np.isnan(capture_months)
+    dates = np.full(len(capture_months), np.datetime64('NaT'), dtype='datetime64[M]')
+    dates[valid] = (capture_months[valid] - _MONTH_1970).astype(np.int64).astype('datetime64[M]')
+    return dates.astype('datetime64[ns]')
+
+def capture_dates_to_months(capture_dates):
+    """Converts capture dates to month numbers (year * 12 + month) in one vectorized step
+    
+    Arguments:
+        capture_dates {array-like} -- Datetimes or 'YYYY-M' strings
+    
+    Returns:
+        {numpy.ndarray} -- Float array of month numbers, unparseable dates become NaN
+    """
+    capture_dates = pd.Series(capture_dates)
+    if pd.api.types.is_datetime64_any_dtype(capture_dates):
+        capture_months = capture_dates.dt.year * 12 + capture_dates.dt.month
+    else:
+        year_month = capture_dates.astype(str).str.split('-', n=1, expand=True).reindex(columns=[0, 1])
+        capture_months = (pd.to_numeric(year_month[0], errors='coerce') * 12
+                          + pd.to_numeric(year_month[1], errors='coerce'))
+    return capture_months.to_numpy(dtype=np.float64, na_value=np.nan)
+
+def to_capture_month(value):
+    """Converts a date to its month number (year * 12 + month)
+    
+    Arguments:
+        value {date, str or int} -- Date, 'YYYY-M' string or month number
+    
+    Returns:
+        {int} -- Month number of the date
+    """
+    if isinstance(value, date):
+        return value.year * 12 + value.month
+    if isinstance(value, str):
+        year, month = value.split('-')[:2]
+        return int(year) * 12 + int(month)
+    return int(value)
+
+class RecordFilter():
+    """Structured filter on pano records, compiled to parameterized SQL.
+    The SQL text only depends on which filters are set, not on their values, so SQLite can reuse the
+    prepared statement of repeated queries. Sets of values are passed as a single JSON parameter.
+
+    Keyword Arguments:
+        bbox {tuple} -- Bounding box (xmin, ymin, xmax, ymax) in which panos must lie (default: {None})
+        subregions {str or iterable} -- Name(s) of the subregions to select (default: {None})
+        date_range {tuple} -- Earliest and latest capture date as dates, 'YYYY-M' strings or month numbers.
+                              Either may be None for an open range (default: {None})
+        pano_ids {iterable} -- Pano IDs to select (default: {None})
+    """
+    def __init__(self, bbox=None, subregions=None, date_range=None, pano_ids=None):
+        self.bbox = bbox
+        self.subregions = [subregions] if isinstance(subregions, str) else subregions
+        self.date_range = date_range
+        self.pano_ids = pano_ids
+
+    def to_sql(self, table, use_rtree=False, month_sql=CAPTURE_MONTH_SQL, normalized=False):
+        """Compiles the filter to a where clause with placeholders
+
+        Arguments:
+            table {str} -- Name of the table to filter
+
+        Keyword Arguments:
+            use_rtree {bool} -- Preselect bounding box candidates with the R*Tree index of the table (default: {False})
+            month_sql {str} -- SQL expression for the capture month of a record (default: {CAPTURE_MONTH_SQL})
+            normalized {bool} -- The table is the legacy view of normalized storage, of which the R*Tree indexes
+                                 every pano once (default: {False})
+
+        Returns:
+            {tuple} -- Where clause and list of parameters. The clause is None when no filter is set
+        """
+        clauses, params = [], []
+        if self.bbox is not None:
+            xmin, ymin, xmax, ymax = [float(v) for v in self.bbox]
+            clauses.append('(pano_x BETWEEN ? AND ?) AND (pano_y BETWEEN ? AND ?)')
+            params += [xmin, xmax, ymin, ymax]
+            if use_rtree:
+                # The R*Tree stores 32-bit floats, so it preselects candidates and the exact test is done on the table
+                rtree_key = 'pano_id' if normalized else 'pano_id, subregion_name'
+                clauses.append(f'''({rtree_key}) IN
+                                (SELECT {rtree_key} FROM {table}_rtree
+                                WHERE max_x >= ? AND min_x <= ? AND max_y >= ? AND min_y <= ?)''')
+                params += [xmin, xmax, ymin, ymax]
+        if self.subregions is not None:
+            clauses.append('subregion_name IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(self.subregions)))
+        if self.date_range is not None:
+            start, end = self.date_range
+            if start is not None:
+                clauses.append(f'({month_sql}) >= ?')
+                params.append(to_capture_month(start))
+            if end is not None:
+                clauses.append(f'({month_sql}) <= ?')
+                params.append(to_capture_month(end))
+        if self.pano_ids is not None:
+            clauses.append('pano_id IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(self.pano_ids)))
+
+        if not clauses:
+            return None, []
+        return ' AND '.join(clauses), params
+
+class DatabaseHandler():
+    """IMPORTANT NOTE: Where clauses passed as strings are not sanitized! Use a RecordFilter for untrusted inputs.
+    Sets up a SQLite database connection with simple functions.
+    Decorator reference: https://stackoverflow.com/questions/1263451/python-decorators-in-classes  
+    
+    Args:
+        db_root (string): Path to the database. 
+        fast_mode (bool): Use WAL journaling, relaxed syncing, a larger page cache and in-memory temp storage.
+            Trades durability of the last transactions on power loss for much faster writes. Defaults to False.
+        cached_statements (int): Number of prepared statements kept by the connection for reuse. Defaults to 256.
+    """
+    def __init__(self, db_root, fast_mode=False, cached_statements=256):
+        self.db = sqlite3.connect(db_root, cached_statements=cached_statements)
+        self.cursor = self.db.cursor()
+        self.table = None
+        self._existing_tables = {}
+        if fast_mode:
+            self.set_fast_mode()
+
+    def set_fast_mode(self, cache_size_mb=256):
+        """Tunes SQLite pragmas for bulk loading
+        
+        Keyword Arguments:
+            cache_size_mb {int} -- Size of the page cache in megabytes (default: {256})
+        """
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        self.cursor.execute('PRAGMA synchronous=NORMAL')
+        self.cursor.execute(f'PRAGMA cache_size=-{int(cache_size_mb * 1024)}')
+        self.cursor.execute('PRAGMA temp_store=MEMORY')
+
+    def _table_selected(func):
+        """Checks if self.table has been set for functions that require selecting a table
+        
+        Arguments:
+            func {Method} -- Function that uses table as input
+        """            
+        def inner(self, *args, **kwargs):
+            if not self.table:
+                raise AssertionError("No table selected. Set a table by setting [db_name].table")
+            else:
+                return func(self, *args, **kwargs)
+        return inner
+
+    def execute_cmd(self, command_str, manual_commit=False):
+        """Catch-all method for manually running commands
+        
+        Arguments:
+            command_str {str} -- String with SQL instructions
+        
+        Keyword Arguments:
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """        
+        self._existing_tables.clear()
+        try:
+            self.cursor.execute(command_str)
+            if not manual_commit:
+                self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+    @contextmanager
+    def _transaction(self):
+        """Runs a block of statements atomically. Without an open transaction, the block runs in its own transaction
+        which is committed at the end. Inside a transaction of the caller, e.g. entries added with manual_commit,
+        the block runs in a savepoint: an error only undoes the block, and committing is left to the caller."""
+        if self.db.in_transaction:
+            self.cursor.execute('SAVEPOINT svdiscover_block')
+            try:
+                yield
+                self.cursor.execute('RELEASE svdiscover_block')
+            except Exception as e:
+                self.cursor.execute('ROLLBACK TO svdiscover_block')
+                self.cursor.execute('RELEASE svdiscover_block')
+                raise e
+            return
+        try:
+            self.cursor.execute('BEGIN')
+            yield
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+    @_table_selected
+    def remove_records(self, where_clause=False, params=(), remove_all=False):
+        """Remove records from the target table. Without a where clause, or with an empty RecordFilter,
+        nothing is removed unless all records are removed explicitly.
+        
+        Keyword Arguments:
+            where_clause {str or RecordFilter} -- Where clause to limit deletion
+            params {tuple} -- Values for the placeholders in a string where clause (default: {()})
+            remove_all {bool} -- Remove all records if no where clause is given (default: {False})
+        """        
+        where_clause, params = self.compile_where(where_clause, params)
+        if not where_clause and not remove_all:
+            raise ValueError('No where clause given, pass remove_all=True to remove all records')
+        try:
+            if where_clause:
+                self.db.execute(f'DELETE FROM {self.table} WHERE {where_clause}', params)
+            else:
+                self.db.execute(f'DELETE FROM {self.table}')
+            self.db.commit()
+        except sqlite3.IntegrityError as e:
+            print(f'Cannot delete record: {e}')
+    
+    @_table_selected
+    @instrument.instrumented('read', rows=len)
+    def get_records(self, where_clause=None, params=(), columns=None):
+        """Select records from the target table into a typed dataframe.
+        Capture dates are converted to datetimes inside the query, in one vectorized step.
+        
+        Keyword Arguments:
+            where_clause {str or RecordFilter} -- Optional where clause to limit selection (default: {None})
+            params {tuple} -- Values for the placeholders in a string where clause (default: {()})
+            columns {list} -- Names of the columns to select, all columns if None (default: {None})
+        
+        Returns:
+            {pandas.DataFrame} -- Dataframe containing all selected records
+        """        
+        where_clause, params = self.compile_where(where_clause, params)
+        try:
+            query = self._select_query(columns, where_clause)
+            table_df = pd.read_sql_query(query, self.db, params=params)
+            if 'capture_date' in table_df:
+                table_df['capture_date'] = months_to_datetime(table_df['capture_date'])
+            return table_df
+        except sqlite3.IntegrityError as e:
+            print(f'Cannot load records: {e}')
+
+    @_table_selected
+    def iter_records(self, chunksize=100000, columns=None, where=None, params=()):
+        """Lazily select records from the target table in dataframes of bounded size.
+        Rows are fetched from an open cursor chunk by chunk, so memory use does not grow with the table.
+        
+        Keyword Arguments:
+            chunksize {int} -- Maximum number of records per dataframe (default: {100000})
+            columns {list} -- Names of the columns to select, all columns if None (default: {None})
+            where {str or RecordFilter} -- Optional where clause to limit selection (default: {None})
+            params {tuple} -- Values for the placeholders in a string where clause (default: {()})
+        
+        Yields:
+            {pandas.DataFrame} -- Dataframe with at most chunksize records
+        """
+        where, params = self.compile_where(where, params)
+        query = self._select_query(columns, where)
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(query, params)
+            headers = [description[0] for description in cursor.description]
+            while True:
+                with instrument.timed('read') as event:
+                    records = cursor.fetchmany(chunksize)
+                    if not records:
+                        # The fetch which finds the cursor exhausted is not counted as a chunk
+                        event['skipped'] = True
+                        break
+                    table_df = pd.DataFrame.from_records(records, columns=headers, coerce_float=True)
+                    if 'capture_date' in table_df:
+                        table_df['capture_date'] = months_to_datetime(table_df['capture_date'])
+                    event['rows'] = len(table_df)
+                yield table_df
+        finally:
+            cursor.close()
+
+    def compile_where(self, where, params=()):
+        """Compiles a where clause for the target table, taking its layout and R*Tree index into account
+
+        Arguments:
+            where {str or RecordFilter} -- Filter to compile; string where clauses are passed through
+
+        Keyword Arguments:
+            params {tuple} -- Values for the placeholders in a string where clause (default: {()})
+
+        Returns:
+            {tuple} -- Where clause and parameters. The clause is None when no filter is set
+        """
+        if isinstance(where, RecordFilter):
+            is_normalized = self.is_normalized(self.table)
+            month_sql = 'capture_month' if is_normalized else CAPTURE_MONTH_SQL
+            return where.to_sql(self.table, use_rtree=where.bbox is not None and self.has_rtree(self.table),
+                                month_sql=month_sql, normalized=is_normalized)
+        return where, params
+
+    def has_rtree(self, table_name):
+        """Checks whether a table has an R*Tree index over its pano coordinates
+        
+        Arguments:
+            table_name {str} -- Name of the table
+
+        Returns:
+            {bool} -- True if the R*Tree index exists
+        """
+        return self._table_exists(f'{table_name}_rtree')
+
+    def is_normalized(self, table_name):
+        """Checks whether a table is the legacy layout view of normalized pano storage
+        
+        Arguments:
+            table_name {str} -- Name of the table
+
+        Returns:
+            {bool} -- True if the pano & membership tables of the view exist
+        """
+        return self._table_exists(f'{table_name}_members')
+
+    def _table_exists(self, table_name):
+        """Checks whether a table exists. The answer is cached until the schema is changed through this handler"""
+        if table_name not in self._existing_tables:
+            query = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
+            self._existing_tables[table_name] = self.cursor.execute(query, [table_name]).fetchone() is not None
+        return self._existing_tables[table_name]
+
+    def _select_query(self, columns=None, where_clause=None):
+        """Builds a SELECT statement on the target table, selecting capture dates as month numbers"""
+        is_normalized = self.is_normalized(self.table)
+        if columns is None and is_normalized:
+            columns = PANO_FIELDS + self._extra_pano_fields(self.table)
+        elif columns is None:
+            columns = [header[1] for header in self.cursor.execute(f'PRAGMA table_info({self.table})')]
+        month_sql = 'capture_month' if is_normalized else CAPTURE_MONTH_SQL
+        select_list = ', '.join(f'{month_sql} AS capture_date' if col == 'capture_date' else col
+                                for col in columns)
+        query = f'SELECT {select_list} FROM {self.table}'
+        if where_clause:
+            query += f' WHERE {where_clause}'
+        return query
+    
+    def _extra_pano_fields(self, table_name):
+        """Fields added with add_field to the pano table of normalized storage"""
+        pano_fields = [header[1] for header in self.cursor.execute(f'PRAGMA table_info({table_name}_panos)')]
+        return tuple(field for field in pano_fields if field not in NORMALIZED_PANO_FIELDS)
+
+    @_table_selected
+    def add_field(self, field_name, datatype):
+        """Adds a field to the target table. For normalized storage the field is added to the pano table,
+        and the legacy view is recreated to include it, atomically or in a savepoint of an open transaction.
+        
+        Arguments:
+            field_name {str} -- Name of the new field
+            datatype {str} -- String of field's datatype in SQL syntax
+        """        
+        if self.is_normalized(self.table):
+            with self._transaction():
+                self.cursor.execute(f'ALTER TABLE {self.table}_panos ADD COLUMN {field_name} {datatype}')
+                # Dropping the view also drops its triggers, which are recreated with the new field
+                self.cursor.execute(f'DROP VIEW {self.table}')
+                self._make_legacy_view(self.table)
+            return
+        try:
+            self.db.execute(f'ALTER TABLE {self.table} ADD COLUMN {field_name} {datatype};')
+        except sqlite3.IntegrityError as e:
+            self.db.rollback()
+            print(f'Cannot add field: {e}')
+
+    _table_selected = staticmethod(_table_selected)
+
+class StreetviewDB(DatabaseHandler):
+    def __init__(self, db_root, verbose=False, fast_mode=False):
+        super().__init__(db_root, fast_mode)
+        self.verbose=verbose
+        self.job_table = None
+
+    def make_region_table(self, table_name, set_target=False, spatial_index=None, normalized=False):
+        """Makes a table to store streetview panorama information for a given region
+        
+        Arguments:
+            table_name {str} -- Name of the new region table
+        
+        Keyword Arguments:
+            set_target {bool} -- Make this table the target table for future functions? (default: {False})
+            spatial_index {str} -- Index pano_x & pano_y with an 'rtree' or a composite 'btree' index (default: {None})
+            normalized {bool} -- Store every pano once, with the subregions it belongs to in a membership table.
+                                 The region table is then a view with the legacy layout. The pano table always
+                                 has a composite B-tree index, and an 'rtree' index is built on it (default: {False})
+        """        
+        self._existing_tables.clear()
+        if normalized:
+            try:
+                self._make_normalized_tables(table_name)
+                self._make_legacy_view(table_name)
+                self.db.commit()
+            except Exception as e:
+                self.db.rollback()
+                raise e
+            if spatial_index:
+                self.add_spatial_index(table_name, spatial_index)
+            if set_target:
+                self.table = table_name
+            return
+        self.execute_cmd(f'''CREATE TABLE IF NOT EXISTS {table_name}
+                                (subregion_name VARCHAR,
+                                pano_id VARCHAR,
+                                capture_date VARCHAR,
+                                anchor_x REAL,
+                                anchor_y REAL,
+                                pano_x REAL,
+                                pano_y REAL,
+                                lookup_date VARCHAR,
+                                download_date VARCHAR,
+                                saved_path VARCHAR,
+                                PRIMARY KEY (pano_id, subregion_name)
+                                )''')
+        if spatial_index:
+            self.add_spatial_index(table_name, spatial_index)
+        if set_target:
+            self.table = table_name
+
+    def _make_normalized_tables(self, table_name):
+        """Makes the pano, subregion and membership tables of normalized pano storage.
+        Panos are keyed by their ID with integer capture months, and the pano coordinates get a composite B-tree index."""
+        self.cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}_panos
+                                (pano_id VARCHAR PRIMARY KEY,
+                                capture_month INTEGER,
+                                anchor_x REAL,
+                                anchor_y REAL,
+                                pano_x REAL,
+                                pano_y REAL,
+                                lookup_date VARCHAR,
+                                download_date VARCHAR,
+                                saved_path VARCHAR
+                                ) WITHOUT ROWID''')
+        self.cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}_subregions
+                                (subregion_id INTEGER PRIMARY KEY,
+                                subregion_name VARCHAR UNIQUE
+                                )''')
+        self.cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}_members
+                                (subregion_id INTEGER,
+                                pano_id VARCHAR,
+                                PRIMARY KEY (subregion_id, pano_id)
+                                ) WITHOUT ROWID''')
+        self.cursor.execute(f'CREATE INDEX IF NOT EXISTS {table_name}_members_pano ON {table_name}_members (pano_id)')
+        self.cursor.execute(f'CREATE INDEX IF NOT EXISTS {table_name}_panos_xy ON {table_name}_panos (pano_x, pano_y)')
+
+    def _make_legacy_view(self, table_name):
+        """Makes a view of normalized pano storage with the columns of a region table, plus the capture month.
+        Inserts, updates of the download columns and of added fields, and deletes on the view are passed on to the
+        underlying tables."""
+        extra_fields = self._extra_pano_fields(table_name)
+        extra_select = ''.join(f', p.{field}' for field in extra_fields)
+        extra_insert = ''.join(f', {field}' for field in extra_fields)
+        extra_values = ''.join(f', new.{field}' for field in extra_fields)
+        extra_update = ''.join(f', {field} = new.{field}' for field in extra_fields)
+        self.cursor.execute(f'''CREATE VIEW IF NOT EXISTS {table_name} AS
+                                SELECT s.subregion_name, p.pano_id, {CAPTURE_DATE_SQL} AS capture_date,
+                                    p.anchor_x, p.anchor_y, p.pano_x, p.pano_y, p.lookup_date, p.download_date, p.saved_path,
+                                    p.capture_month{extra_select}
+                                FROM {table_name}_members m
+                                JOIN {table_name}_subregions s ON s.subregion_id = m.subregion_id
+                                JOIN {table_name}_panos p ON p.pano_id = m.pano_id''')
+        self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table_name}_insert INSTEAD OF INSERT ON {table_name} BEGIN
+                                    INSERT OR IGNORE INTO {table_name}_subregions (subregion_name) VALUES (new.subregion_name);
+                                    INSERT OR IGNORE INTO {table_name}_panos ({', '.join(NORMALIZED_PANO_FIELDS)}{extra_insert}) VALUES
+                                        (new.pano_id, {_capture_month_sql('new.capture_date')}, new.anchor_x, new.anchor_y,
+                                        new.pano_x, new.pano_y, new.lookup_date, new.download_date, new.saved_path{extra_values});
+                                    INSERT OR IGNORE INTO {table_name}_members
+                                        SELECT subregion_id, new.pano_id FROM {table_name}_subregions WHERE subregion_name = new.subregion_name;
+                                END''')
+        self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table_name}_update INSTEAD OF UPDATE OF download_date, saved_path{extra_insert} ON {table_name} BEGIN
+                                    UPDATE {table_name}_panos SET download_date = new.download_date, saved_path = new.saved_path{extra_update}
+                                    WHERE pano_id = old.pano_id;
+                                END''')
+        self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table_name}_delete INSTEAD OF DELETE ON {table_name} BEGIN
+                                    DELETE FROM {table_name}_members WHERE pano_id = old.pano_id AND subregion_id =
+                                        (SELECT subregion_id FROM {table_name}_subregions WHERE subregion_name = old.subregion_name);
+                                    DELETE FROM {table_name}_panos WHERE pano_id = old.pano_id
+                                        AND NOT EXISTS (SELECT 1 FROM {table_name}_members WHERE pano_id = old.pano_id);
+                                END''')
+
+    def normalize_region_table(self, table_name):
+        """Migrates a region table to normalized pano storage in a single transaction, or in a savepoint when the caller
+        has a transaction open.
+        The region table is replaced by a view with the same name and columns, so existing queries keep working.
+        Of panos that occur in several subregions, the copy which has been downloaded is kept. An R*Tree index of
+        the region table is rebuilt on the pano table.
+        
+        Arguments:
+            table_name {str} -- Name of the region table
+        """
+        if self.is_normalized(table_name):
+            return
+        try:
+            with self._transaction():
+                self._make_normalized_tables(table_name)
+                self.cursor.execute(f'''INSERT OR IGNORE INTO {table_name}_subregions (subregion_name)
+                                        SELECT DISTINCT subregion_name FROM {table_name} ORDER BY subregion_name''')
+                self.cursor.execute(f'''INSERT OR IGNORE INTO {table_name}_panos
+                                        SELECT pano_id, {CAPTURE_MONTH_SQL}, anchor_x, anchor_y, pano_x, pano_y,
+                                            lookup_date, download_date, saved_path
+                                        FROM {table_name} ORDER BY pano_id, saved_path DESC''')
+                self.cursor.execute(f'''INSERT OR IGNORE INTO {table_name}_members
+                                        SELECT s.subregion_id, t.pano_id FROM {table_name} t
+                                        JOIN {table_name}_subregions s ON s.subregion_name = t.subregion_name''')
+                has_rtree = self.has_rtree(table_name)
+                if has_rtree:
+                    self.cursor.execute(f'DROP TABLE {table_name}_rtree')
+                self.cursor.execute(f'DROP TABLE {table_name}')
+                self._make_legacy_view(table_name)
+                if has_rtree:
+                    self._make_pano_rtree(table_name)
+        finally:
+            self._existing_tables.clear()
+
+    def add_spatial_index(self, table_name, kind='rtree'):
+        """Indexes the pano coordinates of a region table. Existing records are added to the index.
+        An R*Tree is kept in sync with the region table through triggers and is best for bounding box queries on large tables.
+        A composite B-tree index over (pano_x, pano_y) is lighter, but only narrows down the X-range of a query.
+        Of normalized storage the pano table is indexed, which always has a B-tree index.
+        
+        Arguments:
+            table_name {str} -- Name of the region table
+        
+        Keyword Arguments:
+            kind {str} -- Type of index, either 'rtree' or 'btree' (default: {'rtree'})
+        """
+        is_normalized = self.is_normalized(table_name)
+        if kind == 'btree' and is_normalized:
+            return
+        elif kind == 'btree':
+            self.execute_cmd(f'CREATE INDEX IF NOT EXISTS {table_name}_pano_xy ON {table_name} (pano_x, pano_y)')
+            return
+        elif kind != 'rtree':
+            raise ValueError(f"Unknown spatial index '{kind}', use 'rtree' or 'btree'")
+        if self.has_rtree(table_name):
+            return
+        self._existing_tables.clear()
+        if is_normalized:
+            try:
+                self._make_pano_rtree(table_name)
+                self.db.commit()
+            except Exception as e:
+                self.db.rollback()
+                raise e
+            return
+
+        # The primary key is stored in auxiliary columns rather than relying on rowids, which VACUUM may renumber
+        rtree = f'{table_name}_rtree'
+        try:
+            self.cursor.execute(f'CREATE VIRTUAL TABLE {rtree} USING rtree(id, min_x, max_x, min_y, max_y, +pano_id, +subregion_name)')
+            self.cursor.execute(f'''CREATE TRIGGER {rtree}_insert AFTER INSERT ON {table_name} BEGIN
+                                        INSERT INTO {rtree} (min_x, max_x, min_y, max_y, pano_id, subregion_name)
+                                        VALUES (new.pano_x, new.pano_x, new.pano_y, new.pano_y, new.pano_id, new.subregion_name);
+                                    END''')
+            self.cursor.execute(f'''CREATE TRIGGER {rtree}_delete AFTER DELETE ON {table_name} BEGIN
+                                        DELETE FROM {rtree} WHERE id IN
+                                            (SELECT id FROM {rtree}
+                                            WHERE max_x >= old.pano_x AND min_x <= old.pano_x
+                                            AND max_y >= old.pano_y AND min_y <= old.pano_y
+                                            AND pano_id = old.pano_id AND subregion_name = old.subregion_name);
+                                    END''')
+            self.cursor.execute(f'''CREATE TRIGGER {rtree}_update AFTER UPDATE OF pano_x, pano_y ON {table_name} BEGIN
+                                        UPDATE {rtree} SET min_x = new.pano_x, max_x = new.pano_x, min_y = new.pano_y, max_y = new.pano_y
+                                        WHERE max_x >= old.pano_x AND min_x <= old.pano_x
+                                        AND max_y >= old.pano_y AND min_y <= old.pano_y
+                                        AND pano_id = old.pano_id AND subregion_name = old.subregion_name;
+                                    END''')
+            self.cursor.execute(f'''INSERT INTO {rtree} (min_x, max_x, min_y, max_y, pano_id, subregion_name)
+                                    SELECT pano_x, pano_x, pano_y, pano_y, pano_id, subregion_name FROM {table_name}''')
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+    def _make_pano_rtree(self, table_name):
+        """Makes an R*Tree over the pano table of normalized storage, which holds every pano once and is kept in
+        sync through triggers on the pano table"""
+        rtree = f'{table_name}_rtree'
+        panos = f'{table_name}_panos'
+        self.cursor.execute(f'CREATE VIRTUAL TABLE {rtree} USING rtree(id, min_x, max_x, min_y, max_y, +pano_id)')
+        self.cursor.execute(f'''CREATE TRIGGER {rtree}_insert AFTER INSERT ON {panos} BEGIN
+                                    INSERT INTO {rtree} (min_x, max_x, min_y, max_y, pano_id)
+                                    VALUES (new.pano_x, new.pano_x, new.pano_y, new.pano_y, new.pano_id);
+                                END''')
+        self.cursor.execute(f'''CREATE TRIGGER {rtree}_delete AFTER DELETE ON {panos} BEGIN
+                                    DELETE FROM {rtree} WHERE id IN
+                                        (SELECT id FROM {rtree}
+                                        WHERE max_x >= old.pano_x AND min_x <= old.pano_x
+                                        AND max_y >= old.pano_y AND min_y <= old.pano_y
+                                        AND pano_id = old.pano_id);
+                                END''')
+        self.cursor.execute(f'''CREATE TRIGGER {rtree}_update AFTER UPDATE OF pano_x, pano_y ON {panos} BEGIN
+                                    UPDATE {rtree} SET min_x = new.pano_x, max_x = new.pano_x, min_y = new.pano_y, max_y = new.pano_y
+                                    WHERE max_x >= old.pano_x AND min_x <= old.pano_x
+                                    AND max_y >= old.pano_y AND min_y <= old.pano_y
+                                    AND pano_id = old.pano_id;
+                                END''')
+        self.cursor.execute(f'''INSERT INTO {rtree} (min_x, max_x, min_y, max_y, pano_id)
+                                SELECT pano_x, pano_x, pano_y, pano_y, pano_id FROM {panos}''')
+
+    @DatabaseHandler._table_selected
+    def get_records_in_bbox(self, xmin, ymin, xmax, ymax):
+        """Select records from the target table of which the pano lies within a bounding box.
+        Uses the R*Tree index of the table if there is one.
+
+        Arguments:
+            xmin {float} -- Minimum X coordinate
+            ymin {float} -- Minimum Y coordinate
+            xmax {float} -- Maximum X coordinate
+            ymax {float} -- Maximum Y coordinate
+
+        Returns:
+            {pandas.DataFrame} -- All records with panos inside the bounding box
+        """
+        return self.get_records(RecordFilter(bbox=(xmin, ymin, xmax, ymax)))
+
+    @DatabaseHandler._table_selected
+    def add_entry(self, entry, manual_commit=False):
+        """Stores a record in the target table
+        
+        Arguments:
+            entry {dict} -- dictionary containing entries for all table fields
+        
+        Keyword Arguments:
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """            
+        n_added = self.add_entries([entry], manual_commit=manual_commit)
+        if n_added == 0 and self.verbose:
+            print(f'Duplicate entry for pano {entry["pano_id"]} ignored.')
+
+    @DatabaseHandler._table_selected
+    @instrument.instrumented('store', rows=lambda n_added: n_added)
+    def add_entries(self, entries, batch_size=10000, manual_commit=False):
+        """Stores many records in the target table, using one transaction per batch.
+        Entries which already exist for the same pano and subregion are ignored.
+        
+        Arguments:
+            entries {iterable} -- Dictionaries containing entries for all table fields
+        
+        Keyword Arguments:
+            batch_size {int} -- Number of entries written per transaction (default: {10000})
+            manual_commit {bool} -- Leave committing to the caller, e.g. to include a checkpoint in the same transaction (default: {False})
+
+        Returns:
+            {int} -- Number of new records stored
+        """
+        entries = iter(entries)
+        is_normalized = self.is_normalized(self.table)
+        n_added = 0
+        while True:
+            batch = [_entry_values(entry) for entry in islice(entries, batch_size)]
+            if not batch:
+                return n_added
+            try:
+                if is_normalized:
+                    n_added += self._add_normalized(batch)
+                else:
+                    self.cursor.executemany(f'INSERT OR IGNORE INTO {self.table} ({", ".join(PANO_FIELDS)}) '
+                                            'VALUES (?,?,?,?,?,?,?,?,?,?)', batch)
+                    n_added += self.cursor.rowcount
+                if not manual_commit:
+                    self.db.commit()
+            except Exception as e:
+                self.db.rollback()
+                raise e
+
+    def _add_normalized(self, batch):
+        """Writes a batch of entry values straight to the tables of normalized storage, bypassing the triggers of the view.
+        Returns the number of new pano & subregion memberships."""
+        subregions = {values[0] for values in batch}
+        self.cursor.executemany(f'INSERT OR IGNORE INTO {self.table}_subregions (subregion_name) VALUES (?)',
+                                [(name,) for name in subregions])
+        pano_values = []
+        for subregion_name, pano_id, capture_date, *values in batch:
+            try:
+                capture_month = to_capture_month(capture_date)
+            except (TypeError, ValueError):
+                capture_month = None
+            pano_values.append((pano_id, capture_month, *values))
+        self.cursor.executemany(f'INSERT OR IGNORE INTO {self.table}_panos ({", ".join(NORMALIZED_PANO_FIELDS)}) '
+                                'VALUES (?,?,?,?,?,?,?,?,?)', pano_values)
+        query = f'SELECT subregion_name, subregion_id FROM {self.table}_subregions WHERE subregion_name IN (SELECT value FROM json_each(?))'
+        subregion_ids = dict(self.cursor.execute(query, [json.dumps(list(subregions))]).fetchall())
+        self.cursor.executemany(f'INSERT OR IGNORE INTO {self.table}_members VALUES (?,?)',
+                                [(subregion_ids[values[0]], values[1]) for values in batch])
+        return self.cursor.rowcount
+
+    def _job_table_made(func):
+        """Makes the job tables with their default name for job functions called before make_job_table
+
+        Arguments:
+            func {Method} -- Function that uses the job table
+        """
+        def inner(self, *args, **kwargs):
+            if not self.job_table:
+                self.make_job_table()
+            return func(self, *args, **kwargs)
+        return inner
+
+    def make_job_table(self, table_name='discovery_jobs'):
+        """Makes the tables which keep track of the progress of discovery jobs, so that they can be resumed.
+        One table holds the status of every subregion of a job, the other the status of every sample point.
+        Job functions called before this make the tables with their default name.
+        
+        Keyword Arguments:
+            table_name {str} -- Name of the job table. Sample points are stored in [table_name]_points (default: {'discovery_jobs'})
+        """
+        self.execute_cmd(f'''CREATE TABLE IF NOT EXISTS {table_name}
+                                (job_id VARCHAR,
+                                subregion_name VARCHAR,
+                                status INTEGER,
+                                PRIMARY KEY (job_id, subregion_name)
+                                ) WITHOUT ROWID''')
+        self.execute_cmd(f'''CREATE TABLE IF NOT EXISTS {table_name}_points
+                                (job_id VARCHAR,
+                                subregion_name VARCHAR,
+                                chunk_id INTEGER,
+                                point_idx INTEGER,
+                                x REAL,
+                                y REAL,
+                                status INTEGER,
+                                PRIMARY KEY (job_id, subregion_name, chunk_id, point_idx)
+                                ) WITHOUT ROWID''')
+        self.job_table = table_name
+
+    @_job_table_made
+    def set_job_status(self, job_id, subregion_name, status, manual_commit=False):
+        """Sets the status of a subregion of a discovery job. PENDING means its sample points are still being registered,
+        IN_FLIGHT that all sample points are registered and DONE that all sample points have been looked up.
+        
+        Arguments:
+            job_id {str} -- Name of the discovery job
+            subregion_name {str} -- Subregion name
+            status {int} -- PENDING, IN_FLIGHT or DONE
+
+        Keyword Arguments:
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """
+        self.cursor.execute(f'INSERT OR REPLACE INTO {self.job_table} VALUES (?,?,?)', [job_id, subregion_name, status])
+        if not manual_commit:
+            self.db.commit()
+
+    @_job_table_made
+    def get_job_status(self, job_id):
+        """Gets the status of all subregions of a discovery job
+        
+        Arguments:
+            job_id {str} -- Name of the discovery job
+
+        Returns:
+            {dict} -- Status of every subregion name
+        """
+        query = f'SELECT subregion_name, status FROM {self.job_table} WHERE job_id = ?'
+        return dict(self.cursor.execute(query, [job_id]).fetchall())
+
+    @_job_table_made
+    def register_job_points(self, job_id, subregion_name, chunk_id, sample_pts):
+        """Stores a chunk of sample points as pending. Points which were registered before keep their status,
+        so registering the same deterministic chunks again after a crash does not redo finished points.
+        
+        Arguments:
+            job_id {str} -- Name of the discovery job
+            subregion_name {str} -- Subregion name
+            chunk_id {int} -- Number of the chunk within the subregion
+            sample_pts {list} -- Coordinate pairs in WGS84 coordinates
+        """
+        values = [(job_id, subregion_name, chunk_id, i, float(pt[0]), float(pt[1]), PENDING) for i, pt in enumerate(sample_pts)]
+        try:
+            self.cursor.executemany(f'INSERT OR IGNORE INTO {self.job_table}_points VALUES (?,?,?,?,?,?,?)', values)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+    @_job_table_made
+    def set_job_points_status(self, job_id, subregion_name, job_pts, status, manual_commit=False):
+        """Sets the status of registered sample points
+        
+        Arguments:
+            job_id {str} -- Name of the discovery job
+            subregion_name {str} -- Subregion name
+            job_pts {iterable} -- JobPoints of which to set the status
+            status {int} -- PENDING, IN_FLIGHT or DONE
+
+        Keyword Arguments:
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """
+        values = [(status, job_id, subregion_name, pt.chunk_id, pt.point_idx) for pt in job_pts]
+        self.cursor.executemany(f'''UPDATE {self.job_table}_points SET status = ?
+                                    WHERE job_id = ? AND subregion_name = ? AND chunk_id = ? AND point_idx = ?''', values)
+        if not manual_commit:
+            self.db.commit()
+
+    @_job_table_made
+    def iter_job_points(self, job_id, subregion_name, chunk_id=None, unfinished_only=True):
+        """Lazily reads the registered sample points of a subregion
+        
+        Arguments:
+            job_id {str} -- Name of the discovery job
+            subregion_name {str} -- Subregion name
+
+        Keyword Arguments:
+            chunk_id {int} -- Only read the points of this chunk (default: {None})
+            unfinished_only {bool} -- Skip points which are done (default: {True})
+
+        Yields:
+            {JobPoint} -- Registered sample points, ordered by chunk and index
+        """
+        status_clause = f' AND status != {DONE}' if unfinished_only else ''
+        if chunk_id is None:
+            query = f'''SELECT DISTINCT chunk_id FROM {self.job_table}_points
+                        WHERE job_id = ? AND subregion_name = ?{status_clause} ORDER BY chunk_id'''
+            chunk_ids = [row[0] for row in self.cursor.execute(query, [job_id, subregion_name]).fetchall()]
+        else:
+            chunk_ids = [chunk_id]
+
+        # Points are read one chunk at a time, so no read cursor stays open while progress is written
+        query = f'''SELECT x, y, chunk_id, point_idx FROM {self.job_table}_points
+                    WHERE job_id = ? AND subregion_name = ? AND chunk_id = ?{status_clause} ORDER BY point_idx'''
+        for chunk in chunk_ids:
+            for row in self.cursor.execute(query, [job_id, subregion_name, chunk]).fetchall():
+                yield JobPoint(*row)
+
+    @_job_table_made
+    def get_job_points(self, job_id, subregions=None):
+        """Reads the registered sample points of a discovery job into a dataframe
+
+        Arguments:
+            job_id {str} -- Name of the discovery job
+
+        Keyword Arguments:
+            subregions {str or iterable} -- Only read the points of these subregions (default: {None})
+
+        Returns:
+            {pandas.DataFrame} -- Subregion name, X & Y coordinate and status of every sample point
+        """
+        where_clause, params = RecordFilter(subregions=subregions).to_sql(f'{self.job_table}_points')
+        query = f'SELECT subregion_name, x, y, status FROM {self.job_table}_points WHERE job_id = ?'
+        if where_clause:
+            query += f' AND {where_clause}'
+        return pd.read_sql_query(query, self.db, params=[job_id, *params])
+
+    @DatabaseHandler._table_selected
+    def iter_undownloaded_pano_ids(self, batch_size=10000, include_missing=False):
+        """Lazily reads the IDs of panos in the target table which have not been saved yet.
+        Pano IDs are read in batches with keyset pagination on the primary key, so no read cursor stays open
+        while downloads are recorded, and every batch starts after the last pano ID of the previous one.
+
+        Keyword Arguments:
+            batch_size {int} -- Number of pano IDs read per query (default: {10000})
+            include_missing {bool} -- Also read panos which were recorded as missing by set_missing (default: {False})
+
+        Yields:
+            {str} -- Distinct pano IDs, in sorted order
+        """
+        table = f'{self.table}_panos' if self.is_normalized(self.table) else self.table
+        # Missing panos have a download date but no saved path
+        missing_clause = '' if include_missing else " AND (download_date IS NULL OR download_date = '')"
+        query = f'''SELECT DISTINCT pano_id FROM {table}
+                    WHERE pano_id > ? AND (saved_path IS NULL OR saved_path = ''){missing_clause}
+                    ORDER BY pano_id LIMIT ?'''
+        last_pano_id = ''
+        while True:
+            pano_ids = [row[0] for row in self.cursor.execute(query, [last_pano_id, batch_size]).fetchall()]
+            if not pano_ids:
+                return
+            yield from pano_ids
+            last_pano_id = pano_ids[-1]
+
+    @DatabaseHandler._table_selected
+    def set_downloaded(self, saved_paths, download_date=None, manual_commit=False):
+        """Records the download date and saved path of panos, for all subregions in which they occur
+
+        Arguments:
+            saved_paths {iterable} -- Pairs of pano ID and the path of the saved image
+
+        Keyword Arguments:
+            download_date {str} -- Date of the download, defaults to today (default: {None})
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """
+        download_date = download_date or str(date.today())
+        values = [(download_date, saved_path, pano_id) for pano_id, saved_path in saved_paths]
+        table = f'{self.table}_panos' if self.is_normalized(self.table) else self.table
+        try:
+            self.cursor.executemany(f'UPDATE {table} SET download_date = ?, saved_path = ? WHERE pano_id = ?', values)
+            if not manual_commit:
+                self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+    @DatabaseHandler._table_selected
+    def set_missing(self, pano_ids, download_date=None, manual_commit=False):
+        """Records panos of which no image exists, with the date of the download attempt and no saved path,
+        so that iter_undownloaded_pano_ids skips them
+
+        Arguments:
+            pano_ids {iterable} -- IDs of the missing panos
+
+        Keyword Arguments:
+            download_date {str} -- Date of the download attempt, defaults to today (default: {None})
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """
+        self.set_downloaded(((pano_id, None) for pano_id in pano_ids), download_date, manual_commit)
+
+    _job_table_made = staticmethod(_job_table_made)
+
+    # def calculate_splits(self, table, field_name, split_probabilities, commit_interval=50):
+    #     records = self.get_all_records(table)
+    #     for i, record in enumerate(records):
+    #         split = determine_split(split_probabilities)
+    #         try:
+    #             self.db.execute(f'UPDATE {table} SET {field_name}=(?) WHERE img_id=(?)', [split, record[0]])
+    #             if i % commit_interval == 0 or i == len(records):
+    #                 self.db.commit()
+    #         except sqlite3.IntegrityError as e:
+    #             print(f'Cannot load records: {e}')
@@ -0,0 +1,130 @@
+import os
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+import shapely
+
+from svdiscover import instrument
+from svdiscover.database import DONE
+from svdiscover.lookup import PanoLookupPool
+from svdiscover.sampling import (iter_grid_tiles, grid_xy_in_tile, reproject_xy,
+                                 _iter_job_points, _finish_job_subregion, _ResultWriter)
+
+@instrument.instrumented('discover', rows=len)
+def discover_regions(gdf, sv_db, name_col, grid_resolution=20, in_proj=None, n_processes=None, n_workers=8,
+                     requests_per_second=None, lookup_func=None, cache=None, job_id=None, tile_size=1000):
+    """Discovers the panoramas in every polygon of a dataframe and stores them in the target table of the database.
+    Sampling, clipping and reprojection are sharded tile by tile over a pool of processes, with a bounded number of
+    tiles queued, so memory does not grow with the polygon area. The sample points of all polygons are looked up in
+    one stream by one rate-limited pool of threads, and the calling process is the only writer to the database.
+
+    Arguments:
+        gdf {GeoPandas dataframe} -- Dataframe with polygon geometries in a metric coordinate system
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a target table
+        name_col {str} -- Column with the subregion name of every polygon
+
+    Keyword Arguments:
+        grid_resolution {integer} -- Resolution of the sampling grid in meters (default: {20})
+        in_proj {str} -- EPSG description of the coordinate system of the polygons, defaults to the CRS of the dataframe (default: {None})
+        n_processes {int} -- Number of processes for the geometry stages, defaults to the number of cores (default: {None})
+        n_workers {int} -- Number of concurrent lookups (default: {8})
+        requests_per_second {float} -- Maximum request rate over all lookups, None for no limit (default: {None})
+        lookup_func {callable} -- Replacement for streetview.panoids, e.g. a local stub (default: {None})
+        cache {LookupCache} -- Cache of earlier lookups (default: {None})
+        job_id {str} -- Name of the discovery job to checkpoint. Subregions which are done are skipped (default: {None})
+        tile_size {int} -- Number of grid cells along each side of a sampling tile (default: {1000})
+
+    Returns:
+        {list} -- Names of the subregions which were processed
+    """
+    in_proj = in_proj or gdf.crs.to_string()
+    n_processes = n_processes or os.cpu_count()
+    finished = set()
+    if job_id is not None:
+        finished = {name for name, status in sv_db.get_job_status(job_id).items() if status == DONE}
+    regions = ((row[name_col], row.geometry) for _, row in gdf.iterrows() if row[name_col] not in finished)
+
+    # Worker processes are spawned rather than forked, as the lookup threads are already running
+    with PanoLookupPool(n_workers, requests_per_second, lookup_func) as pool, \
+         ProcessPoolExecutor(max_workers=n_processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+        tiles = _iter_sampled_tiles(regions, executor, grid_resolution, in_proj, tile_size, 2 * n_processes)
+        region_pts = _RegionPoints(tiles, sv_db, job_id)
+        return _store_region_points(region_pts, sv_db, pool, cache, job_id)
+
+_RegionPoint = namedtuple('_RegionPoint', ['x', 'y', 'subregion_name', 'sample_pt'])
+
+def _iter_sampled_tiles(regions, executor, grid_resolution, in_proj, tile_size, max_queued):
+    """Samples and reprojects the tiles of all regions in worker processes, keeping at most max_queued tiles queued.
+    Yields the subregion name and sample points of every tile, in the order of the regions and their tiles."""
+    queued = deque()
+    for name, poly_geom in regions:
+        # Regions without tiles are still yielded, so that they are registered as processed
+        queued.append((name, None))
+        for tile_xs, tile_ys in iter_grid_tiles(poly_geom, grid_resolution, tile_size):
+            while len(queued) >= max_queued:
+                yield _tile_result(*queued.popleft())
+            queued.append((name, executor.submit(_sample_tile, poly_geom, tile_xs, tile_ys, in_proj)))
+    while queued:
+        yield _tile_result(*queued.popleft())
+
+def _tile_result(name, future):
+    return name, future.result() if future is not None else np.empty((0, 2))
+
+def _sample_tile(poly_geom, tile_xs, tile_ys, in_proj):
+    """Geometry stage of a single tile, run in a worker process: samples, clips and reprojects its grid points"""
+    shapely.prepare(poly_geom)
+    xy = grid_xy_in_tile(poly_geom, tile_xs, tile_ys)
+    return np.column_stack(reproject_xy(xy[:, 0], xy[:, 1], in_proj))
+
+class _RegionPoints():
+    """Stream of the sample points of consecutive regions, tagged with their subregion. With a job id, the points of
+    every region are registered in the job table. Counts the points of every region, so that the writer knows when
+    all points of a region are stored."""
+    def __init__(self, tiles, sv_db, job_id=None):
+        self.tiles = tiles
+        self.sv_db = sv_db
+        self.job_id = job_id
+        self.n_points = {}
+        self.exhausted = []
+
+    def __iter__(self):
+        for name, region_tiles in groupby(self.tiles, key=itemgetter(0)):
+            sample_pts = (tuple(sample_pt) for _, xy in region_tiles for sample_pt in xy.tolist())
+            if self.job_id is not None:
+                sample_pts = _iter_job_points(sample_pts, self.job_id, name, self.sv_db)
+            self.n_points[name] = 0
+            for sample_pt in sample_pts:
+                self.n_points[name] += 1
+                yield _RegionPoint(sample_pt[0], sample_pt[1], name, sample_pt)
+            self.exhausted.append(name)
+
+def _store_region_points(region_pts, sv_db, pool, cache, job_id):
+    """Looks up the sample points of all regions in one stream and stores them, finishing every region as soon as
+    all of its points are stored"""
+    resolve = (lambda region_pt: cache.resolve(region_pt, region_pt.subregion_name)) if cache is not None else None
+    writers = {}
+    n_stored = {}
+    processed = []
+
+    def finish_regions():
+        while region_pts.exhausted and n_stored.get(region_pts.exhausted[0], 0) == region_pts.n_points[region_pts.exhausted[0]]:
+            name = region_pts.exhausted.pop(0)
+            if name in writers:
+                writers.pop(name).flush()
+            if job_id is not None:
+                _finish_job_subregion(sv_db, job_id, name)
+            processed.append(name)
+
+    for region_pt, *response in pool.map(region_pts, resolve):
+        name = region_pt.subregion_name
+        if name not in writers:
+            writers[name] = _ResultWriter(name, sv_db, cache, job_id)
+        writers[name].add((region_pt.sample_pt, *response))
+        n_stored[name] = n_stored.get(name, 0) + 1
+        finish_regions()
+    finish_regions()
+    return processed
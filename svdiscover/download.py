@@ -0,0 +1,176 @@
+import os
+import shutil
+import logging
+import threading
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from svdiscover.lookup import RateLimiter, call_with_backoff
+
+STATIC_API_URL = 'https://maps.googleapis.com/maps/api/streetview'
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+NOT_FOUND_STATUS_CODE = 404
+
+logger = logging.getLogger(__name__)
+
+class PanoDownloader():
+    """Downloads the panoramas of the target table of a database with a bounded pool of worker threads.
+    Images are streamed to a temporary file which is renamed once complete, so an interrupted download never
+    leaves a partial image behind. The API is asked to return an error code instead of a placeholder image, and
+    panos it does not know (404) are recorded as missing without retrying. The saved path and download date are recorded in batched transactions by
+    the calling thread, and panos which already have a saved path or are missing are skipped, so a restarted run
+    continues where the previous one stopped.
+
+    Arguments:
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a target table
+        out_dir {str} -- Directory in which the images are saved
+        api_key {str} -- Google API key. See the read-me on how to acquire a key
+
+    Keyword Arguments:
+        n_workers {int} -- Number of concurrent downloads (default: {8})
+        requests_per_second {float} -- Maximum request rate per host, None for no limit (default: {None})
+        base_url {str} -- URL of the Street View Static API, e.g. a local stub for testing (default: {STATIC_API_URL})
+        image_params {dict} -- Extra query parameters such as heading, fov or pitch (default: {None})
+        size {str} -- Image size in pixels (default: {'640x640'})
+        batch_size {int} -- Number of downloads recorded per transaction (default: {1000})
+        max_retries {int} -- Number of retries with exponential backoff on server errors (default: {5})
+        timeout {float} -- Timeout in seconds of a single request (default: {30})
+    """
+    def __init__(self, sv_db, out_dir, api_key, n_workers=8, requests_per_second=None, base_url=STATIC_API_URL,
+                 image_params=None, size='640x640', batch_size=1000, max_retries=5, timeout=30):
+        self.sv_db = sv_db
+        self.out_dir = out_dir
+        self.api_key = api_key
+        self.n_workers = n_workers
+        self.requests_per_second = requests_per_second
+        self.base_url = base_url
+        self.image_params = image_params or {}
+        self.size = size
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiters = {}
+        self.lock = threading.Lock()
+        self.n_downloaded = 0
+        self.n_failed = 0
+        self.n_missing = 0
+        self.missing = []
+
+    def _rate_limiter(self, url):
+        """Returns the rate limiter of the host of a URL, creating it on first use"""
+        if not self.requests_per_second:
+            return None
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.rate_limiters:
+                self.rate_limiters[host] = RateLimiter(self.requests_per_second, burst=self.n_workers)
+            return self.rate_limiters[host]
+
+    def pano_url(self, pano_id):
+        # Without return_error_code the API answers unknown panos with a grey placeholder image and status 200
+        params = {'size': self.size, 'pano': pano_id, **self.image_params, 'return_error_code': 'true', 'key': self.api_key}
+        return f'{self.base_url}?{urlencode(params)}'
+
+    def pano_path(self, pano_id):
+        # Images are spread over subdirectories, as directories with millions of files are slow to list
+        return os.path.join(self.out_dir, pano_id[:2], f'{pano_id}.jpg')
+
+    def _fetch(self, url, saved_path):
+        """Streams an image to its saved path and returns the HTTP status; errors worth retrying are raised"""
+        part_path = f'{saved_path}.part'
+        try:
+            with urlopen(url, timeout=self.timeout) as response, open(part_path, 'wb') as f:
+                shutil.copyfileobj(response, f, length=1 << 16)
+                # Chunked reads end quietly when the connection drops, leaving the rest of the declared length unread
+                if response.length:
+                    raise ConnectionError(f'Connection closed with {response.length} bytes of the image left')
+            os.replace(part_path, saved_path)
+        except HTTPError as e:
+            if e.code in RETRY_STATUS_CODES:
+                raise e
+            return e.code
+        finally:
+            # Left behind by an error halfway through the stream, the part file would never be completed
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        return 200
+
+    def download_pano(self, pano_id):
+        """Downloads a single panorama, unless its image already exists on disk
+
+        Arguments:
+            pano_id {str} -- ID of the panorama
+
+        Returns:
+            {str} -- Path of the saved image, or None if the download failed
+        """
+        saved_path = self.pano_path(pano_id)
+        if os.path.exists(saved_path):
+            return saved_path
+        os.makedirs(os.path.dirname(saved_path), exist_ok=True)
+        # The URL holds the API key, so only the pano ID is logged
+        url = self.pano_url(pano_id)
+        try:
+            status = call_with_backoff(self._fetch, (url, saved_path),
+                                       max_retries=self.max_retries,
+                                       rate_limiter=self._rate_limiter(url))
+        except Exception as e:
+            logger.warning('Cannot download pano %s: %s', pano_id, e)
+            return None
+        if status == NOT_FOUND_STATUS_CODE:
+            with self.lock:
+                self.n_missing += 1
+                self.missing.append(pano_id)
+        elif status != 200:
+            logger.warning('Cannot download pano %s: HTTP status %d', pano_id, status)
+        return saved_path if status == 200 else None
+
+    def run(self, pano_ids=None):
+        """Downloads all panoramas which have not been saved yet or recorded as missing
+
+        Keyword Arguments:
+            pano_ids {iterable} -- Pano IDs to download instead of all unsaved panos of the target table (default: {None})
+
+        Returns:
+            {int} -- Number of panoramas saved in this run
+        """
+        if pano_ids is None:
+            pano_ids = self.sv_db.iter_undownloaded_pano_ids()
+        n_downloaded = self.n_downloaded
+        saved = []
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            for pano_id in pano_ids:
+                if len(pending) >= 4 * self.n_workers:
+                    saved = self._collect(pending, saved)
+                pending[executor.submit(self.download_pano, pano_id)] = pano_id
+            while pending:
+                saved = self._collect(pending, saved)
+        self._record(saved)
+        return self.n_downloaded - n_downloaded
+
+    def _collect(self, pending, saved):
+        """Waits for finished downloads and records them once a batch is full"""
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pano_id = pending.pop(future)
+            saved_path = future.result()
+            if saved_path is None:
+                self.n_failed += 1
+            else:
+                saved.append((pano_id, saved_path))
+        if len(saved) >= self.batch_size:
+            self._record(saved)
+            return []
+        return saved
+
+    def _record(self, saved):
+        if saved:
+            self.sv_db.set_downloaded(saved)
+            self.n_downloaded += len(saved)
+        with self.lock:
+            missing, self.missing = self.missing, []
+        if missing:
+            self.sv_db.set_missing(missing)
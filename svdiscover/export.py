@@ -1,35 +1,177 @@
-import csv
-
-def export_to_csv(out_filepath, record_list, header=None):
-    """Simple utility to export SQLite records to a CSV
-    
-    Arguments:
-        out_filepath {str} -- Filepath+name of output file
-        record_list {list} -- List of lists containing SQLite database records
-    """    
-    with open(out_filepath, "w") as f:
-        writer = csv.writer(f)
-        if header:
-            writer.writerow(header)
-        writer.writerows(record_list)
-
-# def plot_anchor_timediff(records, centerpoint, zoom=5):
-#     map_obj = folium.Map(
-#         location=centerpoint,
-#         zoom_start=zoom
-#     )
-
-#     for r in records:
-#         if r[-1] <= 2:
-#             color = 'red'
-#         elif r[-1] >= 3 and r[-1] < 6:
-#             color = 'orange'
-#         else:
-#             color = 'green'
-
-#         folium.Marker(
-#             location=[r[1], r[0]],
-#             #popup=f"{records[r][0][0]}",
-#             icon=folium.Icon(color=color)
-#         ).add_to(map_obj)
-#     return map_obj
+import csv
+import json
+import queue
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Layout of a 2D point in well-known binary: byte order, geometry type and the coordinates, without padding
+_WKB_POINT_DTYPE = np.dtype([('byte_order', 'u1'), ('geometry_type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+def export_to_csv(out_filepath, record_list, header=None):
+    """Simple utility to export SQLite records to a CSV
+    
+    Arguments:
+        out_filepath {str} -- Filepath+name of output file
+        record_list {iterable} -- List of lists containing SQLite database records, or dataframe chunks from DatabaseHandler.iter_records
+    """    
+    with open(out_filepath, "w") as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        for records in record_list:
+            if isinstance(records, pd.DataFrame):
+                writer.writerows(records.itertuples(index=False, name=None))
+            else:
+                writer.writerow(records)
+
+def export_to_parquet(sv_db, out_dir, chunksize=100000, columns=None, where=None, params=(), geometry=True,
+                      partition_by=None, row_group_size=None, compression='zstd'):
+    """Streams the records of the target table to a Parquet dataset, chunk by chunk so memory use stays flat.
+    Columns are typed by their declared SQL types, with capture dates as timestamps, so chunks with only missing
+    values keep the types of the table. With geometry, the pano positions are added as a WKB
+    point column with GeoParquet metadata, so the dataset can be read with geopandas.read_parquet.
+    Nothing is written if no records are selected. Requires pyarrow.
+    
+    Arguments:
+        sv_db {DatabaseHandler} -- Database with a target table
+        out_dir {str} -- Directory of the dataset, Parquet files are written as part-[i].parquet
+    
+    Keyword Arguments:
+        chunksize {int} -- Number of records read from the database at a time (default: {100000})
+        columns {list} -- Names of the columns to export, all columns if None (default: {None})
+        where {str or RecordFilter} -- Optional where clause to limit the export (default: {None})
+        params {tuple} -- Values for the placeholders in a string where clause (default: {()})
+        geometry {bool} -- Add a WKB point geometry of pano_x & pano_y in WGS84 coordinates (default: {True})
+        partition_by {str or list} -- Column(s) to partition the dataset by in hive-style directories,
+                                      e.g. 'subregion_name' or 'capture_year' (default: {None})
+        row_group_size {int} -- Number of rows per row group, None for the pyarrow default (default: {None})
+        compression {str} -- Parquet compression codec, e.g. 'zstd', 'snappy' or None (default: {'zstd'})
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError as e:
+        raise ImportError('Parquet export requires pyarrow, install it with `pip install pyarrow`') from e
+
+    partition_by = [partition_by] if isinstance(partition_by, str) else list(partition_by or [])
+    if columns is not None:
+        # Columns needed for the geometry and the partitions are read even if they are not exported otherwise
+        required = (['pano_x', 'pano_y'] if geometry else []) + [col for col in partition_by if col != 'capture_year']
+        required += ['capture_date'] if 'capture_year' in partition_by else []
+        columns = list(columns) + [col for col in required if col not in columns]
+
+    chunks = sv_db.iter_records(chunksize, columns, where, params)
+    first_records = next(chunks, None)
+    if first_records is None:
+        return
+    record_schema = _declared_schema(pa, sv_db, first_records.columns)
+    if 'capture_year' in partition_by:
+        record_schema = record_schema.append(pa.field('capture_year', pa.int16()))
+    # No pandas metadata is stored, as it would make readers restore partition columns with the types of the chunks
+    schema = record_schema
+    if geometry:
+        geo_metadata = {'version': '1.0.0',
+                        'primary_column': 'geometry',
+                        'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Point']}}}
+        schema = schema.append(pa.field('geometry', pa.binary()))
+        schema = schema.with_metadata({b'geo': json.dumps(geo_metadata).encode()})
+    partitioning = None
+    if partition_by:
+        partitioning = ds.partitioning(pa.schema([schema.field(col) for col in partition_by]), flavor='hive')
+
+    def to_batch(records):
+        if 'capture_year' in partition_by:
+            records = records.assign(capture_year=records['capture_date'].dt.year.astype('Int16'))
+        batch = pa.RecordBatch.from_pandas(records, schema=record_schema, preserve_index=False)
+        if geometry:
+            batch = batch.append_column('geometry', _wkb_points(pa, records['pano_x'], records['pano_y']))
+        return batch.replace_schema_metadata(schema.metadata)
+
+    row_group_kwargs = {}
+    if row_group_size:
+        row_group_kwargs = {'max_rows_per_group': row_group_size, 'min_rows_per_group': row_group_size}
+    file_options = ds.ParquetFileFormat().make_write_options(compression=compression)
+
+    # pyarrow consumes the batches in its own threads, while SQLite connections may only be read from the thread
+    # that opened them. Chunks are therefore read here and handed to the writer through a small bounded queue.
+    batches = queue.Queue(maxsize=2)
+    def iter_queued():
+        while (batch := batches.get()) is not None:
+            yield batch
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        writer = executor.submit(ds.write_dataset, iter_queued(), out_dir, schema=schema, format='parquet',
+                                 file_options=file_options, partitioning=partitioning,
+                                 existing_data_behavior='overwrite_or_ignore', **row_group_kwargs)
+        try:
+            for records in itertools.chain([first_records], chunks):
+                _put_unless_failed(batches, to_batch(records), writer)
+        finally:
+            _put_unless_failed(batches, None, writer)
+        writer.result()
+
+def _declared_schema(pa, sv_db, columns):
+    """Arrow schema of the columns of the target table, from their declared SQL types.
+    Types follow the affinity rules of SQLite, and columns without a declared type are exported as strings."""
+    declared_types = {header[1]: header[2].upper() for header in sv_db.cursor.execute(f'PRAGMA table_info({sv_db.table})')}
+    fields = []
+    for col in columns:
+        declared_type = declared_types.get(col, '')
+        if col == 'capture_date':
+            arrow_type = pa.timestamp('ns')
+        elif 'INT' in declared_type:
+            arrow_type = pa.int64()
+        elif any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+            arrow_type = pa.float64()
+        elif 'BLOB' in declared_type:
+            arrow_type = pa.binary()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(col, arrow_type))
+    return pa.schema(fields)
+
+def _put_unless_failed(batches, batch, writer):
+    """Queues a batch for the writer, raising the exception of the writer if it stopped"""
+    while True:
+        try:
+            batches.put(batch, timeout=1)
+            return
+        except queue.Full:
+            if writer.done():
+                writer.result()
+                return
+
+def _wkb_points(pa, x, y):
+    """Encodes coordinate arrays as little-endian WKB points in one vectorized step"""
+    n_points = len(x)
+    points = np.empty(n_points, dtype=_WKB_POINT_DTYPE)
+    points['byte_order'] = 1
+    points['geometry_type'] = 1
+    points['x'] = x
+    points['y'] = y
+    offsets = np.arange(n_points + 1, dtype=np.int32) * _WKB_POINT_DTYPE.itemsize
+    return pa.BinaryArray.from_buffers(pa.binary(), n_points, [None, pa.py_buffer(offsets), pa.py_buffer(points.tobytes())])
+
+# def plot_anchor_timediff(records, centerpoint, zoom=5):
+#     map_obj = folium.Map(
+#         location=centerpoint,
+#         zoom_start=zoom
+#     )
+
+#     for r in records:
+#         if r[-1] <= 2:
+#             color = 'red'
+#         elif r[-1] >= 3 and r[-1] < 6:
+#             color = 'orange'
+#         else:
+#             color = 'green'
+
+#         folium.Marker(
+#             location=[r[1], r[0]],
+#             #popup=f"{records[r][0][0]}",
+#             icon=folium.Icon(color=color)
+#         ).add_to(map_obj)
+#     return map_obj
@@ -0,0 +1,151 @@
+import json
+import threading
+from math import frexp
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, time
+
+class StageStats():
+    """Running statistics of a pipeline stage: number of calls, total time, rows processed and a
+    histogram of call latencies in power-of-two millisecond buckets"""
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.rows = 0
+        self.histogram = {}
+
+    def add(self, seconds, rows=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.rows += rows
+        # Bucket b holds latencies in [2^(b-1), 2^b) milliseconds
+        bucket = max(frexp(seconds * 1000)[1], 0)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def summary(self):
+        return {'calls': self.calls,
+                'seconds': self.seconds,
+                'mean_ms': 1000 * self.seconds / self.calls if self.calls else 0.,
+                'rows': self.rows,
+                'rows_per_second': self.rows / self.seconds if self.seconds else 0.,
+                'latency_ms_histogram': {f'<{2 ** bucket}': n for bucket, n in sorted(self.histogram.items())}}
+
+class Instrumentation():
+    """Collects per-stage timers and counters of the discovery pipeline. Safe to share between threads.
+    Every measurement is also passed to the callbacks as a dictionary, e.g. to write a JSON log.
+
+    Keyword Arguments:
+        callbacks {list} -- Functions called with every timing and counter event (default: {None})
+    """
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage, rows=0):
+        """Times the enclosed block as one call of a stage. The number of rows can be set on the yielded
+        dictionary when it is only known at the end of the block. Setting 'skipped' on it leaves the block out,
+        e.g. when it turned out there was no work to do."""
+        event = {'stage': stage, 'rows': rows}
+        start = perf_counter()
+        try:
+            yield event
+        finally:
+            if not event.pop('skipped', False):
+                event['seconds'] = perf_counter() - start
+                with self.lock:
+                    self.stages.setdefault(stage, StageStats()).add(event['seconds'], event['rows'])
+                self._emit(event)
+
+    def count(self, counter, n=1):
+        """Increments a counter, such as the number of retries"""
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+        self._emit({'counter': counter, 'n': n})
+
+    def _emit(self, event):
+        for callback in self.callbacks:
+            callback(event)
+
+    def summary(self):
+        """Summarizes all stages and counters
+
+        Returns:
+            {dict} -- Statistics per stage, and the value of every counter
+        """
+        with self.lock:
+            return {'stages': {stage: stats.summary() for stage, stats in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+class JsonLogger():
+    """Callback which appends every event as a line of JSON to a log file
+
+    Arguments:
+        log_path {str} -- Path of the log file
+    """
+    def __init__(self, log_path):
+        self.file = open(log_path, 'a')
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps({'time': time(), **event})
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
+
+_active = None
+
+def enable(callbacks=None):
+    """Starts collecting timings of the pipeline stages, replacing earlier instrumentation
+
+    Keyword Arguments:
+        callbacks {list} -- Functions called with every timing and counter event, e.g. a JsonLogger (default: {None})
+
+    Returns:
+        {Instrumentation} -- The active instrumentation, of which summary() reports the collected statistics
+    """
+    global _active
+    _active = Instrumentation(callbacks)
+    return _active
+
+def disable():
+    """Stops collecting timings"""
+    global _active
+    _active = None
+
+def timed(stage, rows=0):
+    """Times a block as a call of a stage if instrumentation is enabled. Costs next to nothing otherwise."""
+    if _active is None:
+        return nullcontext({'stage': stage, 'rows': rows})
+    return _active.timer(stage, rows)
+
+def count(counter, n=1):
+    """Increments a counter if instrumentation is enabled"""
+    if _active is not None:
+        _active.count(counter, n)
+
+def instrumented(stage, rows=None):
+    """Decorator which times every call of a function as a stage if instrumentation is enabled
+
+    Arguments:
+        stage {str} -- Name of the stage
+
+    Keyword Arguments:
+        rows {callable} -- Computes the number of rows processed from the return value of the function (default: {None})
+    """
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.timer(stage) as event:
+                result = func(*args, **kwargs)
+                if rows is not None and result is not None:
+                    event['rows'] = rows(result)
+            return result
+        return inner
+    return decorator
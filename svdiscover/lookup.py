@@ -0,0 +1,178 @@
+import random
+import logging
+import threading
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from svdiscover import instrument
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter():
+    """Token bucket which limits how many requests per second are sent to the API.
+    Safe to share between threads.
+
+    Arguments:
+        requests_per_second {float} -- Rate at which tokens are refilled
+
+    Keyword Arguments:
+        burst {int} -- Maximum number of tokens that can be stored (default: {1})
+    """
+    def __init__(self, requests_per_second, burst=1):
+        self.rate = float(requests_per_second)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.last_refill = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it"""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            sleep(wait_time)
+
+def backoff_delay(attempt, base_delay=1., max_delay=60.):
+    """Exponential backoff with full jitter
+
+    Arguments:
+        attempt {int} -- Number of the failed attempt, starting at 0
+
+    Keyword Arguments:
+        base_delay {float} -- Delay in seconds for the first retry (default: {1.})
+        max_delay {float} -- Upper limit on the delay in seconds (default: {60.})
+
+    Returns:
+        {float} -- Number of seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def call_with_backoff(func, args=(), kwargs=None, max_retries=5, base_delay=1., max_delay=60., rate_limiter=None):
+    """Calls a function, retrying with exponential backoff if it raises an exception
+
+    Arguments:
+        func {callable} -- Function to call
+
+    Keyword Arguments:
+        args {tuple} -- Positional arguments for the function (default: {()})
+        kwargs {dict} -- Keyword arguments for the function (default: {None})
+        max_retries {int} -- Number of retries before the exception is passed on (default: {5})
+        base_delay {float} -- Delay in seconds for the first retry (default: {1.})
+        max_delay {float} -- Upper limit on the delay in seconds (default: {60.})
+        rate_limiter {RateLimiter} -- Optional rate limiter consulted before every attempt (default: {None})
+
+    Returns:
+        The return value of the function
+    """
+    kwargs = kwargs or {}
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries:
+                raise e
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            instrument.count('retries')
+            logger.warning('Querying error (%s), retrying in %.1f seconds', e, delay)
+            sleep(delay)
+
+class PanoLookupPool():
+    """Bounded pool of worker threads that look up panoramas for sample points.
+    Lookups run in the workers; results are handed back to the calling thread, so
+    that a single writer can store them without sharing the SQLite connection.
+    Lookup backends with a fetch_many method, such as AsyncHTTPBackend, get batches of sample points instead,
+    which they look up concurrently; every worker then runs one batch at a time.
+
+    Keyword Arguments:
+        n_workers {int} -- Number of worker threads (default: {8})
+        requests_per_second {float} -- Maximum request rate over all workers, None for no limit (default: {None})
+        lookup_func {callable} -- Replacement for streetview.panoids, e.g. a local stub (default: {None})
+        max_retries {int} -- Number of retries per sample point (default: {5})
+        max_in_flight {int} -- Maximum number of queued lookups. Defaults to 4x the number of workers (default: {None})
+    """
+    def __init__(self, n_workers=8, requests_per_second=None, lookup_func=None, max_retries=5, max_in_flight=None):
+        self.n_workers = n_workers
+        self.rate_limiter = RateLimiter(requests_per_second, burst=n_workers) if requests_per_second else None
+        self.lookup_func = lookup_func
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight or 4 * n_workers
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+
+    def _lookup(self, sample_pts):
+        """Looks up a batch of sample points, returning pairs of sample point & response"""
+        if self.is_batched:
+            panos = self.lookup_func.fetch_many(sample_pts, max_retries=self.max_retries, rate_limiter=self.rate_limiter)
+            return list(zip(sample_pts, panos))
+        # Imported here to avoid a circular import with sampling.py
+        from svdiscover.sampling import lookup_panos
+        return [(sample_pt, lookup_panos(sample_pt,
+                                         lookup_func=self.lookup_func,
+                                         rate_limiter=self.rate_limiter,
+                                         max_retries=self.max_retries))
+                for sample_pt in sample_pts]
+
+    @property
+    def is_batched(self):
+        return hasattr(self.lookup_func, 'fetch_many')
+
+    def map(self, sample_pts, resolve=None):
+        """Looks up panoramas for all sample points, keeping at most max_in_flight lookups queued
+
+        Arguments:
+            sample_pts {iterable} -- Coordinate pairs in WGS84 coordinates
+
+        Keyword Arguments:
+            resolve {callable} -- Returns the known (response, lookup date) of a sample point, or None if it needs to be
+                                  looked up, e.g. LookupCache.resolve. Known responses are yielded right away (default: {None})
+
+        Yields:
+            {tuple} -- Sample point and its panoids response in order of completion, followed by the lookup date for known responses
+        """
+        # Batches are split over the workers, so that all of them are busy with at most max_in_flight points queued
+        batch_size = max(1, self.max_in_flight // self.n_workers) if self.is_batched else 1
+        pending = {}
+        batch = []
+        for sample_pt in sample_pts:
+            resolved = resolve(sample_pt) if resolve is not None else None
+            if resolved is not None:
+                yield (sample_pt, *resolved)
+                continue
+            batch.append(sample_pt)
+            if len(batch) == batch_size:
+                yield from self._submit(pending, batch)
+                batch = []
+
+        if batch:
+            yield from self._submit(pending, batch)
+        while pending:
+            yield from self._wait_for_batches(pending)
+
+    def _submit(self, pending, batch):
+        """Submits a batch once fewer than max_in_flight sample points are queued, yielding the results of finished batches"""
+        if sum(map(len, pending.values())) >= self.max_in_flight:
+            yield from self._wait_for_batches(pending)
+        pending[self.executor.submit(self._lookup, batch)] = batch
+
+    def _wait_for_batches(self, pending):
+        """Waits until at least one batch is done, and yields the results of all finished batches"""
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.pop(future)
+            yield from future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,133 +1,306 @@
-import csv
-from datetime import datetime
-
-import geopandas as gpd
-from shapely.geometry import Point
-
-def add_pano_stats_to_polygons(pano_db, poly):
-    """Adds panorama availability statistics of panoramas within an input polygon
-
-    Args:
-        pano_db (svdiscover.database.StreetviewDB): SQLite database containing panorama statistics
-        poly (GeoPandas dataframe): Dataframe with polygon geometries
-
-    Returns:
-        GeoPandas dataframe: Input dataframe with added statistics
-    """    
-    # Accounting for GeoPandas geometry and Shapely polygon objects
-    if type(poly['geometry'].bounds) == tuple:
-        xmin, ymin, xmax, ymax = poly['geometry'].bounds
-    else:
-        xmin, ymin, xmax, ymax = poly['geometry'].bounds.values[0]
-    
-    # Get points which are inside of the extent of the polygon
-    panos_in_approx_range = pano_db.get_records(f'(pano_x BETWEEN {xmin} AND {xmax}) AND (pano_y BETWEEN {ymin} AND {ymax})')
-    ids_with_pts = {}
-    for _,row in panos_in_approx_range.iterrows():
-        ids_with_pts[row['pano_id']] = Point([row['pano_x'], row['pano_y']])
-    
-    # Keep only those points that intersect the polygon
-    pano_ids_in_poly = [p for p in ids_with_pts if gpd.GeoSeries(poly['geometry']).intersects(ids_with_pts[p]).any()]
-    panos_in_poly = panos_in_approx_range[panos_in_approx_range['pano_id'].isin(pano_ids_in_poly)]
-
-    # Calculate pano stats over all panos in poly
-    if not panos_in_poly.empty:
-        poly = calculate_pano_timestats(poly, panos_in_poly)
-
-    return poly
-
-def calculate_pano_timestats(poly, panos):
-    """From a dataframe of panoramas, calculates basic availability statistics for a given polygon
-
-    Args:
-        poly (GeoPandas dataframe): Dataframe with polygon geometries
-        poly (Pandas dataframe): Dataframe with polygon geometries
-
-    Returns:
-        Geopandas dataframe: Input dataframe with added statistics
-    """    
-    # Calculate differences between earliest and latest panoramas
-    earliest_pano_date = panos['capture_date'].min()
-    latest_pano_date = panos['capture_date'].max()
-    mean_pano_date = panos['capture_date'].mean()
-    panos_range_days = (latest_pano_date - earliest_pano_date).days
-
-    # Calculate time diffference to start of streetview
-    FIRST_PANO_DATE = datetime(2005, 1, 1) # Streetview went into alpha in 2005, so 2005 is taken as the earliest possible date
-    days_rel_to_earliest_date = (earliest_pano_date - FIRST_PANO_DATE).days    
-
-    # Assign to row
-    poly['earliest'] = str(earliest_pano_date.date())
-    poly['earliest_year'] = int(earliest_pano_date.date().year)
-    poly['latest'] = str(latest_pano_date.date())
-    poly['latest_year'] = int(latest_pano_date.date().year)
-    poly['mean_date'] = str(mean_pano_date.date())
-    poly['rel_earliest_days'] = days_rel_to_earliest_date
-    poly['range_days'] = panos_range_days
-
-    return poly
-
-def group_by_xy(records, x_col, y_col, precision=-1):
-    """Groups panoramas by their xy location.
-    Records must be sorted by XY columns of interest!
-    
-    Arguments:
-        records {List of lists} -- Contains records extracted from a Streetview database
-        x_col {int} -- Index of x-coordinate column
-        y_col {int} -- Index of y-coordinate column
-
-    Keyword Arguments:
-        precision {int} -- Number of digits used for grouping. -1 is all digits. (default: {-1})
-    
-    Returns:
-        dict -- Contains records grouped by their anchor location as dict key
-    """    
-    groups = {}
-    records_at_xy = []
-    records = iter(records)
-
-    # Initialize t-1
-    prev_record = next(records)
-    records_at_xy.append(prev_record)
-
-    for record in records:
-        # Check if panos are close enough to be considered at the same location
-        if str(record[x_col])[:precision] != str(prev_record[x_col])[:precision]:
-            if str(record[y_col])[:precision] != str(prev_record[y_col])[:precision]:
-                groups[f'{prev_record[x_col]}-{prev_record[y_col]}'] = records_at_xy
-                records_at_xy = []     
-        records_at_xy.append(record)
-        prev_record = record
-    return groups
-
-def get_xy_timestats(xy_records, x_col, y_col):
-    """Calculates biggest timedif, min pano date, max pano date, and num. of distinct pano dates per anchor XY
-    
-    Arguments:
-        anchor_records {dict} -- Dictionary with xy as keys and records at xy as entries
-        x_col {int} -- Index of x-coordinate column
-        y_col {int} -- Index of y-coordinate column        
-    
-    Returns:
-        list -- List containing the xy and its biggest time difference
-    """    
-    xy_stats = []
-
-    for a in xy_records:
-        timestamps = [datetime.strptime(entry[2], '%Y-%m') for entry in xy_records[a]]
-        min_time = min(timestamps)
-        max_time = max(timestamps)
-        num_timesteps = len(set(timestamps))
-
-        month_timediff = 12 * (max_time.year - min_time.year) + (max_time.month - min_time.month)
-        year_timediff = month_timediff/12
-
-        xy_stats.append([xy_records[a][0][0],
-                        xy_records[a][0][x_col],
-                        xy_records[a][0][y_col],
-                        min_time,
-                        max_time,
-                        month_timediff,
-                        year_timediff,
-                        num_timesteps])
+import csv
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point
+
+from svdiscover import instrument
+from svdiscover.database import capture_dates_to_months, months_to_datetime
+
+FIRST_PANO_DATE = datetime(2005, 1, 1) # Streetview went into alpha in 2005, so 2005 is taken as the earliest possible date
+
+def add_pano_stats_to_polygons(pano_db, poly):
+    """Adds panorama availability statistics of panoramas within an input polygon
+
+    Args:
+        pano_db (svdiscover.database.StreetviewDB): SQLite database containing panorama statistics
+        poly (GeoPandas dataframe): Dataframe with polygon geometries
+
+    Returns:
+        GeoPandas dataframe: Input dataframe with added statistics
+    """    
+    # Accounting for GeoPandas geometry and Shapely polygon objects
+    if type(poly['geometry'].bounds) == tuple:
+        xmin, ymin, xmax, ymax = poly['geometry'].bounds
+    else:
+        xmin, ymin, xmax, ymax = poly['geometry'].bounds.values[0]
+    
+    # Get points which are inside of the extent of the polygon
+    panos_in_approx_range = pano_db.get_records_in_bbox(xmin, ymin, xmax, ymax)
+    ids_with_pts = {}
+    for _,row in panos_in_approx_range.iterrows():
+        ids_with_pts[row['pano_id']] = Point([row['pano_x'], row['pano_y']])
+    
+    # Keep only those points that intersect the polygon
+    pano_ids_in_poly = [p for p in ids_with_pts if gpd.GeoSeries(poly['geometry']).intersects(ids_with_pts[p]).any()]
+    panos_in_poly = panos_in_approx_range[panos_in_approx_range['pano_id'].isin(pano_ids_in_poly)]
+
+    # Calculate pano stats over all panos in poly
+    if not panos_in_poly.empty:
+        poly = calculate_pano_timestats(poly, panos_in_poly)
+
+    return poly
+
+def add_pano_stats_to_all_polygons(pano_db, polys):
+    """Adds panorama availability statistics to every polygon of a dataframe at once.
+    Panos in the extent of all polygons are loaded with one query, matched to the polygons with a single
+    spatial join and summarized with a grouped aggregation.
+
+    Args:
+        pano_db (svdiscover.database.StreetviewDB): SQLite database containing panorama statistics
+        polys (GeoPandas dataframe): Dataframe with polygon geometries, in the coordinate system of the stored panos
+
+    Returns:
+        GeoPandas dataframe: Input dataframe with added statistics. Polygons without panos get missing values
+    """
+    xmin, ymin, xmax, ymax = polys.total_bounds
+    panos = pano_db.get_records_in_bbox(xmin, ymin, xmax, ymax)
+    return calculate_pano_timestats_per_polygon(polys, panos)
+
+@instrument.instrumented('polygon_stats', rows=len)
+def calculate_pano_timestats_per_polygon(polys, panos):
+    """From a dataframe of panoramas, calculates basic availability statistics for every polygon of a dataframe.
+    Panos which are stored for several subregions are counted once.
+
+    Args:
+        polys (GeoPandas dataframe): Dataframe with polygon geometries
+        panos (Pandas dataframe): Dataframe with pano_id, pano_x, pano_y and capture_date columns
+
+    Returns:
+        Geopandas dataframe: Copy of the input dataframe with added statistics
+    """
+    panos = panos.drop_duplicates('pano_id')
+    pano_pts = gpd.GeoDataFrame({'capture_date': panos['capture_date'].values},
+                                geometry=gpd.points_from_xy(panos['pano_x'], panos['pano_y']),
+                                crs=polys.crs)
+
+    # Join on polygon positions so that the index of the input dataframe does not need to be unique
+    poly_geoms = gpd.GeoDataFrame(geometry=polys.geometry.values, crs=polys.crs)
+    panos_in_polys = gpd.sjoin(pano_pts, poly_geoms, how='inner', predicate='intersects')
+    date_stats = panos_in_polys.groupby('index_right')['capture_date'].agg(['min', 'max', 'mean'])
+    date_stats = date_stats.reindex(range(len(polys)))
+
+    earliest_pano_date = date_stats['min']
+    latest_pano_date = date_stats['max']
+    has_panos = earliest_pano_date.notna().values
+
+    polys = polys.copy()
+    polys['earliest'] = earliest_pano_date.dt.date.astype(str).where(has_panos).values
+    polys['earliest_year'] = earliest_pano_date.dt.year.astype('Int64').values
+    polys['latest'] = latest_pano_date.dt.date.astype(str).where(has_panos).values
+    polys['latest_year'] = latest_pano_date.dt.year.astype('Int64').values
+    polys['mean_date'] = date_stats['mean'].dt.date.astype(str).where(has_panos).values
+    polys['rel_earliest_days'] = (earliest_pano_date - FIRST_PANO_DATE).dt.days.astype('Int64').values
+    polys['range_days'] = (latest_pano_date - earliest_pano_date).dt.days.astype('Int64').values
+
+    return polys
+
+def calculate_pano_timestats(poly, panos):
+    """From a dataframe of panoramas, calculates basic availability statistics for a given polygon
+
+    Args:
+        poly (GeoPandas dataframe): Dataframe with polygon geometries
+        poly (Pandas dataframe): Dataframe with polygon geometries
+
+    Returns:
+        Geopandas dataframe: Input dataframe with added statistics
+    """    
+    # Calculate differences between earliest and latest panoramas
+    earliest_pano_date = panos['capture_date'].min()
+    latest_pano_date = panos['capture_date'].max()
+    mean_pano_date = panos['capture_date'].mean()
+    panos_range_days = (latest_pano_date - earliest_pano_date).days
+
+    # Calculate time diffference to start of streetview
+    days_rel_to_earliest_date = (earliest_pano_date - FIRST_PANO_DATE).days    
+
+    # Assign to row
+    poly['earliest'] = str(earliest_pano_date.date())
+    poly['earliest_year'] = int(earliest_pano_date.date().year)
+    poly['latest'] = str(latest_pano_date.date())
+    poly['latest_year'] = int(latest_pano_date.date().year)
+    poly['mean_date'] = str(mean_pano_date.date())
+    poly['rel_earliest_days'] = days_rel_to_earliest_date
+    poly['range_days'] = panos_range_days
+
+    return poly
+
+XYGroups = namedtuple('XYGroups', ['labels', 'order', 'offsets', 'x', 'y'])
+XYGroups.__doc__ = """Records grouped by location, stored as compact index arrays.
+The records of group i are order[offsets[i]:offsets[i + 1]], labels holds the group of every input record
+and x & y hold the location of the first record of every group."""
+
+def group_xy(x, y, tolerance=None):
+    """Groups coordinates by location in a single sorted pass, without requiring sorted input.
+    With a tolerance, coordinates are quantized to integer cells of a grid, so that all points in the same cell form a group.
+
+    Arguments:
+        x {array-like} -- X coordinates
+        y {array-like} -- Y coordinates
+
+    Keyword Arguments:
+        tolerance {float} -- Size of the grid cells, in the units of the coordinates. None groups identical coordinates (default: {None})
+
+    Returns:
+        XYGroups -- Group label of every record and the record indices of every group
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if tolerance:
+        key_x = np.floor(x / tolerance)
+        key_y = np.floor(y / tolerance)
+    else:
+        key_x, key_y = x, y
+
+    if tolerance and len(x) > 0 and (np.ptp(key_x) + 1) * (np.ptp(key_y) + 1) < 2 ** 62:
+        # Combine both cell indices into one integer key, which sorts much faster than two columns
+        key_x = (key_x - key_x.min()).astype(np.int64)
+        key_y = (key_y - key_y.min()).astype(np.int64)
+        keys = key_x * (key_y.max() + 1) + key_y
+    else:
+        # Complex numbers sort by their real part first and imaginary part second
+        keys = key_x + 1j * key_y
+
+    # A stable sort keeps records in input order within every group, so the first record of a group is its first occurrence
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+
+    group_starts = np.flatnonzero(is_group_start)
+    offsets = np.append(group_starts, len(order))
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = np.cumsum(is_group_start) - 1
+    return XYGroups(labels, order, offsets, x[order[group_starts]], y[order[group_starts]])
+
+def group_by_xy(records, x_col, y_col, precision=-1):
+    """Groups panoramas by their xy location. Records do not need to be sorted.
+    
+    Arguments:
+        records {List of lists} -- Contains records extracted from a Streetview database
+        x_col {int} -- Index of x-coordinate column
+        y_col {int} -- Index of y-coordinate column
+
+    Keyword Arguments:
+        precision {int} -- Number of decimals used for grouping. -1 is all digits. (default: {-1})
+    
+    Returns:
+        dict -- Contains records grouped by their anchor location as dict key
+    """    
+    records = list(records)
+    x = np.array([record[x_col] for record in records], dtype=np.float64)
+    y = np.array([record[y_col] for record in records], dtype=np.float64)
+    if precision >= 0:
+        x, y = np.round(x, precision), np.round(y, precision)
+
+    xy_groups = group_xy(x, y)
+    groups = {}
+    for i in range(len(xy_groups.x)):
+        group_records = xy_groups.order[xy_groups.offsets[i]:xy_groups.offsets[i + 1]]
+        first_record = records[group_records[0]]
+        groups[f'{first_record[x_col]}-{first_record[y_col]}'] = [records[j] for j in group_records]
+    return groups
+
+@instrument.instrumented('timestats', rows=len)
+def xy_timestats(x, y, capture_dates, tolerance=None):
+    """Calculates biggest timedif, min pano date, max pano date, and num. of distinct pano dates per location.
+    Capture dates are converted to month numbers (year * 12 + month) once, after which all statistics are
+    computed with grouped array reductions.
+
+    Arguments:
+        x {array-like} -- X coordinates of the panos or their anchors
+        y {array-like} -- Y coordinates of the panos or their anchors
+        capture_dates {array-like} -- Capture dates as datetimes, 'YYYY-M' strings or month numbers
+
+    Keyword Arguments:
+        tolerance {float} -- Size of the grid cells used for grouping locations. None groups identical coordinates (default: {None})
+
+    Returns:
+        {pandas.DataFrame} -- One row per location with x, y, min_time, max_time, month_timediff, year_timediff & num_timesteps
+    """
+    capture_dates = np.asarray(capture_dates)
+    if np.issubdtype(capture_dates.dtype, np.number):
+        capture_months = capture_dates.astype(np.float64)
+    else:
+        capture_months = capture_dates_to_months(capture_dates)
+    has_date = ~np.isnan(capture_months)
+    x = np.asarray(x, dtype=np.float64)[has_date]
+    y = np.asarray(y, dtype=np.float64)[has_date]
+    capture_months = capture_months[has_date].astype(np.int64)
+
+    xy_groups = group_xy(x, y, tolerance)
+    min_month, max_month, num_timesteps = _grouped_month_stats(xy_groups.labels, capture_months, len(xy_groups.x))
+    month_timediff = max_month - min_month
+
+    return pd.DataFrame({'x': xy_groups.x,
+                         'y': xy_groups.y,
+                         'min_time': months_to_datetime(min_month),
+                         'max_time': months_to_datetime(max_month),
+                         'month_timediff': month_timediff,
+                         'year_timediff': month_timediff / 12,
+                         'num_timesteps': num_timesteps})
+
+def _grouped_month_stats(labels, capture_months, n_groups):
+    """Minimum month, maximum month and number of distinct months for every group label.
+    Groups without months get a minimum and maximum month of 0."""
+    if len(capture_months) == 0:
+        return (np.zeros(n_groups, dtype=np.int64),) * 3
+
+    # Sorting the distinct (group, month) pairs orders the months within every group
+    first_month = capture_months.min()
+    n_months = capture_months.max() - first_month + 1
+    group_months = np.sort(labels * n_months + (capture_months - first_month))
+    is_distinct = np.ones(len(group_months), dtype=bool)
+    is_distinct[1:] = group_months[1:] != group_months[:-1]
+    group_months = group_months[is_distinct]
+    group_labels = group_months // n_months
+    months = group_months % n_months + first_month
+
+    num_timesteps = np.bincount(group_labels, minlength=n_groups)
+    group_ends = np.cumsum(num_timesteps)
+    has_months = num_timesteps > 0
+    min_month = np.zeros(n_groups, dtype=np.int64)
+    max_month = np.zeros(n_groups, dtype=np.int64)
+    min_month[has_months] = months[(group_ends - num_timesteps)[has_months]]
+    max_month[has_months] = months[group_ends[has_months] - 1]
+    return min_month, max_month, num_timesteps
+
+def get_xy_timestats(xy_records, x_col, y_col):
+    """Calculates biggest timedif, min pano date, max pano date, and num. of distinct pano dates per anchor XY
+    
+    Arguments:
+        anchor_records {dict} -- Dictionary with xy as keys and records at xy as entries
+        x_col {int} -- Index of x-coordinate column
+        y_col {int} -- Index of y-coordinate column        
+    
+    Returns:
+        list -- List containing the xy and its biggest time difference. Dates and time differences are None
+                for an XY without valid capture dates
+    """    
+    groups = list(xy_records.values())
+    group_sizes = [len(records) for records in groups]
+    labels = np.repeat(np.arange(len(groups)), group_sizes)
+    capture_months = capture_dates_to_months([entry[2] for records in groups for entry in records])
+    # Missing or invalid capture dates are NaN months, which are left out rather than cast to integers
+    has_date = ~np.isnan(capture_months)
+    min_month, max_month, num_timesteps = _grouped_month_stats(labels[has_date], capture_months[has_date].astype(np.int64), len(groups))
+
+    has_months = num_timesteps > 0
+    min_times = months_to_datetime(np.where(has_months, min_month, np.nan)).astype('datetime64[us]').tolist()
+    max_times = months_to_datetime(np.where(has_months, max_month, np.nan)).astype('datetime64[us]').tolist()
+    month_timediffs = [int(diff) if has else None for diff, has in zip(max_month - min_month, has_months)]
+
+    xy_stats = []
+    for i, records in enumerate(groups):
+        xy_stats.append([records[0][0],
+                        records[0][x_col],
+                        records[0][y_col],
+                        min_times[i],
+                        max_times[i],
+                        month_timediffs[i],
+                        month_timediffs[i]/12 if month_timediffs[i] is not None else None,
+                        int(num_timesteps[i])])
     return xy_stats
\ No newline at end of file
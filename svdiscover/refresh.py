@@ -0,0 +1,206 @@
+from datetime import date
+from math import cos, radians
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from svdiscover.cache import METERS_PER_DEGREE
+from svdiscover.database import RecordFilter
+from svdiscover.sampling import grid_xy_in_poly, prepared, store_panos_from_sample_pts
+
+ANCHOR_KEYS = ['subregion_name', 'anchor_x', 'anchor_y']
+
+class AnchorBackoff():
+    """Keeps track of when the anchors of a region table were last refreshed, and how many refreshes in a row
+    returned no new panos. Every refresh without new panos doubles the age at which the anchor is due again.
+
+    Arguments:
+        sv_db {StreetviewDB} -- Database in which the backoff table is stored
+
+    Keyword Arguments:
+        table_name {str} -- Name of the backoff table (default: {'refresh_backoff'})
+    """
+    def __init__(self, sv_db, table_name='refresh_backoff'):
+        self.sv_db = sv_db
+        self.table_name = table_name
+        sv_db.execute_cmd(f'''CREATE TABLE IF NOT EXISTS {table_name}
+                                (subregion_name VARCHAR,
+                                anchor_x REAL,
+                                anchor_y REAL,
+                                last_lookup VARCHAR,
+                                no_change_count INTEGER,
+                                PRIMARY KEY (subregion_name, anchor_x, anchor_y)
+                                ) WITHOUT ROWID''')
+
+    def load(self):
+        """Reads the refresh state of all anchors
+
+        Returns:
+            {pandas.DataFrame} -- Subregion name, anchor coordinates, date of the last lookup and number of unchanged refreshes
+        """
+        return pd.read_sql_query(f'SELECT * FROM {self.table_name}', self.sv_db.db)
+
+    def record(self, anchor_results, lookup_date=None, manual_commit=False):
+        """Stores the outcome of refreshed anchors
+
+        Arguments:
+            anchor_results {iterable} -- Tuples of subregion name, anchor X, anchor Y and whether new panos were found
+
+        Keyword Arguments:
+            lookup_date {str} -- Date of the refresh, defaults to today (default: {None})
+            manual_commit {bool} -- Commit after completing (default: {False})
+        """
+        lookup_date = lookup_date or str(date.today())
+        values = [(subregion_name, x, y, lookup_date, has_new_panos, subregion_name, x, y)
+                  for subregion_name, x, y, has_new_panos in anchor_results]
+        try:
+            self.sv_db.cursor.executemany(f'''INSERT OR REPLACE INTO {self.table_name}
+                                              SELECT ?, ?, ?, ?,
+                                                  CASE WHEN ? THEN 0 ELSE COALESCE(
+                                                      (SELECT no_change_count + 1 FROM {self.table_name}
+                                                       WHERE subregion_name = ? AND anchor_x = ? AND anchor_y = ?), 1) END''',
+                                          values)
+            if not manual_commit:
+                self.sv_db.db.commit()
+        except Exception as e:
+            self.sv_db.db.rollback()
+            raise e
+
+def select_anchors(sv_db, backoff, max_age_days=30, max_backoff_days=360, changed_areas=None, subregions=None, today=None,
+                   job_id=None, cache=None, grid_resolution=20):
+    """Selects the anchors of the target table which are due for a refresh. An anchor is due when its last lookup
+    is older than max_age_days, doubled for every earlier refresh which returned no new panos, or when it lies
+    in an area that is flagged as changed. Anchors are the sample points of earlier lookups which returned panos,
+    and with a job id all sample points of that discovery job, so that points which returned nothing are refreshed too.
+    Changed areas are sampled again on a grid, and every new point is assigned to the subregion of the nearest anchor,
+    so changed areas should lie within the sampled regions.
+
+    Arguments:
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a target table
+        backoff {AnchorBackoff} -- Refresh state of the anchors
+
+    Keyword Arguments:
+        max_age_days {int} -- Age in days of the last lookup after which an anchor is refreshed (default: {30})
+        max_backoff_days {int} -- Upper limit of the backed-off age in days (default: {360})
+        changed_areas {Shapely geometry} -- Areas in WGS84 coordinates in which all anchors are refreshed (default: {None})
+        subregions {str or iterable} -- Only refresh anchors of these subregions (default: {None})
+        today {date} -- Date to compute ages against, defaults to today (default: {None})
+        job_id {str} -- Discovery job of which all sample points are anchors, requires a job table (default: {None})
+        cache {LookupCache} -- Cache of earlier lookups, which dates anchors that returned no panos (default: {None})
+        grid_resolution {float} -- Resolution in meters of the grid sampled in changed areas (default: {20})
+
+    Returns:
+        {pandas.DataFrame} -- Subregion name & anchor coordinates of the anchors to refresh
+    """
+    today = pd.Timestamp(today or date.today())
+    anchors = _load_anchors(sv_db, subregions, job_id, cache)
+    anchors = anchors.merge(backoff.load(), on=ANCHOR_KEYS, how='left')
+
+    last_lookup = pd.to_datetime(anchors['last_lookup'].fillna(anchors['lookup_date']), errors='coerce')
+    no_change_count = anchors['no_change_count'].fillna(0).to_numpy()
+    max_age = np.minimum(max_age_days * 2. ** no_change_count, max(max_age_days, max_backoff_days))
+    is_due = (last_lookup.isna() | (last_lookup <= today - pd.to_timedelta(max_age, unit='D'))).to_numpy()
+    if changed_areas is None:
+        return anchors.loc[is_due, ANCHOR_KEYS].reset_index(drop=True)
+
+    changed_areas = prepared(changed_areas)
+    is_due = is_due | shapely.intersects_xy(changed_areas, anchors['anchor_x'].to_numpy(), anchors['anchor_y'].to_numpy())
+    resampled = _resample_changed_areas(changed_areas, anchors[ANCHOR_KEYS], grid_resolution)
+    due_anchors = pd.concat([anchors.loc[is_due, ANCHOR_KEYS], resampled], ignore_index=True)
+    return due_anchors.drop_duplicates(ANCHOR_KEYS, ignore_index=True)
+
+def _load_anchors(sv_db, subregions=None, job_id=None, cache=None):
+    """Reads the anchors of stored panos with their last lookup date, and the sample points of a job.
+    Sample points without stored panos are dated by the cache, or left undated so that they are due."""
+    where_clause, params = sv_db.compile_where(RecordFilter(subregions=subregions))
+    query = f'SELECT subregion_name, anchor_x, anchor_y, MAX(lookup_date) AS lookup_date FROM {sv_db.table}'
+    if where_clause:
+        query += f' WHERE {where_clause}'
+    anchors = pd.read_sql_query(f'{query} GROUP BY subregion_name, anchor_x, anchor_y', sv_db.db, params=params)
+    if job_id is None:
+        return anchors
+
+    job_anchors = sv_db.get_job_points(job_id, subregions).rename(columns={'x': 'anchor_x', 'y': 'anchor_y'})
+    job_anchors = job_anchors[ANCHOR_KEYS].drop_duplicates()
+    anchors = anchors.merge(job_anchors, on=ANCHOR_KEYS, how='outer')
+    if cache is not None:
+        cached_dates = pd.read_sql_query(f'SELECT cell_x, cell_y, lookup_date FROM {cache.table_name}', sv_db.db)
+        cells = pd.DataFrame({'cell_x': np.round(anchors['anchor_x'].to_numpy() / cache.tolerance).astype(np.int64),
+                              'cell_y': np.round(anchors['anchor_y'].to_numpy() / cache.tolerance).astype(np.int64)})
+        cached_dates = cells.merge(cached_dates, on=['cell_x', 'cell_y'], how='left')['lookup_date']
+        anchors['lookup_date'] = anchors['lookup_date'].fillna(pd.Series(cached_dates.to_numpy(), index=anchors.index))
+    return anchors
+
+def _resample_changed_areas(changed_areas, anchors, grid_resolution):
+    """Grid points in changed areas, assigned to the subregion of the nearest anchor.
+    The areas are scaled to meters at their mean latitude, which is accurate enough for the size of a grid cell."""
+    if anchors.empty:
+        return anchors
+    _, ymin, _, ymax = changed_areas.bounds
+    scale = np.array([METERS_PER_DEGREE * cos(radians((ymin + ymax) / 2)), METERS_PER_DEGREE])
+    xy = grid_xy_in_poly(shapely.transform(changed_areas, lambda coords: coords * scale), grid_resolution) / scale
+    anchor_xy = anchors[['anchor_x', 'anchor_y']].to_numpy()
+    tree = shapely.STRtree(shapely.points(anchor_xy * scale))
+    pt_idx, anchor_idx = tree.query_nearest(shapely.points(xy * scale), all_matches=False)
+    return pd.DataFrame({'subregion_name': anchors['subregion_name'].to_numpy()[anchor_idx],
+                         'anchor_x': xy[pt_idx, 0],
+                         'anchor_y': xy[pt_idx, 1]})
+
+def refresh(sv_db, max_age_days=30, max_backoff_days=360, changed_areas=None, subregions=None, backoff=None,
+            n_workers=1, requests_per_second=None, lookup_func=None, pool=None, job_id=None, cache=None, grid_resolution=20):
+    """Incrementally refreshes the target table: only anchors which are due are looked up again, and only panos
+    which are not stored yet for their subregion are added. Anchors that returned no new panos are backed off.
+    See select_anchors for which anchors are refreshed.
+
+    Arguments:
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a target table
+
+    Keyword Arguments:
+        max_age_days {int} -- Age in days of the last lookup after which an anchor is refreshed (default: {30})
+        max_backoff_days {int} -- Upper limit of the backed-off age in days (default: {360})
+        changed_areas {Shapely geometry} -- Areas in WGS84 coordinates which are sampled again (default: {None})
+        subregions {str or iterable} -- Only refresh anchors of these subregions (default: {None})
+        backoff {AnchorBackoff} -- Refresh state of the anchors, defaults to the 'refresh_backoff' table (default: {None})
+        n_workers {int} -- Number of concurrent lookups (default: {1})
+        requests_per_second {float} -- Maximum request rate, None for no limit (default: {None})
+        lookup_func {callable} -- Replacement for streetview.panoids, e.g. a local stub (default: {None})
+        pool {PanoLookupPool} -- Existing lookup pool to use instead of n_workers & requests_per_second (default: {None})
+        job_id {str} -- Discovery job of which all sample points are refreshed, requires a job table (default: {None})
+        cache {LookupCache} -- Cache of earlier lookups, which dates anchors that returned no panos. Refreshed
+                               anchors are always looked up again rather than read from the cache (default: {None})
+        grid_resolution {float} -- Resolution in meters of the grid sampled in changed areas (default: {20})
+
+    Returns:
+        {dict} -- Number of refreshed anchors, anchors with new panos and new panos
+    """
+    backoff = backoff or AnchorBackoff(sv_db)
+    anchors = select_anchors(sv_db, backoff, max_age_days, max_backoff_days, changed_areas, subregions,
+                             job_id=job_id, cache=cache, grid_resolution=grid_resolution)
+    stats = {'anchors': len(anchors), 'changed_anchors': 0, 'new_panos': 0}
+
+    for subregion_name, subregion_anchors in anchors.groupby('subregion_name', sort=False):
+        sample_pts = list(zip(subregion_anchors['anchor_x'].tolist(), subregion_anchors['anchor_y'].tolist()))
+        anchor_results = []
+
+        def on_result(sample_pt, panos):
+            # Results are handed over on the writing thread, before the new entries are flushed, so a pano that
+            # is new to several anchors of the same batch marks all of them as changed
+            pano_ids = [pano['panoid'] for pano in panos if 'year' in pano]
+            has_new_panos = bool(set(pano_ids) - _stored_pano_ids(sv_db, subregion_name, pano_ids))
+            stats['changed_anchors'] += has_new_panos
+            anchor_results.append((subregion_name, *sample_pt, has_new_panos))
+
+        # New panos are counted from the inserted rows, as a pano may be returned by several anchors
+        stats['new_panos'] += store_panos_from_sample_pts(sample_pts, subregion_name, sv_db, n_workers,
+                                                          requests_per_second, lookup_func, pool=pool,
+                                                          on_result=on_result)
+        backoff.record(anchor_results)
+    return stats
+
+def _stored_pano_ids(sv_db, subregion_name, pano_ids):
+    """Selects which of the pano IDs are already stored for a subregion"""
+    if not pano_ids:
+        return set()
+    where_clause, params = sv_db.compile_where(RecordFilter(subregions=subregion_name, pano_ids=pano_ids))
+    return {row[0] for row in sv_db.cursor.execute(f'SELECT pano_id FROM {sv_db.table} WHERE {where_clause}', params)}
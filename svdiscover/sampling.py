@@ -1,107 +1,441 @@
-from time import sleep
-from math import floor, ceil
-from datetime import date
-
-import streetview
-import geopandas as gpd
-from pyproj import Proj, CRS, Transformer
-from shapely.geometry import MultiPoint
-from shapely.ops import transform
-
-def sample_pts_in_poly(poly_geom, grid_resolution=20):
-    """Creates a point every n meters in a regular grid set by the grid resolution.
-    Coordinate system of input geometry should be in meters (Use the UTM zone that intersects your polgyon if unsure)
-
-    Arguments:
-        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in which points must fall
-        grid_resolution {integer} -- Resolution in meters
-    
-    Keyword Arguments:
-        n_samples {int} -- Number of points to sample. Default will sample based on polygon area (default: 20 meters)
-    
-    Returns:
-        {shapely.geometry.MultiPoint} -- Shapely MultiPoint object containing all coordinate pairs
-    """    
-    xmin_orig, ymin_orig, xmax_orig, ymax_orig = poly_geom.bounds
-
-    # Generate XY pairs with spacing set by the grid resolution
-    xy_pairs = []
-    for x in range(floor(xmin_orig), ceil(xmax_orig), grid_resolution):
-        for y in range(floor(ymin_orig), ceil(ymax_orig), grid_resolution):
-            xy_pairs.append((x, y))
-    grid_points_in_extent = MultiPoint(xy_pairs)
-    
-    # Keep only points which intersect the input polygon
-    sample_pts = poly_geom.intersection(grid_points_in_extent)
-
-    return sample_pts
-
-def reproject_to_wgs(geometry, in_proj, out_proj='EPSG:4326'):
-    """Reprojects a Shapely geometry to an output projection
-
-    Args:
-        geometry (Shapely.geometry): [description]
-        in_proj (str): EPSG description of the input project system
-        out_proj (str, optional): EPSG description of the input project system. Defaults to 'EPSG:4326'.
-
-    Returns:
-        {Shapely.geometry}: The input Shapely geometry reprojected to the output projection
-    """
-    in_proj = CRS(in_proj)
-    out_proj = CRS('EPSG:4326')        
-    projection = Transformer.from_crs(in_proj, out_proj, always_xy=True).transform
-    geom_resampled = transform(projection, geometry)
-    return geom_resampled
-
-def store_panos_from_sample_pts(sample_pts, subregion_name, sv_db):
-    """Retrieves panoramas and stores them in a SQLite database
-    
-    Arguments:
-        sample_pts {list} -- List of coordinate pairs
-        subregion_name {str} -- Subregion name to fill in the region table
-        sv_db {StreetviewDB} -- SQLite database for panorama IDs
-    """    
-    for sample_pt in sample_pts:
-        entries = panos_from_coord_pair(sample_pt, subregion_name)
-        if len(entries) > 0:
-            for entry in entries:
-                sv_db.add_entry(entry, manual_commit=True)
-        sv_db.db.commit()
-        sleep(0.01)
-
-
-def panos_from_coord_pair(sample_pt, subregion_name=''):
-    """Get all panoramas with a date from a coordinate pair
-    
-    Arguments:
-        sample_pt {list} -- List containing an X and Y coordinate in WGS84 coordinates
-    
-    Keyword Arguments:
-        subregion_name {str} -- Optional subregion name for keeping track of aggregations (default: {''})
-    
-    Returns:
-        {list} -- List containing dictionaries of all panoramas at the coordinate pairs
-    """
-    try:    
-        anchor_pano = streetview.panoids(lat=sample_pt[1], lon=sample_pt[0])
-    except:
-        print("Querying errors, retrying in 30 seconds")
-        sleep(30)
-        anchor_pano = streetview.panoids(lat=sample_pt[1], lon=sample_pt[0])
-
-    entries = []
-    if len(anchor_pano) > 0:
-        for pano in anchor_pano:
-            if 'year' in pano:
-                entry = {'subregion_name': subregion_name,
-                            'pano_id': pano['panoid'],
-                            'capture_date': f'{pano["year"]}-{pano["month"]}',
-                            'anchor_x': sample_pt[0],
-                            'anchor_y': sample_pt[1],
-                            'pano_x': pano['lon'],
-                            'pano_y': pano['lat'],
-                            'lookup_date': str(date.today()),
-                            'download_date': '',
-                            'saved_path': ''}
-                entries.append(entry)
-    return entries
+from copy import copy
+from math import floor, ceil
+from datetime import date
+from functools import lru_cache, partial
+from itertools import islice
+
+import numpy as np
+import shapely
+import geopandas as gpd
+from pyproj import CRS, Transformer
+from shapely.geometry import MultiPoint, box
+
+from svdiscover import instrument
+from svdiscover.backends import StreetviewBackend
+from svdiscover.lookup import PanoLookupPool, RateLimiter, call_with_backoff
+from svdiscover.database import JobPoint, PENDING, IN_FLIGHT, DONE
+
+def sample_pts_in_poly(poly_geom, grid_resolution=20):
+    """Creates a point every n meters in a regular grid set by the grid resolution.
+    Coordinate system of input geometry should be in meters (Use the UTM zone that intersects your polgyon if unsure)
+
+    Arguments:
+        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in which points must fall
+        grid_resolution {integer} -- Resolution in meters
+    
+    Keyword Arguments:
+        n_samples {int} -- Number of points to sample. Default will sample based on polygon area (default: 20 meters)
+    
+    Returns:
+        {shapely.geometry.MultiPoint} -- Shapely MultiPoint object containing all coordinate pairs
+    """
+    return MultiPoint(grid_xy_in_poly(poly_geom, grid_resolution))
+
+def grid_xy_in_poly(poly_geom, grid_resolution=20, tile_size=1000):
+    """Creates a point every n meters in a regular grid set by the grid resolution and returns their coordinates as an array.
+    Candidate points are filtered with a vectorized point-in-polygon test, so only points inside the polygon are kept in memory.
+
+    Arguments:
+        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in which points must fall, in a metric coordinate system
+
+    Keyword Arguments:
+        grid_resolution {integer} -- Resolution in meters (default: {20})
+        tile_size {int} -- Number of grid cells along each side of a tile tested at once (default: {1000})
+
+    Returns:
+        {numpy.ndarray} -- Array of shape (n, 2) with the XY coordinates of all points inside the polygon
+    """
+    xy_tiles = list(iter_grid_xy_in_poly(poly_geom, grid_resolution, tile_size))
+    if not xy_tiles:
+        return np.empty((0, 2))
+    return np.concatenate(xy_tiles)
+
+def iter_grid_xy_in_poly(poly_geom, grid_resolution=20, tile_size=1000):
+    """Lazily yields the grid points inside a polygon, one tile at a time.
+    The bounds of the polygon are split into square tiles of the grid and only the points of one tile are generated
+    at a time. Peak memory therefore depends on the tile size and not on the polygon area. Points are tested against
+    the whole polygon, so the output does not depend on the tile size and matches grid_xy_in_poly.
+
+    Arguments:
+        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in which points must fall, in a metric coordinate system
+
+    Keyword Arguments:
+        grid_resolution {integer} -- Resolution in meters (default: {20})
+        tile_size {int} -- Number of grid cells along each side of a tile (default: {1000})
+
+    Yields:
+        {numpy.ndarray} -- Array of shape (n, 2) with the XY coordinates of the points inside the polygon within one tile
+    """
+    poly_geom = prepared(poly_geom)
+    for tile_xs, tile_ys in iter_grid_tiles(poly_geom, grid_resolution, tile_size):
+        with instrument.timed('sample') as event:
+            xy = grid_xy_in_tile(poly_geom, tile_xs, tile_ys)
+            # Tiles outside the polygon are not counted as calls of the stage
+            event['rows'] = len(xy)
+            event['skipped'] = len(xy) == 0
+        if len(xy) > 0:
+            yield xy
+
+def prepared(geometry):
+    """Returns a prepared geometry for fast repeated predicates, without changing the input
+
+    Arguments:
+        geometry {shapely.geometry} -- Geometry to prepare
+
+    Returns:
+        {shapely.geometry} -- The geometry itself if it is prepared already, otherwise a prepared copy
+    """
+    if shapely.is_prepared(geometry):
+        return geometry
+    # A copy is prepared, so that the geometry of the caller is left untouched
+    geometry = copy(geometry)
+    shapely.prepare(geometry)
+    return geometry
+
+def iter_grid_tiles(poly_geom, grid_resolution=20, tile_size=1000):
+    """Splits the sampling grid of a polygon into square tiles, without generating their points
+
+    Arguments:
+        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in which points must fall, in a metric coordinate system
+
+    Keyword Arguments:
+        grid_resolution {integer} -- Resolution in meters (default: {20})
+        tile_size {int} -- Number of grid cells along each side of a tile (default: {1000})
+
+    Yields:
+        {tuple} -- Arrays with the X coordinates of the grid columns and the Y coordinates of the grid rows of a tile
+    """
+    xmin_orig, ymin_orig, xmax_orig, ymax_orig = poly_geom.bounds
+    x_origin, y_origin = floor(xmin_orig), floor(ymin_orig)
+    n_cols = max(0, ceil((ceil(xmax_orig) - x_origin) / grid_resolution))
+    n_rows = max(0, ceil((ceil(ymax_orig) - y_origin) / grid_resolution))
+    for col in range(0, n_cols, tile_size):
+        tile_xs = x_origin + grid_resolution * np.arange(col, min(col + tile_size, n_cols), dtype=np.float64)
+        for row in range(0, n_rows, tile_size):
+            yield tile_xs, y_origin + grid_resolution * np.arange(row, min(row + tile_size, n_rows), dtype=np.float64)
+
+def grid_xy_in_tile(poly_geom, tile_xs, tile_ys):
+    """Returns the grid points of a tile which intersect the polygon. Prepare the polygon for repeated calls.
+
+    Arguments:
+        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in which points must fall
+        tile_xs {numpy.ndarray} -- X coordinates of the grid columns of the tile
+        tile_ys {numpy.ndarray} -- Y coordinates of the grid rows of the tile
+
+    Returns:
+        {numpy.ndarray} -- Array of shape (n, 2) with the XY coordinates of the points inside the polygon
+    """
+    tile = box(tile_xs[0], tile_ys[0], tile_xs[-1], tile_ys[-1])
+    if not poly_geom.intersects(tile):
+        return np.empty((0, 2))
+    grid_x, grid_y = np.meshgrid(tile_xs, tile_ys, indexing='ij')
+    grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+    if not poly_geom.contains(tile):
+        in_poly = shapely.intersects_xy(poly_geom, grid_x, grid_y)
+        grid_x, grid_y = grid_x[in_poly], grid_y[in_poly]
+    return np.column_stack([grid_x, grid_y])
+
+@lru_cache(maxsize=32)
+def get_transformer(in_proj, out_proj='EPSG:4326'):
+    """Returns a Transformer between two coordinate systems, cached per (source, target) pair
+
+    Arguments:
+        in_proj {str} -- EPSG description of the input projection system
+    
+    Keyword Arguments:
+        out_proj {str} -- EPSG description of the output projection system (default: {'EPSG:4326'})
+
+    Returns:
+        {pyproj.Transformer} -- Transformer with XY axis order for both coordinate systems
+    """
+    return Transformer.from_crs(CRS(in_proj), CRS(out_proj), always_xy=True)
+
+@instrument.instrumented('reproject', rows=lambda xy: np.size(xy[0]))
+def reproject_xy(x, y, in_proj, out_proj='EPSG:4326'):
+    """Reprojects arrays of X and Y coordinates in one vectorized call
+
+    Arguments:
+        x {numpy.ndarray} -- X coordinates
+        y {numpy.ndarray} -- Y coordinates
+        in_proj {str} -- EPSG description of the input projection system
+
+    Keyword Arguments:
+        out_proj {str} -- EPSG description of the output projection system (default: {'EPSG:4326'})
+
+    Returns:
+        {tuple} -- Arrays with the reprojected X and Y coordinates
+    """
+    return get_transformer(in_proj, out_proj).transform(x, y)
+
+def reproject_to_wgs(geometry, in_proj, out_proj='EPSG:4326'):
+    """Reprojects a Shapely geometry or an array of XY coordinates to an output projection
+
+    Args:
+        geometry (Shapely.geometry or numpy.ndarray): Geometry or array of shape (n, 2) with XY coordinates
+        in_proj (str): EPSG description of the input project system
+        out_proj (str, optional): EPSG description of the output project system. Defaults to 'EPSG:4326'.
+
+    Returns:
+        {Shapely.geometry or numpy.ndarray}: The input reprojected to the output projection
+    """
+    def project_coords(coords):
+        return np.column_stack(reproject_xy(coords[:, 0], coords[:, 1], in_proj, out_proj))
+
+    if isinstance(geometry, np.ndarray):
+        return project_coords(geometry)
+    return shapely.transform(geometry, project_coords)
+
+def iter_sample_pts(poly_geom, in_proj, grid_resolution=20, tile_size=1000):
+    """Lazily yields WGS84 sample points for a polygon, tile by tile.
+    Each tile of grid points is reprojected as a single array, so the points can be fed straight into
+    store_panos_from_sample_pts without holding all points of the polygon in memory.
+
+    Arguments:
+        poly_geom {shapely.geometry.polygon.Polygon} -- Target polygon in a metric coordinate system
+        in_proj {str} -- EPSG description of the coordinate system of the polygon
+
+    Keyword Arguments:
+        grid_resolution {integer} -- Resolution in meters (default: {20})
+        tile_size {int} -- Number of grid cells along each side of a tile (default: {1000})
+
+    Yields:
+        {tuple} -- XY coordinate pair in WGS84 coordinates
+    """
+    for xy_tile in iter_grid_xy_in_poly(poly_geom, grid_resolution, tile_size):
+        for sample_pt in reproject_to_wgs(xy_tile, in_proj).tolist():
+            yield tuple(sample_pt)
+
+def store_panos_from_sample_pts(sample_pts, subregion_name, sv_db, n_workers=1, requests_per_second=None, lookup_func=None, pool=None, cache=None, job_id=None, on_result=None, batch_size=1000):
+    """Retrieves panoramas and stores them in a SQLite database.
+    With more than one worker, lookups run concurrently while the calling thread remains the only writer to the database.
+    Entries are committed in batches rather than once per sample point, so an interruption loses the lookups of the
+    uncommitted batch. With a job id, every batch is committed together with a checkpoint of the finished sample points,
+    so that an interrupted run can be continued with resume() or by running it again with the same job id. A cache is
+    committed with the same batches, so a re-run without a job id reuses the committed lookups. Without a job id or
+    a cache nothing records which points were done; use batch_size=1 to commit after every sample point instead.
+    
+    Arguments:
+        sample_pts {iterable} -- Coordinate pairs in WGS84 coordinates
+        subregion_name {str} -- Subregion name to fill in the region table
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs
+
+    Keyword Arguments:
+        n_workers {int} -- Number of concurrent lookups (default: {1})
+        requests_per_second {float} -- Maximum request rate, None for no limit (default: {None})
+        lookup_func {callable} -- Replacement for streetview.panoids, e.g. a local stub (default: {None})
+        pool {PanoLookupPool} -- Existing lookup pool to use instead of n_workers & requests_per_second (default: {None})
+        cache {LookupCache} -- Cache of earlier lookups, which is consulted before and updated after every lookup (default: {None})
+        job_id {str} -- Name of the discovery job to checkpoint in the job table of the database (default: {None})
+        on_result {callable} -- Called with every sample point and its response from the writing thread, also for cached lookups (default: {None})
+        batch_size {int} -- Number of entries or processed sample points after which a transaction is committed (default: {1000})
+
+    Returns:
+        {int} -- Number of new records stored
+    """
+    if job_id is not None:
+        sample_pts = _iter_job_points(sample_pts, job_id, subregion_name, sv_db)
+    resolve = partial(cache.resolve, subregion_name=subregion_name) if cache is not None else None
+
+    writer = _ResultWriter(subregion_name, sv_db, cache, job_id, on_result, batch_size)
+    if pool is not None:
+        writer.store(pool.map(sample_pts, resolve))
+    elif n_workers > 1:
+        with PanoLookupPool(n_workers, requests_per_second, lookup_func) as pool:
+            writer.store(pool.map(sample_pts, resolve))
+    else:
+        rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+        writer.store(_iter_serial_lookups(sample_pts, lookup_func, rate_limiter, resolve))
+
+    if job_id is not None:
+        _finish_job_subregion(sv_db, job_id, subregion_name)
+    return writer.n_added
+
+def _finish_job_subregion(sv_db, job_id, subregion_name):
+    """Marks a subregion of a job as done once all of its sample points are registered and done"""
+    is_registered = sv_db.get_job_status(job_id).get(subregion_name) == IN_FLIGHT
+    if is_registered and next(sv_db.iter_job_points(job_id, subregion_name), None) is None:
+        sv_db.set_job_status(job_id, subregion_name, DONE)
+
+def resume(sv_db, job_id, **lookup_kwargs):
+    """Continues an interrupted discovery job from its last checkpoint, looking up only the sample points that are not done.
+    Subregions of which not all sample points were registered before the interruption are returned; run
+    store_panos_from_sample_pts for them again with the same job id to generate the rest of their points.
+
+    Arguments:
+        sv_db {StreetviewDB} -- SQLite database for panorama IDs, with a job table
+        job_id {str} -- Name of the discovery job
+
+    Keyword Arguments:
+        lookup_kwargs -- Keyword arguments for store_panos_from_sample_pts, such as n_workers or cache
+
+    Returns:
+        {list} -- Names of the subregions which still need their sample points to be generated
+    """
+    incomplete_subregions = []
+    for subregion_name, status in sv_db.get_job_status(job_id).items():
+        if status == DONE:
+            continue
+        job_pts = sv_db.iter_job_points(job_id, subregion_name)
+        store_panos_from_sample_pts(job_pts, subregion_name, sv_db, job_id=job_id, **lookup_kwargs)
+        if status == PENDING:
+            incomplete_subregions.append(subregion_name)
+    return incomplete_subregions
+
+def _iter_job_points(sample_pts, job_id, subregion_name, sv_db, chunk_size=1000):
+    """Registers sample points in the job table chunk by chunk and yields those that are not done as JobPoints.
+    JobPoints, e.g. when resuming, are already registered and are passed on."""
+    sample_pts = iter(sample_pts)
+    chunk_id = 0
+    is_registering = False
+    while True:
+        chunk = list(islice(sample_pts, chunk_size))
+        if not chunk:
+            break
+        if isinstance(chunk[0], JobPoint):
+            job_pts = chunk
+        else:
+            if not is_registering:
+                sv_db.set_job_status(job_id, subregion_name, PENDING)
+                is_registering = True
+            # Chunks are numbered in order of generation, so regenerating the same points maps them to the same rows
+            sv_db.register_job_points(job_id, subregion_name, chunk_id, chunk)
+            job_pts = list(sv_db.iter_job_points(job_id, subregion_name, chunk_id))
+            chunk_id += 1
+        sv_db.set_job_points_status(job_id, subregion_name, job_pts, IN_FLIGHT)
+        yield from job_pts
+
+    # All points are registered once the input is exhausted; an empty input still marks the subregion as registered
+    if is_registering or subregion_name not in sv_db.get_job_status(job_id):
+        sv_db.set_job_status(job_id, subregion_name, IN_FLIGHT)
+
+class _ResultWriter():
+    """Writes panoids responses and cached lookups to the database from a single thread, in batched transactions.
+    With a job id, the finished sample points are checkpointed in the same transaction as their entries. Every
+    transaction ends at a sample point boundary, so a point is never stored partially."""
+    def __init__(self, subregion_name, sv_db, cache=None, job_id=None, on_result=None, batch_size=1000):
+        self.subregion_name = subregion_name
+        self.sv_db = sv_db
+        self.cache = cache
+        self.job_id = job_id
+        self.on_result = on_result
+        self.batch_size = batch_size
+        self.entries = []
+        self.done_pts = []
+        self.n_pending = 0
+        self.n_added = 0
+
+    def store(self, results):
+        for result in results:
+            self.add(result)
+        self.flush()
+
+    def add(self, result):
+        """Adds a sample point & its response, followed by the lookup date for known responses"""
+        # Known responses come with their lookup date, fresh lookups are added to the cache
+        if self.cache is not None and len(result) == 2:
+            self.cache.put(*result, manual_commit=True)
+        self._add(*result)
+        # Every sample point counts, so that the cache of points without panos is committed as well
+        self.n_pending += 1
+        if len(self.entries) >= self.batch_size or self.n_pending >= self.batch_size:
+            self.flush()
+
+    def _add(self, sample_pt, panos, lookup_date=None):
+        if self.on_result is not None:
+            self.on_result(sample_pt, panos)
+        self.entries.extend(entries_from_panos(panos, sample_pt, lookup_date, self.subregion_name))
+        if self.job_id is not None:
+            self.done_pts.append(sample_pt)
+
+    def flush(self):
+        try:
+            n_added = self.sv_db.add_entries(self.entries, manual_commit=True)
+            if self.job_id is not None:
+                self.sv_db.set_job_points_status(self.job_id, self.subregion_name, self.done_pts, DONE, manual_commit=True)
+            self.sv_db.db.commit()
+        except Exception as e:
+            self.sv_db.db.rollback()
+            raise e
+        self.n_added += n_added
+        self.entries = []
+        self.done_pts = []
+        self.n_pending = 0
+
+def _iter_serial_lookups(sample_pts, lookup_func=None, rate_limiter=None, resolve=None):
+    """Looks up sample points one at a time in the calling thread, yielding known responses without a lookup"""
+    for sample_pt in sample_pts:
+        resolved = resolve(sample_pt) if resolve is not None else None
+        if resolved is None:
+            yield sample_pt, lookup_panos(sample_pt, lookup_func, rate_limiter)
+        else:
+            yield (sample_pt, *resolved)
+
+@instrument.instrumented('lookup', rows=len)
+def lookup_panos(sample_pt, lookup_func=None, rate_limiter=None, max_retries=5):
+    """Queries all panoramas at a coordinate pair, retrying with exponential backoff on querying errors
+    
+    Arguments:
+        sample_pt {list} -- List containing an X and Y coordinate in WGS84 coordinates
+    
+    Keyword Arguments:
+        lookup_func {callable} -- Lookup backend, e.g. an AsyncHTTPBackend or a local stub, defaults to streetview.panoids (default: {None})
+        rate_limiter {RateLimiter} -- Optional rate limiter shared between lookups (default: {None})
+        max_retries {int} -- Number of retries with exponential backoff on querying errors (default: {5})
+    
+    Returns:
+        {list} -- Response of streetview.panoids
+    """
+    lookup_func = lookup_func or StreetviewBackend()
+    return call_with_backoff(lookup_func,
+                             kwargs={'lat': sample_pt[1], 'lon': sample_pt[0]},
+                             max_retries=max_retries,
+                             rate_limiter=rate_limiter)
+
+def entries_from_panos(panos, sample_pt, lookup_date=None, subregion_name=''):
+    """Converts a panoids response to entries for the region table. Panoramas without a date are left out.
+    
+    Arguments:
+        panos {list} -- Response of streetview.panoids
+        sample_pt {list} -- List containing an X and Y coordinate in WGS84 coordinates
+    
+    Keyword Arguments:
+        lookup_date {str} -- Date of the lookup, defaults to today (default: {None})
+        subregion_name {str} -- Optional subregion name for keeping track of aggregations (default: {''})
+    
+    Returns:
+        {list} -- List containing dictionaries of all panoramas at the coordinate pairs
+    """
+    lookup_date = lookup_date or str(date.today())
+    entries = []
+    for pano in panos:
+        if 'year' in pano:
+            entry = {'subregion_name': subregion_name,
+                        'pano_id': pano['panoid'],
+                        'capture_date': f'{pano["year"]}-{pano["month"]}',
+                        'anchor_x': sample_pt[0],
+                        'anchor_y': sample_pt[1],
+                        'pano_x': pano['lon'],
+                        'pano_y': pano['lat'],
+                        'lookup_date': lookup_date,
+                        'download_date': '',
+                        'saved_path': ''}
+            entries.append(entry)
+    return entries
+
+def panos_from_coord_pair(sample_pt, subregion_name='', lookup_func=None, rate_limiter=None, max_retries=5):
+    """Get all panoramas with a date from a coordinate pair
+    
+    Arguments:
+        sample_pt {list} -- List containing an X and Y coordinate in WGS84 coordinates
+    
+    Keyword Arguments:
+        subregion_name {str} -- Optional subregion name for keeping track of aggregations (default: {''})
+        lookup_func {callable} -- Replacement for streetview.panoids, e.g. a local stub (default: {None})
+        rate_limiter {RateLimiter} -- Optional rate limiter shared between lookups (default: {None})
+        max_retries {int} -- Number of retries with exponential backoff on querying errors (default: {5})
+    
+    Returns:
+        {list} -- List containing dictionaries of all panoramas at the coordinate pairs
+    """
+    anchor_pano = lookup_panos(sample_pt, lookup_func, rate_limiter, max_retries)
+    return entries_from_panos(anchor_pano, sample_pt, subregion_name=subregion_name)
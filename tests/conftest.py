@@ -0,0 +1,33 @@
+import pytest
+
+from svdiscover import backends, lookup
+from svdiscover.database import StreetviewDB
+
+ENTRY_DEFAULTS = {'pano_id': lambda i: f'pano_{i}', 'capture_date': '2019-6', 'anchor_x': 0., 'anchor_y': 0.,
+                  'pano_x': float, 'pano_y': 0., 'lookup_date': '2021-01-01', 'download_date': None, 'saved_path': None}
+
+def _make_entries(n, subregion_name='a', **columns):
+    columns = {**ENTRY_DEFAULTS, **columns}
+    return [{'subregion_name': subregion_name,
+             **{name: value(i) if callable(value) else value for name, value in columns.items()}}
+            for i in range(n)]
+
+@pytest.fixture
+def make_entries():
+    """Factory of region table entries for n panos. Column values passed as keywords replace the defaults,
+    callables are called with the index of the entry."""
+    return _make_entries
+
+@pytest.fixture
+def sv_db(request):
+    """In-memory database with an empty target region table 'panos'.
+    Parametrize indirectly with 'legacy' or 'normalized' to choose the table layout."""
+    sv_db = StreetviewDB(':memory:')
+    sv_db.make_region_table('panos', set_target=True, normalized=getattr(request, 'param', 'legacy') == 'normalized')
+    return sv_db
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retries without waiting, both for lookups and downloads and for the async backends"""
+    monkeypatch.setattr(lookup, 'sleep', lambda delay: None)
+    monkeypatch.setattr(backends, 'backoff_delay', lambda attempt: 0.)
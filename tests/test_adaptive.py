@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Polygon, box
+
+from svdiscover import adaptive
+from svdiscover.adaptive import adaptive_store_panos
+from svdiscover.sampling import grid_xy_in_poly, reproject_xy, store_panos_from_sample_pts
+
+PROJ = 'EPSG:28992'
+ORIGIN = np.array([120000., 480000.])
+
+class RoadPanoids():
+    """Lookup stub which returns every pano within the lookup radius, with panos spaced along synthetic roads"""
+    def __init__(self, roads, spacing=10, radius=50):
+        self.xy = np.array([road.interpolate(d).coords[0] for road in roads for d in np.arange(0, road.length, spacing)])
+        lon, lat = reproject_xy(self.xy[:, 0], self.xy[:, 1], PROJ)
+        self.lon_lat = np.column_stack([lon, lat])
+        self.radius = radius
+        self.calls = 0
+
+    def __call__(self, lat, lon):
+        self.calls += 1
+        x, y = reproject_xy(np.array([lon]), np.array([lat]), 'EPSG:4326', PROJ)
+        idx = np.flatnonzero(np.hypot(self.xy[:, 0] - x[0], self.xy[:, 1] - y[0]) <= self.radius)
+        return [{'panoid': f'pano_{i}', 'lon': self.lon_lat[i, 0], 'lat': self.lon_lat[i, 1], 'year': 2020, 'month': 1}
+                for i in idx]
+
+def road(*xy):
+    return LineString([ORIGIN + pt for pt in xy])
+
+LAYOUTS = {
+    'long_strip': (box(*ORIGIN, *(ORIGIN + [1000, 250])), [road((0, 200), (1000, 60))]),
+    'small_strip': (box(*ORIGIN, *(ORIGIN + [300, 100])), [road((0, 90), (300, 5))]),
+    'street_grid': (box(*ORIGIN, *(ORIGIN + 1000)),
+                    [road((0, y), (1000, y)) for y in (130, 470, 800)] + [road((x, 0), (x, 1000)) for x in (90, 610)]),
+}
+
+def stored_ids(sv_db, subregion_name):
+    query = 'SELECT pano_id FROM panos WHERE subregion_name = ?'
+    return {row[0] for row in sv_db.cursor.execute(query, [subregion_name])}
+
+@pytest.mark.parametrize('name', LAYOUTS)
+def test_recall_matches_fixed_grid(sv_db, name):
+    poly_geom, roads = LAYOUTS[name]
+
+    stub = RoadPanoids(roads)
+    xy = grid_xy_in_poly(poly_geom, 20)
+    lon, lat = reproject_xy(xy[:, 0], xy[:, 1], PROJ)
+    store_panos_from_sample_pts(list(zip(lon, lat)), 'grid', sv_db, lookup_func=stub)
+    n_grid_calls, stub.calls = stub.calls, 0
+
+    adaptive_store_panos(poly_geom, 'adaptive', sv_db, PROJ, lookup_func=stub)
+    grid_ids = stored_ids(sv_db, 'grid')
+    assert grid_ids
+    assert grid_ids <= stored_ids(sv_db, 'adaptive')
+    if name != 'small_strip':
+        assert stub.calls < n_grid_calls
+
+def test_stored_panos_are_not_looked_up_again(sv_db):
+    poly_geom, roads = LAYOUTS['long_strip']
+    stub = RoadPanoids(roads)
+    adaptive_store_panos(poly_geom, 'a', sv_db, PROJ, lookup_func=stub)
+    n_first_calls, stub.calls = stub.calls, 0
+    adaptive_store_panos(poly_geom, 'a', sv_db, PROJ, lookup_func=stub)
+    assert stub.calls < n_first_calls
+
+def test_shared_sample_points_are_looked_up_once(sv_db, monkeypatch):
+    # At the finest level, cells along the edges of the diamond share its vertices as their sample point
+    poly_geom = Polygon([ORIGIN + xy for xy in [(200, 0), (400, 200), (200, 400), (0, 200)]])
+    batches = []
+
+    def recording_store(sample_pts, *args, **kwargs):
+        batches.append(sample_pts)
+        return store_panos_from_sample_pts(sample_pts, *args, **kwargs)
+
+    monkeypatch.setattr(adaptive, 'store_panos_from_sample_pts', recording_store)
+    adaptive_store_panos(poly_geom, 'a', sv_db, PROJ, lookup_func=lambda lat, lon: [])
+    assert len(batches) > 1
+    assert all(len(batch) == len(set(batch)) for batch in batches)
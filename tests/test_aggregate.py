@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from svdiscover.aggregate import GridAggregator, aggregate_grid
+
+both_layouts = pytest.mark.parametrize('sv_db', ['legacy', 'normalized'], indirect=True)
+
+@pytest.fixture
+def panos(sv_db, make_entries):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(4.8, 4.9, 500)
+    y = rng.uniform(52.3, 52.35, 500)
+    sv_db.add_entries(make_entries(500, pano_id=lambda i: f'pano_{i:03d}', capture_date=lambda i: f'{2010 + i % 10}-{1 + i % 12}',
+                                   pano_x=x.__getitem__, pano_y=y.__getitem__))
+
+def test_pyramid_of_empty_grid():
+    levels = GridAggregator((0, 0, 10, 10), 1).pyramid(3)
+    assert len(levels) == 4
+    assert all(level.count.sum() == 0 and level.to_table().empty for level in levels)
+
+@both_layouts
+@pytest.mark.usefixtures('panos')
+def test_aggregate_grid_reads_the_table_once(sv_db):
+    queries = []
+    sv_db.db.set_trace_callback(queries.append)
+    grid = aggregate_grid(sv_db, 0.01, chunksize=7)
+    sv_db.db.set_trace_callback(None)
+    assert len([query for query in queries if query.lstrip().upper().startswith('SELECT')]) == 1
+
+    assert grid.count.sum() == 500
+    xmin, ymin, xmax, ymax = grid.bounds
+    records = sv_db.get_records(columns=['pano_x', 'pano_y'])
+    assert xmin <= records['pano_x'].min() and records['pano_x'].max() < xmax
+    assert ymin <= records['pano_y'].min() and records['pano_y'].max() < ymax
+
+@both_layouts
+@pytest.mark.usefixtures('panos')
+def test_grown_grid_matches_grid_with_bounds(sv_db):
+    grown = aggregate_grid(sv_db, 0.01, chunksize=7)
+    fixed = aggregate_grid(sv_db, 0.01, bounds=grown.bounds)
+    # Rounding of the bounds may add an empty row or column to the fixed grid, so only cells with panos are compared
+    assert grown.to_table().equals(fixed.to_table())
+
+@both_layouts
+@pytest.mark.usefixtures('panos')
+def test_pyramid_matches_coarser_grid(sv_db):
+    fine = aggregate_grid(sv_db, 0.005, bounds=(4.8, 52.3, 4.9, 52.35))
+    coarse = fine.pyramid(1)[1]
+    direct = aggregate_grid(sv_db, 0.01, bounds=coarse.bounds)
+    assert coarse.to_table().equals(direct.to_table())
@@ -0,0 +1,88 @@
+import threading
+from importlib.util import find_spec
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+from svdiscover import instrument
+from svdiscover.backends import AsyncHTTPBackend, LookupBackend, MockPanoServer
+from svdiscover.lookup import PanoLookupPool
+from svdiscover.sampling import store_panos_from_sample_pts
+
+CLIENTS = [pytest.param(client, marks=pytest.mark.skipif(find_spec(client) is None, reason=f'{client} is not installed'))
+           for client in ('aiohttp', 'httpx')]
+
+FIXTURE = [{'panoid': f'mock_{i}', 'lat': 52.3, 'lon': 4.8 + i * 1e-4, 'year': 2020, 'month': 1 + i % 12}
+           for i in range(100)]
+
+def sample_points(n):
+    return [(4.8 + i * 1e-4, 52.3) for i in range(n)]
+
+pytestmark = pytest.mark.usefixtures('no_backoff')
+
+def test_lookup_backend_is_abstract():
+    class IncompleteBackend(LookupBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+@pytest.mark.parametrize('client', CLIENTS)
+def test_backend_returns_panos_near_point(client):
+    with MockPanoServer(FIXTURE, search_radius=10) as server, AsyncHTTPBackend(server.url, client=client) as backend:
+        panos = backend(lat=52.3, lon=4.8)
+        assert [pano['panoid'] for pano in panos] == [pano['panoid'] for pano in server.panos_near(52.3, 4.8)]
+        assert panos[0]['panoid'] == 'mock_0'
+
+@pytest.mark.parametrize('client', CLIENTS)
+def test_numpy_coordinates_are_sent_as_numbers(client):
+    lon, lat = np.array(sample_points(3)).T
+    with MockPanoServer(FIXTURE, search_radius=5) as server, AsyncHTTPBackend(server.url, client=client) as backend:
+        assert backend(lat=lat[0], lon=lon[0])[0]['panoid'] == 'mock_0'
+        responses = backend.fetch_many(list(zip(lon, lat)), max_retries=0)
+    assert [response[0]['panoid'] for response in responses] == ['mock_0', 'mock_1', 'mock_2']
+
+@pytest.mark.parametrize('client', CLIENTS)
+def test_fetch_many_runs_lookups_concurrently(client):
+    with MockPanoServer(FIXTURE, latency=0.05) as server, \
+         AsyncHTTPBackend(server.url, max_connections=20, client=client) as backend:
+        start = perf_counter()
+        responses = backend.fetch_many(sample_points(40))
+        seconds = perf_counter() - start
+    assert len(responses) == 40
+    assert all(response for response in responses)
+    # Serial lookups take 40 times the latency, 20 connections take about twice the latency
+    assert seconds < 40 * 0.05 / 4
+
+@pytest.mark.parametrize('client', CLIENTS)
+def test_failed_lookups_are_retried(sv_db, client):
+    stats = instrument.enable()
+    try:
+        with MockPanoServer(FIXTURE, search_radius=5, failure_rate=0.3) as server, \
+             AsyncHTTPBackend(server.url, max_connections=8, client=client) as backend, \
+             PanoLookupPool(2, lookup_func=backend, max_retries=20, max_in_flight=16) as pool:
+            store_panos_from_sample_pts(sample_points(100), 'mock', sv_db, pool=pool)
+    finally:
+        instrument.disable()
+    assert server.n_failures > 0
+    assert stats.summary()['counters']['retries'] == server.n_failures
+    assert stats.summary()['stages']['lookup']['calls'] == 100
+    assert {row[0] for row in sv_db.cursor.execute('SELECT pano_id FROM panos')} == {pano['panoid'] for pano in FIXTURE}
+
+@pytest.mark.parametrize('client', CLIENTS)
+def test_pool_hands_batches_to_backend(client):
+    batch_sizes = []
+    lock = threading.Lock()
+
+    class RecordingBackend(AsyncHTTPBackend):
+        def fetch_many(self, sample_pts, **kwargs):
+            with lock:
+                batch_sizes.append(len(sample_pts))
+            return super().fetch_many(sample_pts, **kwargs)
+
+    with MockPanoServer(FIXTURE) as server, RecordingBackend(server.url, client=client) as backend, \
+         PanoLookupPool(2, lookup_func=backend, max_in_flight=20) as pool:
+        results = list(pool.map(sample_points(45)))
+    assert sorted(pt for pt, _ in results) == sample_points(45)
+    assert batch_sizes == [10, 10, 10, 10, 5]
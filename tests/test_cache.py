@@ -0,0 +1,82 @@
+import pytest
+
+from svdiscover.cache import LookupCache
+from svdiscover.lookup import PanoLookupPool
+from svdiscover.sampling import store_panos_from_sample_pts
+
+class StubPanoids():
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, lat, lon):
+        self.calls += 1
+        return [{'panoid': f'pano_{lon:.4f}_{lat:.4f}', 'lat': lat, 'lon': lon, 'year': 2020, 'month': 5}]
+
+def sample_points(n):
+    return [(4.8 + i * 1e-3, 52.3) for i in range(n)]
+
+def count_records(sv_db, subregion_name):
+    query = 'SELECT COUNT(*) FROM panos WHERE subregion_name = ?'
+    return sv_db.cursor.execute(query, [subregion_name]).fetchone()[0]
+
+@pytest.mark.parametrize('n_workers', [1, 4])
+def test_cache_hits_are_streamed_inline(sv_db, n_workers):
+    cache = LookupCache(sv_db)
+    stub = StubPanoids()
+    store_panos_from_sample_pts(sample_points(100), 'a', sv_db, lookup_func=stub, cache=cache)
+    assert stub.calls == 100
+
+    n_pulled = 0
+    n_stored = []
+
+    def sample_pts():
+        nonlocal n_pulled
+        for sample_pt in sample_points(100):
+            n_pulled += 1
+            yield sample_pt
+
+    def on_result(sample_pt, panos):
+        n_stored.append(n_pulled)
+
+    with PanoLookupPool(n_workers, lookup_func=stub) as pool:
+        store_panos_from_sample_pts(sample_pts(), 'b', sv_db, pool=pool, cache=cache, on_result=on_result)
+    assert stub.calls == 100
+    # Every cached point is handed to the writer before the next point is read
+    assert n_stored == list(range(1, 101))
+    assert count_records(sv_db, 'b') == 100
+
+def test_coverage_is_per_subregion(sv_db):
+    cache = LookupCache(sv_db, coverage_radius=50)
+    stub = StubPanoids()
+    store_panos_from_sample_pts(sample_points(10), 'a', sv_db, lookup_func=stub, cache=cache)
+    assert stub.calls == 10
+
+    # Covered for subregion a, so nothing is looked up or stored again
+    store_panos_from_sample_pts(sample_points(10), 'a', sv_db, lookup_func=stub, cache=cache)
+    assert cache.skipped == 10
+    # Not covered for subregion b, so the cached responses are stored under b
+    store_panos_from_sample_pts(sample_points(10), 'b', sv_db, lookup_func=stub, cache=cache)
+    assert cache.skipped == 10
+    assert stub.calls == 10
+    assert count_records(sv_db, 'b') == 10
+
+def test_interrupted_run_keeps_cached_empty_lookups(sv_db):
+    cache = LookupCache(sv_db)
+    n_calls = 0
+
+    def interrupted_panoids(lat, lon):
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls > 250:
+            raise KeyboardInterrupt
+        return []
+
+    with pytest.raises(KeyboardInterrupt):
+        store_panos_from_sample_pts(sample_points(500), 'a', sv_db, lookup_func=interrupted_panoids, cache=cache, batch_size=100)
+    # Like a crash, the interruption loses the uncommitted batch; lookups without panos still count toward a batch
+    sv_db.db.rollback()
+    assert sv_db.cursor.execute('SELECT COUNT(*) FROM lookup_cache').fetchone()[0] == 200
+
+    stub = StubPanoids()
+    store_panos_from_sample_pts(sample_points(500), 'a', sv_db, lookup_func=stub, cache=cache, batch_size=100)
+    assert stub.calls == 300
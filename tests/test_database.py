@@ -0,0 +1,106 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from svdiscover import instrument
+from svdiscover.database import RecordFilter
+
+@pytest.fixture(autouse=True)
+def panos(sv_db, make_entries):
+    sv_db.add_entries(make_entries(10))
+
+def count_records(sv_db):
+    return sv_db.cursor.execute(f'SELECT COUNT(*) FROM {sv_db.table}').fetchone()[0]
+
+@pytest.mark.parametrize('where', [False, None, '', RecordFilter()])
+def test_remove_records_requires_a_filter(sv_db, where):
+    with pytest.raises(ValueError):
+        sv_db.remove_records(where)
+    assert count_records(sv_db) == 10
+
+def test_remove_records_with_filter(sv_db):
+    sv_db.remove_records(RecordFilter(pano_ids=['pano_1', 'pano_2']))
+    assert count_records(sv_db) == 8
+
+def test_remove_all_records(sv_db):
+    sv_db.remove_records(remove_all=True)
+    assert count_records(sv_db) == 0
+
+def test_table_layout_cache_follows_schema_changes(sv_db):
+    assert not sv_db.is_normalized('panos') and not sv_db.has_rtree('panos')
+    sv_db.add_spatial_index('panos')
+    assert sv_db.has_rtree('panos')
+    sv_db.normalize_region_table('panos')
+    assert sv_db.is_normalized('panos') and sv_db.has_rtree('panos')
+    assert count_records(sv_db) == 10
+
+def test_add_field_to_normalized_table(sv_db, make_entries):
+    sv_db.normalize_region_table('panos')
+    sv_db.add_field('label', 'VARCHAR')
+    sv_db.add_entries(make_entries(12))
+    sv_db.cursor.execute("UPDATE panos SET label = 'road' WHERE pano_id = 'pano_1'")
+    records = sv_db.get_records(RecordFilter(pano_ids=['pano_1', 'pano_11']))
+    assert sorted(records['label'].fillna('')) == ['', 'road']
+    assert count_records(sv_db) == 12
+
+@pytest.mark.parametrize('sv_db', ['legacy', 'normalized'], indirect=True)
+def test_rtree_finds_records_in_bbox(sv_db, make_entries):
+    sv_db.add_spatial_index('panos')
+    assert sv_db.has_rtree('panos')
+    sv_db.add_entries(make_entries(10, 'b'))
+    sv_db.remove_records(RecordFilter(subregions='b', pano_ids=['pano_3']))
+    records = sv_db.get_records(RecordFilter(bbox=(2.5, -1, 5.5, 1)))
+    assert sorted(zip(records['subregion_name'], records['pano_id'])) == [
+        ('a', 'pano_3'), ('a', 'pano_4'), ('a', 'pano_5'), ('b', 'pano_4'), ('b', 'pano_5')]
+
+
+def test_only_chunks_with_records_are_timed(sv_db):
+    stats = instrument.enable()
+    try:
+        chunks = list(sv_db.iter_records(chunksize=5))
+    finally:
+        instrument.disable()
+    assert len(chunks) == 2
+    assert stats.summary()['stages']['read']['calls'] == 2
+
+def legacy_get_records(sv_db):
+    """Original row-by-row implementation of get_records, with the intended date format"""
+    records = sv_db.cursor.execute(f'SELECT * FROM {sv_db.table}').fetchall()
+    headers = [header[1] for header in sv_db.cursor.execute(f'PRAGMA table_info({sv_db.table})')]
+    table_df = pd.DataFrame({header: [row[i] for row in records] for i, header in enumerate(headers)})
+    table_df['capture_date'] = table_df['capture_date'].apply(lambda x: pd.to_datetime(str(x), format='%Y-%m'))
+    return table_df
+
+def test_get_records_matches_row_by_row_loading(sv_db, make_entries):
+    capture_dates = ['2007-1', '2015-3', '2019-12', '2021-10']
+    sv_db.add_entries(make_entries(4, 'b', capture_date=capture_dates.__getitem__, pano_y=0.5, saved_path='b.jpg'))
+    records = sv_db.get_records()
+    legacy_records = legacy_get_records(sv_db)
+    # Recent pandas parses single dates at a coarser resolution than nanoseconds
+    legacy_records['capture_date'] = legacy_records['capture_date'].astype('datetime64[ns]')
+    pd.testing.assert_frame_equal(records, legacy_records)
+    assert records['capture_date'].dtype == 'datetime64[ns]'
+    assert records['pano_x'].dtype == records['pano_y'].dtype == 'float64'
+    assert records.loc[records['subregion_name'] == 'b', 'capture_date'].tolist() == [
+        pd.Timestamp(2007, 1, 1), pd.Timestamp(2015, 3, 1), pd.Timestamp(2019, 12, 1), pd.Timestamp(2021, 10, 1)]
+
+def test_get_records_with_invalid_capture_dates(sv_db, make_entries):
+    sv_db.add_entries(make_entries(3, 'b', capture_date=['2015-3', 'unknown', None].__getitem__))
+    records = sv_db.get_records(RecordFilter(subregions='b'), columns=['pano_id', 'capture_date'])
+    assert list(records.columns) == ['pano_id', 'capture_date']
+    assert records['capture_date'].dtype == 'datetime64[ns]'
+    assert records['capture_date'].iloc[0] == pd.Timestamp(2015, 3, 1)
+    assert records['capture_date'].iloc[1:].isna().all()
+
+def test_schema_changes_keep_pending_entries_of_the_caller(sv_db, make_entries):
+    sv_db.add_entries(make_entries(5, 'b'), manual_commit=True)
+    sv_db.normalize_region_table('panos')
+    sv_db.add_field('label', 'VARCHAR')
+    # A failing schema change only undoes itself, the pending entries stay in the open transaction
+    with pytest.raises(sqlite3.OperationalError):
+        sv_db.add_field('label', 'VARCHAR')
+    assert sv_db.db.in_transaction
+    sv_db.db.commit()
+    assert count_records(sv_db) == 15
+    assert 'label' in sv_db.get_records(columns=['label'])
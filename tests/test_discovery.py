@@ -0,0 +1,39 @@
+import geopandas as gpd
+from shapely.geometry import LineString, Polygon
+
+from svdiscover.cache import LookupCache
+from svdiscover.database import DONE
+from svdiscover.discovery import discover_regions
+from svdiscover.sampling import grid_xy_in_poly, reproject_xy
+
+def stub_panoids(lat, lon):
+    lat, lon = round(lat, 4), round(lon, 4)
+    return [{'panoid': f'{lat}_{lon}', 'lat': lat, 'lon': lon, 'year': 2019, 'month': 3}]
+
+def expected_pano_ids(poly_geom, grid_resolution):
+    xy = grid_xy_in_poly(poly_geom, grid_resolution)
+    lons, lats = reproject_xy(xy[:, 0], xy[:, 1], 'EPSG:28992')
+    return {pano['panoid'] for lon, lat in zip(lons, lats) for pano in stub_panoids(lat, lon)}
+
+def make_regions():
+    roads = [LineString([(120000 + i * 3000, 480000), (122000 + i * 3000, 483000)]).buffer(40) for i in range(4)]
+    # A polygon smaller than the grid resolution has no sample points
+    polygons = roads + [Polygon([(0, 0), (1, 0), (1, 1)])]
+    return gpd.GeoDataFrame({'name': [f'region_{i}' for i in range(len(polygons))]}, geometry=polygons, crs='EPSG:28992')
+
+def stored_pano_ids(sv_db, name):
+    query = 'SELECT pano_id FROM panos WHERE subregion_name = ?'
+    return {row[0] for row in sv_db.cursor.execute(query, [name])}
+
+def test_discover_regions_streams_tiles_of_all_regions(sv_db):
+    gdf = make_regions()
+    sv_db.make_job_table()
+    processed = discover_regions(gdf, sv_db, 'name', n_processes=2, n_workers=8, lookup_func=stub_panoids,
+                                 cache=LookupCache(sv_db), job_id='job', tile_size=16)
+    assert sorted(processed) == sorted(gdf['name'])
+    for name, poly_geom in zip(gdf['name'], gdf.geometry):
+        assert stored_pano_ids(sv_db, name) == expected_pano_ids(poly_geom, 20)
+    assert set(sv_db.get_job_status('job').values()) == {DONE}
+
+    # Finished regions are skipped when the job is run again
+    assert discover_regions(gdf, sv_db, 'name', n_processes=2, lookup_func=stub_panoids, job_id='job') == []
@@ -0,0 +1,92 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from svdiscover.download import PanoDownloader
+
+IMAGE = b'\xff\xd8' + bytes(range(256)) * 64
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Static API stub: pano IDs starting with 'missing' are unknown, 'flaky' fails once with 503 and 'broken'
+    cuts off the image halfway"""
+    requests = []
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        self.requests.append(params)
+        pano_id = params['pano']
+        n_requests = sum(request['pano'] == pano_id for request in self.requests)
+        if pano_id.startswith('missing') and params.get('return_error_code') == 'true':
+            self.send_error(404)
+        elif pano_id.startswith('flaky') and n_requests == 1:
+            self.send_error(503)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(IMAGE)))
+            self.end_headers()
+            self.wfile.write(IMAGE[:len(IMAGE) // 2] if pano_id.startswith('broken') else IMAGE)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def base_url():
+    StubHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/streetview'
+    server.shutdown()
+    server.server_close()
+
+pytestmark = pytest.mark.usefixtures('no_backoff')
+
+@pytest.fixture
+def add_panos(sv_db, make_entries):
+    def add_panos(pano_ids):
+        sv_db.add_entries(make_entries(len(pano_ids), pano_id=pano_ids.__getitem__))
+    return add_panos
+
+def part_files(out_dir):
+    return [name for _, _, names in os.walk(out_dir) for name in names if name.endswith('.part')]
+
+def test_download_saves_images_and_retries(sv_db, add_panos, base_url, tmp_path):
+    add_panos(['ok_1', 'ok_2', 'flaky_1'])
+    downloader = PanoDownloader(sv_db, str(tmp_path), 'key', n_workers=2, base_url=base_url)
+    assert downloader.run() == 3
+    assert downloader.n_failed == 0
+    for pano_id in ['ok_1', 'ok_2', 'flaky_1']:
+        with open(downloader.pano_path(pano_id), 'rb') as f:
+            assert f.read() == IMAGE
+    assert list(sv_db.iter_undownloaded_pano_ids()) == []
+    assert all(request['return_error_code'] == 'true' for request in StubHandler.requests)
+
+def test_unknown_pano_is_not_retried(sv_db, add_panos, base_url, tmp_path):
+    add_panos(['missing_1', 'ok_1'])
+    downloader = PanoDownloader(sv_db, str(tmp_path), 'key', base_url=base_url)
+    assert downloader.run() == 1
+    assert downloader.n_failed == 1
+    assert downloader.n_missing == 1
+    assert sum(request['pano'] == 'missing_1' for request in StubHandler.requests) == 1
+    assert not os.path.exists(downloader.pano_path('missing_1'))
+
+    # Recorded as missing, so a restarted run does not ask for it again
+    assert list(sv_db.iter_undownloaded_pano_ids()) == []
+    assert list(sv_db.iter_undownloaded_pano_ids(include_missing=True)) == ['missing_1']
+    assert PanoDownloader(sv_db, str(tmp_path), 'key', base_url=base_url).run() == 0
+    assert sum(request['pano'] == 'missing_1' for request in StubHandler.requests) == 1
+
+def test_broken_download_leaves_no_part_file(sv_db, add_panos, base_url, tmp_path, caplog):
+    add_panos(['broken_1'])
+    downloader = PanoDownloader(sv_db, str(tmp_path), 'secret-key', base_url=base_url, max_retries=1)
+    assert downloader.run() == 0
+    assert downloader.n_failed == 1
+    assert sum(request['pano'] == 'broken_1' for request in StubHandler.requests) == 2
+    assert not os.path.exists(downloader.pano_path('broken_1'))
+    assert part_files(tmp_path) == []
+    # Failures are logged by pano ID, never with the URL that holds the API key
+    assert 'broken_1' in caplog.text and 'secret-key' not in caplog.text
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from svdiscover.export import export_to_parquet
+
+pytestmark = pytest.mark.parametrize('sv_db', ['legacy', 'normalized'], indirect=True)
+
+@pytest.fixture(autouse=True)
+def panos(sv_db, make_entries):
+    columns = {'capture_date': lambda i: f'{2015 + i % 3}-6', 'pano_x': lambda i: 4.8 + i * 1e-3, 'pano_y': 52.3}
+    # Sorted by pano ID, the first chunk only has panos that have not been downloaded
+    sv_db.add_entries(make_entries(10, 'a', pano_id=lambda i: f'a_{i}', **columns) +
+                      make_entries(10, 'b', pano_id=lambda i: f'b_{i}', download_date='2021-02-01',
+                                   saved_path=lambda i: f'{i}.jpg', **columns))
+
+def test_column_missing_in_first_chunk(sv_db, tmp_path):
+    export_to_parquet(sv_db, str(tmp_path), chunksize=5, columns=['pano_id', 'capture_date', 'saved_path'],
+                      where='1 = 1 ORDER BY pano_id', geometry=False)
+    records = pd.read_parquet(tmp_path).sort_values('pano_id')
+    assert len(records) == 20
+    assert records['saved_path'].isna().sum() == 10
+    assert records['saved_path'].dropna().tolist() == [f'{i}.jpg' for i in range(10)]
+    assert str(records['capture_date'].dtype).startswith('datetime64')
+
+def test_partitioned_dataset_reads_back(sv_db, tmp_path):
+    gpd = pytest.importorskip('geopandas')
+    export_to_parquet(sv_db, str(tmp_path), chunksize=5, partition_by=['subregion_name', 'capture_year'])
+    records = gpd.read_parquet(tmp_path)
+    assert len(records) == 20
+    assert sorted(records['capture_year'].astype(int).unique()) == [2015, 2016, 2017]
+    assert sorted(records['subregion_name'].astype(str).unique()) == ['a', 'b']
+    assert (records['capture_date'].dt.year == records['capture_year'].astype(int)).all()
+    assert records.geometry.x.round(6).tolist() == records['pano_x'].round(6).tolist()
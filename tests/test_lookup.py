@@ -0,0 +1,103 @@
+import threading
+from time import monotonic, sleep
+
+import pytest
+
+from svdiscover import instrument, lookup
+from svdiscover.lookup import PanoLookupPool, RateLimiter, backoff_delay, call_with_backoff
+
+class ConcurrencyStub():
+    """Lookup stub which records how many calls run at the same time"""
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, lat, lon):
+        with self.lock:
+            self.active += 1
+            self.calls += 1
+            self.max_active = max(self.max_active, self.active)
+        sleep(self.latency)
+        with self.lock:
+            self.active -= 1
+        return [{'panoid': f'{lon}_{lat}', 'lat': lat, 'lon': lon, 'year': 2020, 'month': 1}]
+
+def test_pool_returns_every_point():
+    sample_pts = [(float(i), 0.) for i in range(50)]
+    with PanoLookupPool(4, lookup_func=ConcurrencyStub(0.)) as pool:
+        results = list(pool.map(sample_pts))
+    assert sorted(pt for pt, _ in results) == sample_pts
+    assert all(panos[0]['lon'] == pt[0] for pt, panos in results)
+
+def test_pool_bounds_in_flight_lookups():
+    n_pulled = 0
+
+    def sample_pts():
+        nonlocal n_pulled
+        for i in range(100):
+            n_pulled += 1
+            yield (float(i), 0.)
+
+    stub = ConcurrencyStub()
+    with PanoLookupPool(3, lookup_func=stub, max_in_flight=6) as pool:
+        for n_yielded, _ in enumerate(pool.map(sample_pts()), 1):
+            # At most max_in_flight lookups are pending, plus the point waiting to be submitted
+            assert n_pulled - n_yielded <= 6
+    assert stub.calls == 100
+    assert stub.max_active <= 3
+
+def test_rate_limiter_limits_request_rate():
+    limiter = RateLimiter(50, burst=1)
+    start = monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    # The first token is available immediately, the other ten are refilled at 50 per second
+    assert monotonic() - start >= 10 / 50 * 0.9
+
+def test_pool_respects_requests_per_second():
+    stub = ConcurrencyStub(0.)
+    start = monotonic()
+    with PanoLookupPool(4, requests_per_second=40, lookup_func=stub) as pool:
+        list(pool.map([(float(i), 0.) for i in range(12)]))
+    # A burst of n_workers tokens is allowed, the remaining lookups wait for refills
+    assert monotonic() - start >= (12 - 4) / 40 * 0.9
+
+def test_call_with_backoff_retries_until_success(monkeypatch):
+    delays = []
+    monkeypatch.setattr(lookup, 'sleep', delays.append)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError('Temporary failure')
+        return 'panos'
+
+    stats = instrument.enable()
+    try:
+        assert call_with_backoff(flaky, max_retries=5, base_delay=1., max_delay=60.) == 'panos'
+    finally:
+        instrument.disable()
+    assert len(attempts) == 3
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2
+    assert stats.summary()['counters']['retries'] == 2
+
+@pytest.mark.usefixtures('no_backoff')
+def test_call_with_backoff_raises_after_max_retries():
+    attempts = []
+
+    def failing():
+        attempts.append(1)
+        raise ConnectionError('Permanent failure')
+
+    with pytest.raises(ConnectionError):
+        call_with_backoff(failing, max_retries=2)
+    assert len(attempts) == 3
+
+def test_backoff_delay_is_capped():
+    for attempt in range(20):
+        assert 0 <= backoff_delay(attempt, base_delay=1., max_delay=5.) <= 5.
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+from svdiscover.pano_funcs import (add_pano_stats_to_all_polygons, add_pano_stats_to_polygons, get_xy_timestats,
+                                   group_by_xy, group_xy, xy_timestats)
+
+def test_group_xy_keeps_first_occurrence():
+    # Many duplicates make an unstable sort reorder records within groups
+    x = np.tile([3., 1., 2.], 1000)
+    y = np.zeros(len(x))
+    xy_groups = group_xy(x, y)
+    for i in range(len(xy_groups.x)):
+        members = xy_groups.order[xy_groups.offsets[i]:xy_groups.offsets[i + 1]]
+        assert np.all(np.diff(members) > 0)
+
+def test_group_by_xy_keys_by_first_record():
+    records = [('p0', 1.0, 2.0), ('p1', 1.04, 2.0), ('p2', 1.0, 2.0)]
+    groups = group_by_xy(records, 1, 2, precision=1)
+    assert list(groups) == ['1.0-2.0']
+    assert [record[0] for record in groups['1.0-2.0']] == ['p0', 'p1', 'p2']
+
+def test_get_xy_timestats_ignores_invalid_dates():
+    # Records of pano ID, X, capture date & Y
+    xy_records = {'0-0': [('p0', 0., '2015-3', 0.), ('p1', 0., None, 0.), ('p2', 0., 'unknown', 0.), ('p3', 0., '2018-6', 0.)],
+                  '1-1': [('p4', 1., None, 1.)]}
+    stats = get_xy_timestats(xy_records, 1, 3)
+    assert stats[0][3:] == [datetime(2015, 3, 1), datetime(2018, 6, 1), 39, 39 / 12, 2]
+    assert stats[1][3:] == [None, None, None, None, 0]
+
+def test_xy_timestats_ignores_invalid_dates():
+    stats = xy_timestats([0., 0., 0.], [0., 0., 0.], ['2015-3', None, '2016-3'])
+    assert stats['num_timesteps'].tolist() == [2]
+    assert stats['month_timediff'].tolist() == [12]
+
+STAT_COLUMNS = ['earliest', 'earliest_year', 'latest', 'latest_year', 'mean_date', 'rel_earliest_days', 'range_days']
+
+def test_polygon_stats_match_per_polygon_stats(sv_db, make_entries):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 100, 300)
+    y = rng.uniform(0, 100, 300)
+    sv_db.add_entries(make_entries(300, capture_date=lambda i: f'{2008 + i % 12}-{1 + i % 12}',
+                                   pano_x=x.__getitem__, pano_y=y.__getitem__))
+    # The last two polygons have no panos, the first ones overlap
+    polys = gpd.GeoDataFrame({'name': list('abcde')},
+                             geometry=[box(0, 0, 50, 50), box(25, 25, 75, 75), box(60, 0, 100, 40),
+                                       box(200, 200, 210, 210), box(-20, -20, -10, -10)])
+
+    stats = add_pano_stats_to_all_polygons(sv_db, polys)
+    for i, (_, poly) in enumerate(polys.iterrows()):
+        expected = add_pano_stats_to_polygons(sv_db, poly.copy())
+        for column in STAT_COLUMNS:
+            if column in expected:
+                assert stats[column].iloc[i] == expected[column], (i, column)
+            else:
+                assert pd.isna(stats[column].iloc[i]), (i, column)
+    assert stats[STAT_COLUMNS].iloc[:3].notna().all().all()
+    assert stats[STAT_COLUMNS].iloc[3:].isna().all().all()
@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import numpy as np
+from shapely.geometry import box
+
+from svdiscover.cache import LookupCache
+from svdiscover.refresh import AnchorBackoff, refresh
+from svdiscover.sampling import store_panos_from_sample_pts
+
+class WorldPanoids():
+    """Lookup stub returning the panos of a mutable world within a radius in degrees of the sample point"""
+    def __init__(self, radius=3e-4):
+        self.panos = {}
+        self.radius = radius
+        self.calls = 0
+
+    def __call__(self, lat, lon):
+        self.calls += 1
+        return [{'panoid': pano_id, 'lat': pano_lat, 'lon': pano_lon, 'year': 2020, 'month': 1}
+                for pano_id, (pano_lon, pano_lat) in self.panos.items()
+                if np.hypot(pano_lon - lon, pano_lat - lat) <= self.radius]
+
+def stored_ids(sv_db):
+    return {row[0] for row in sv_db.cursor.execute('SELECT pano_id FROM panos')}
+
+SAMPLE_PTS = [(4.8 + i * 1e-3, 52.3) for i in range(5)]
+
+def test_empty_sample_points_of_a_job_are_refreshed(sv_db):
+    sv_db.make_job_table()
+    stub = WorldPanoids()
+    stub.panos['old'] = SAMPLE_PTS[0]
+    cache = LookupCache(sv_db)
+    store_panos_from_sample_pts(SAMPLE_PTS, 'a', sv_db, lookup_func=stub, cache=cache, job_id='job')
+
+    stub.panos['new'] = SAMPLE_PTS[3]
+    # Stored anchors alone never look at the sample points that returned nothing
+    assert refresh(sv_db, max_age_days=0, lookup_func=stub)['new_panos'] == 0
+    stats = refresh(sv_db, max_age_days=0, lookup_func=stub, job_id='job', cache=cache)
+    assert stats['anchors'] == 5
+    assert stats['new_panos'] == 1
+    assert stored_ids(sv_db) == {'old', 'new'}
+
+def test_undue_empty_sample_points_are_dated_by_the_cache(sv_db):
+    sv_db.make_job_table()
+    stub = WorldPanoids()
+    cache = LookupCache(sv_db)
+    store_panos_from_sample_pts(SAMPLE_PTS, 'a', sv_db, lookup_func=stub, cache=cache, job_id='job')
+    stub.calls = 0
+    stats = refresh(sv_db, max_age_days=30, lookup_func=stub, job_id='job', cache=cache)
+    assert stats['anchors'] == 0 and stub.calls == 0
+    # Without the cache the empty sample points have no lookup date, so they are due
+    assert refresh(sv_db, max_age_days=30, lookup_func=stub, job_id='job')['anchors'] == 5
+
+def test_changed_areas_are_sampled_again(sv_db):
+    stub = WorldPanoids(radius=2e-4)
+    stub.panos.update({f'old_{i}': pt for i, pt in enumerate(SAMPLE_PTS)})
+    store_panos_from_sample_pts(SAMPLE_PTS, 'a', sv_db, lookup_func=stub)
+
+    # Halfway between two anchors, out of reach of both
+    stub.panos['new'] = (4.8015, 52.3)
+    changed_area = box(4.8012, 52.2998, 4.8018, 52.3002)
+    stats = refresh(sv_db, max_age_days=30, lookup_func=stub, changed_areas=changed_area, grid_resolution=10)
+    assert stats['new_panos'] == 1
+    assert 'new' in stored_ids(sv_db)
+    assert set(sv_db.get_records(columns=['subregion_name'])['subregion_name']) == {'a'}
+
+def test_new_panos_are_counted_once(sv_db):
+    stub = WorldPanoids(radius=2e-3)
+    store_panos_from_sample_pts(SAMPLE_PTS[:2], 'a', sv_db, lookup_func=lambda lat, lon: [
+        {'panoid': f'old_{lon}', 'lat': lat, 'lon': lon, 'year': 2019, 'month': 1}])
+
+    # Both anchors see the same new pano within one batch
+    stub.panos['new'] = (4.8005, 52.3)
+    stats = refresh(sv_db, max_age_days=0, lookup_func=stub)
+    assert stats['changed_anchors'] == 2
+    assert stats['new_panos'] == 1
+
+def test_backoff_doubles_the_age_of_unchanged_anchors(sv_db):
+    store_panos_from_sample_pts(SAMPLE_PTS[:1], 'a', sv_db, lookup_func=lambda lat, lon: [
+        {'panoid': 'old', 'lat': lat, 'lon': lon, 'year': 2019, 'month': 1}])
+    backoff = AnchorBackoff(sv_db)
+    backoff.record([('a', *SAMPLE_PTS[0], False)], lookup_date=str(date.today() - timedelta(days=45)))
+    # Due after 60 days instead of 30, as the last refresh found nothing
+    assert refresh(sv_db, max_age_days=30, lookup_func=WorldPanoids(), backoff=backoff)['anchors'] == 0
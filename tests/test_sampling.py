@@ -0,0 +1,106 @@
+from math import floor, ceil
+
+import numpy as np
+import pytest
+import shapely
+from pyproj import Transformer
+from shapely.geometry import LineString, MultiPoint, Point, Polygon
+
+from svdiscover import instrument
+from svdiscover.database import DONE, StreetviewDB
+from svdiscover.sampling import (get_transformer, grid_xy_in_poly, iter_grid_xy_in_poly, reproject_to_wgs, resume,
+                                 store_panos_from_sample_pts)
+
+def legacy_grid_xy(poly_geom, grid_resolution):
+    """Grid points of the original sample_pts_in_poly, which intersected the polygon with all points of its extent"""
+    xmin, ymin, xmax, ymax = poly_geom.bounds
+    xy_pairs = [(x, y) for x in range(floor(xmin), ceil(xmax), grid_resolution)
+                for y in range(floor(ymin), ceil(ymax), grid_resolution)]
+    sample_pts = poly_geom.intersection(MultiPoint(xy_pairs))
+    return sorted((pt.x, pt.y) for pt in getattr(sample_pts, 'geoms', [sample_pts]) if not pt.is_empty)
+
+POLYGONS = {
+    # Edges along grid lines put points exactly on the boundary, and on the edges of tiles
+    'l_shape': Polygon([(0, 0), (2000, 0), (2000, 1000), (1000, 1000), (1000, 2000), (0, 2000)]),
+    'road': LineString([(0, 0), (1000, 400), (1500, 1600), (3000, 1700)]).buffer(60, quad_segs=2),
+    'circle': Point(500, 500).buffer(700),
+}
+
+@pytest.mark.parametrize('name', POLYGONS)
+@pytest.mark.parametrize('tile_size', [1000, 7, 1])
+def test_grid_matches_legacy_for_any_tile_size(name, tile_size):
+    poly_geom = POLYGONS[name]
+    xy = grid_xy_in_poly(poly_geom, 10, tile_size)
+    assert sorted(map(tuple, xy.tolist())) == legacy_grid_xy(poly_geom, 10)
+
+def test_tiles_do_not_overlap():
+    xy = np.concatenate(list(iter_grid_xy_in_poly(POLYGONS['l_shape'], 10, tile_size=7)))
+    assert len(np.unique(xy, axis=0)) == len(xy)
+
+def test_input_geometry_is_not_prepared():
+    poly_geom = Point(0, 0).buffer(100)
+    grid_xy_in_poly(poly_geom, 10)
+    assert not shapely.is_prepared(poly_geom)
+
+def test_only_tiles_with_points_are_timed():
+    stats = instrument.enable()
+    try:
+        # Most tiles of the bounds of the road lie outside of it
+        xy_tiles = list(iter_grid_xy_in_poly(POLYGONS['road'], 10, tile_size=10))
+    finally:
+        instrument.disable()
+    sample_stats = stats.summary()['stages']['sample']
+    assert sample_stats['calls'] == len(xy_tiles)
+    assert sample_stats['rows'] == sum(map(len, xy_tiles))
+
+class CrashingPanoids():
+    """Lookup stub which records every finished lookup and crashes before the lookup after crash_after"""
+    def __init__(self, crash_after=None):
+        self.crash_after = crash_after
+        self.looked_up = []
+
+    def __call__(self, lat, lon):
+        if len(self.looked_up) == self.crash_after:
+            raise KeyboardInterrupt
+        self.looked_up.append((lon, lat))
+        return [{'panoid': f'pano_{lon:.5f}', 'lat': lat, 'lon': lon, 'year': 2020, 'month': 1}]
+
+def test_crashed_job_resumes_without_repeating_lookups(tmp_path):
+    db_path = str(tmp_path / 'panos.db')
+    sample_pts = [(4.8 + i * 1e-5, 52.3) for i in range(2500)]
+    sv_db = StreetviewDB(db_path)
+    sv_db.make_region_table('panos', set_target=True)
+    crashing = CrashingPanoids(crash_after=1500)
+    # The job table is made with its default name on first use
+    with pytest.raises(KeyboardInterrupt):
+        store_panos_from_sample_pts(sample_pts, 'a', sv_db, lookup_func=crashing, job_id='job', batch_size=100)
+    sv_db.db.close()
+
+    sv_db = StreetviewDB(db_path)
+    sv_db.make_region_table('panos', set_target=True)
+    resumed = CrashingPanoids()
+    # The last chunk of points was not registered before the crash, so the subregion is returned to be generated again
+    assert resume(sv_db, 'job', lookup_func=resumed) == ['a']
+    store_panos_from_sample_pts(sample_pts, 'a', sv_db, lookup_func=resumed, job_id='job', batch_size=100)
+
+    looked_up = crashing.looked_up + resumed.looked_up
+    assert len(looked_up) == len(set(looked_up)) == len(sample_pts)
+    assert sv_db.get_job_status('job') == {'a': DONE}
+    assert sv_db.cursor.execute('SELECT COUNT(*) FROM panos').fetchone()[0] == len(sample_pts)
+
+def test_reprojection_to_other_output_crs():
+    xy = np.array([[120000., 480000.], [121000., 487000.]])
+    expected = Transformer.from_crs('EPSG:28992', 'EPSG:3857', always_xy=True).transform(xy[:, 0], xy[:, 1])
+    np.testing.assert_allclose(reproject_to_wgs(xy, 'EPSG:28992', 'EPSG:3857'), np.column_stack(expected))
+    line = reproject_to_wgs(LineString(xy), 'EPSG:28992', 'EPSG:3857')
+    np.testing.assert_allclose(shapely.get_coordinates(line), np.column_stack(expected))
+
+def test_transformers_are_reused():
+    get_transformer.cache_clear()
+    xy = np.array([[120000., 480000.]])
+    for _ in range(3):
+        reproject_to_wgs(xy, 'EPSG:28992')
+    reproject_to_wgs(xy, 'EPSG:28992', 'EPSG:3857')
+    cache_info = get_transformer.cache_info()
+    assert cache_info.misses == 2 and cache_info.hits == 2
+    assert get_transformer('EPSG:28992') is get_transformer('EPSG:28992')